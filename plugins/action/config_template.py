@@ -23,13 +23,21 @@
 # 3. Changed to use iniparser instead of usage of outdated RawConfigParser
 
 import base64
+import copy
 import dataclasses
+import functools
+import hashlib
+import importlib
+import importlib.util
 import json
 import os
+import pickle
 import re
 import shutil
 import tempfile
 import typing
+from collections import ChainMap
+from collections.abc import MutableMapping
 from io import StringIO
 
 from ansible import constants as C
@@ -40,186 +48,665 @@ from ansible.plugins.action import ActionBase
 from ansible.template import generate_ansible_template_vars
 
 try:
-    from jsonpatch import JsonPatch
-except ImportError:
-    JsonPatch = None  # type: ignore[assignment,misc]
-try:
-    from iniparse import ini
-    from iniparse.utils import tidy as ini_tidy
-except ImportError:
-    ini = None  # type: ignore[assignment]
-    ini_tidy = None  # type: ignore[assignment]
-try:
-    import hjson
+    from ansible.module_utils.common.text.converters import to_bytes, to_text
 except ImportError:
-    hjson = None  # type: ignore[assignment]
+    # Compatibility with older ansible-core.
+    from ansible.module_utils._text import to_bytes, to_text
 try:
-    import tomlkit
+    from ansible.template import AnsibleNativeEnvironment
 except ImportError:
-    tomlkit = None  # type: ignore[assignment]
+    # ansible-core 2.19+ always renders native types
+    AnsibleNativeEnvironment = None  # type: ignore[assignment,misc]
 try:
-    from ruamel.yaml import YAML
+    from ansible.template import trust_as_template
 except ImportError:
-    YAML = None  # type: ignore[assignment,misc]
+    # ansible-core < 2.19 templates any string
+    def trust_as_template(value):  # type: ignore[no-redef]
+        return value
+
+
+@functools.lru_cache(maxsize=None)
+def optional_import(name: str) -> typing.Any:
+    """Import optional dependency on first use, None if it is not installed.
+
+    Ansible imports action plugins in every worker for every task, so parser
+    backends are imported only when their config_type is used.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def __getattr__(name: str) -> typing.Any:
+    # lazily imported names, also used by pickle to find INIConfig
+    if name in ("OptionLine", "INIConfig"):
+        classes = _ini_classes()
+        if name in classes:
+            return classes[name]
+    elif name in ("orjson", "hjson", "tomlkit"):
+        return optional_import(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-try:
-    from ansible.module_utils.common.text.converters import to_bytes, to_text
-except ImportError:
-    # Compatibility with older ansible-core.
-    from ansible.module_utils._text import to_bytes, to_text
 
 _DocT = typing.Union[dict, list]
+# Rendered template: text, or already a document when rendered natively
+_ResultantT = typing.Union[str, _DocT]
+
+
+@dataclasses.dataclass(frozen=True)
+class JsonBackend:
+    """JSON parser/serializer pair used by config_type=json/hjson and jsonnet.
+
+    Serialization output must be byte-identical to the stdlib ``json.dumps``
+    for the same ``indent``/``sort_keys``, so backends only differ in speed.
+    """
+
+    name: str
+    loads: typing.Callable[[typing.Union[str, bytes]], typing.Any]
+    dumps: typing.Callable[[typing.Any, typing.Optional[int], bool], str]
+
+
+def _stdlib_json_dumps(
+    obj: typing.Any, indent: typing.Optional[int] = None, sort_keys: bool = False
+) -> str:
+    return json.dumps(obj, indent=indent, sort_keys=sort_keys)
+
+
+# NOTE(vermakov): orjson silently converts integers outside of int64/uint64
+# to float; every such integer has at least 19 digits (-9223372036854775809).
+# Digits in strings or fractions only cause a needless stdlib parse.
+_JSON_BIGINT_RE = re.compile(r"-?\d{19,}")
+_JSON_BIGINT_BYTES_RE = re.compile(rb"-?\d{19,}")
+
+
+def _orjson_loads(resultant: typing.Union[str, bytes]) -> typing.Any:
+    if isinstance(resultant, str):
+        bigint = _JSON_BIGINT_RE.search(resultant) is not None
+    else:
+        bigint = _JSON_BIGINT_BYTES_RE.search(resultant) is not None
+    if bigint:
+        return json.loads(resultant)
+    orjson = optional_import("orjson")
+    try:
+        return orjson.loads(resultant)
+    except orjson.JSONDecodeError:
+        # orjson is stricter than stdlib (NaN, Infinity, lone surrogates),
+        # keep accepting everything that json.loads accepts.
+        return json.loads(resultant)
+
+
+JSON_BACKENDS: typing.Dict[str, JsonBackend] = {
+    "json": JsonBackend("json", json.loads, _stdlib_json_dumps),
+}
+
+if importlib.util.find_spec("orjson") is not None:
+    # NOTE(vermakov): orjson.dumps() differs in float formatting, ensure_ascii
+    # and separators, so only parsing is accelerated.
+    JSON_BACKENDS["orjson"] = JsonBackend("orjson", _orjson_loads, _stdlib_json_dumps)
+
+_JSON_BACKENDS_PRIORITY = ["orjson", "json"]
+
+
+def register_json_backend(backend: JsonBackend, preferred: bool = False) -> None:
+    """Add backend to the registry, optionally making it the auto choice."""
+    JSON_BACKENDS[backend.name] = backend
+    if backend.name in _JSON_BACKENDS_PRIORITY:
+        _JSON_BACKENDS_PRIORITY.remove(backend.name)
+    if preferred:
+        _JSON_BACKENDS_PRIORITY.insert(0, backend.name)
+    else:
+        _JSON_BACKENDS_PRIORITY.insert(len(_JSON_BACKENDS_PRIORITY) - 1, backend.name)
+
+
+def get_json_backend(name: str = "auto") -> JsonBackend:
+    """Return the named backend, or the fastest available one for 'auto'."""
+    if name == "auto":
+        for candidate in _JSON_BACKENDS_PRIORITY:
+            if candidate in JSON_BACKENDS:
+                return JSON_BACKENDS[candidate]
+
+    try:
+        return JSON_BACKENDS[name]
+    except KeyError:
+        raise AnsibleActionFail(
+            f"Unsupported json_backend: {name}. Valid options are"
+            f" auto, {', '.join(sorted(JSON_BACKENDS))}."
+        ) from None
+
+
+def hjson_loads(
+    resultant: str, backend: typing.Optional[JsonBackend] = None
+) -> typing.Any:
+    """Parse HJSON, trying the strict JSON backend first as it's much faster."""
+    if backend is None:
+        backend = get_json_backend()
+
+    try:
+        return backend.loads(resultant)
+    except ValueError:
+        pass
+
+    hjson = optional_import("hjson")
+    if hjson is None:
+        raise AnsibleActionFail(
+            "hjson python package is required for config_type=hjson"
+        )
+    return hjson.loads(resultant)
+
+
+class RunCache:
+    """Cache shared by all forks of one ansible run.
 
+    Every task on every host runs in a freshly forked worker, so a plain
+    module level dict lives only as long as one task on one host. Entries are
+    also pickled to the controller temporary directory (C.DEFAULT_LOCAL_TMP),
+    which is created once per run and removed when the run ends.
 
-if ini is not None:
+    get() returns a private copy of the value, unless shared=True is requested,
+    in which case the same object is returned for every call in the process
+    and the caller must not modify it.
 
-    class OptionLine(ini.OptionLine):
-        indent = ""
+    With root set, the cache is kept in that directory across runs and the
+    least recently used entries above max_entries are evicted. Such entries
+    are stored as JSON, not pickled, and are used only while the directory
+    is writable by the controller user alone.
+    """
 
-        regex = re.compile(
-            r"^(?P<indent>[\s]*)"
-            r"(?P<name>[^:=\s[][^:=]*)"
-            r"(?P<sep>[:=]\s*)"
-            r"(?P<value>.*)$"
+    def __init__(
+        self,
+        namespace: str,
+        root: typing.Optional[str] = None,
+        max_entries: typing.Optional[int] = None,
+    ):
+        self.namespace = namespace
+        self.root = root
+        self.max_entries = max_entries
+        self._blobs: typing.Dict[str, bytes] = {}
+        self._objects: typing.Dict[str, typing.Any] = {}
+        self._private = False
+
+    @staticmethod
+    def make_key(*parts: typing.Union[str, bytes]) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(
+            self.root or C.DEFAULT_LOCAL_TMP, f"vooon_config_{self.namespace}"
         )
 
-        indent_regex = re.compile(r"^(?P<indent>[\s]*)")
+    def _is_private(self) -> bool:
+        """True unless root is set and others can write to the cache dir"""
+        if self.root is None or self._private:
+            return True
 
-        def to_string(self) -> str:
-            return self.indent + super().to_string()
+        def private(path: str) -> bool:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            return st.st_uid == os.getuid() and not st.st_mode & 0o022
 
-        @classmethod
-        def parse(cls, line: str) -> typing.Optional["OptionLine"]:
-            instance = super().parse(line)
-            if instance is not None:
-                m = cls.indent_regex.match(line)
-                if m:
-                    instance.indent = m.group("indent")
-
-            return instance
-
-    class INIConfig(ini.INIConfig):
-        _line_types = [
-            ini.EmptyLine,
-            ini.CommentLine,
-            ini.SectionLine,
-            OptionLine,
-            ini.ContinuationLine,
-        ]
-        _injected_default_section: bool = False
+        self._private = private(self.root) and private(self.path)
+        return self._private
 
-        @classmethod
-        def from_string(
-            cls, resultant: str, source: str = "<???>", **kwargs
-        ) -> "INIConfig":
-            if resultant.endswith("\n"):
-                resultant = resultant[0:-1]
+    def verify_root(self) -> None:
+        """Create the root cache dir, fail if others can write to it"""
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+        except OSError as e:
+            raise AnsibleActionFail(f"cannot create cache dir {self.path}: {e}")
+        if not self._is_private():
+            raise AnsibleActionFail(
+                f"cache dir {self.path} must be owned by the controller user"
+                " and not writable by group or others"
+            )
 
-            ini.DEFAULTSECT = "@@disable_default_section_special_handling"
-            ini.change_comment_syntax(";#", allow_rem=False)
+    def _load_blob(self, key: str) -> typing.Optional[bytes]:
+        blob = self._blobs.get(key)
+        if blob is None:
+            if not self._is_private():
+                return None
+            path = os.path.join(self.path, key)
+            try:
+                with open(path, "rb") as f:
+                    blob = f.read()
+                if self.max_entries:
+                    os.utime(path)  # mtime orders the eviction
+            except OSError:
+                return None
+            self._blobs[key] = blob
+
+        return blob
+
+    def get(self, key: str, shared: bool = False) -> typing.Any:
+        """Return cached value or raise KeyError"""
+        if shared and key in self._objects:
+            return self._objects[key]
+
+        blob = self._load_blob(key)
+        if blob is None:
+            raise KeyError(key)
+
+        if self.root is None:
+            value = pickle.loads(blob)
+        else:
+            try:
+                value = json.loads(blob)
+            except ValueError:
+                raise KeyError(key)  # not ours
+        if shared:
+            self._objects[key] = value
+        return value
+
+    def set(self, key: str, value: typing.Any) -> None:
+        try:
+            if self.root is None:
+                blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                blob = json.dumps(value).encode("utf-8")
+        except (
+            pickle.PicklingError,
+            TypeError,
+            ValueError,
+            AttributeError,
+            RecursionError,
+        ):
+            return  # not cacheable, not an error
 
-            buf = StringIO(resultant)
-            buf.name = source
+        self._blobs[key] = blob
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            if not self._is_private():
+                return
+            fd, tmp_path = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp_path, os.path.join(self.path, key))
+            if self.max_entries:
+                self._evict(self.max_entries)
+        except OSError:
+            pass  # other forks just parse again
+
+    def _evict(self, max_entries: int) -> None:
+        """Remove the least recently used entries above max_entries"""
+        with os.scandir(self.path) as it:
+            entries = [entry for entry in it if entry.is_file()]
+        if len(entries) <= max_entries:
+            return
+
+        def mtime(entry: os.DirEntry) -> int:
+            try:
+                return entry.stat().st_mtime_ns
+            except OSError:
+                return 0  # removed meanwhile
 
+        entries.sort(key=mtime)
+        for entry in entries[: len(entries) - max_entries]:
             try:
-                instance = cls(buf, optionxformvalue=str, **kwargs)
-            except ini.MissingSectionHeaderError:
-                # Fallback for .env like files used by systemd
-                buf.seek(0)
-                buf.write("[DEFAULT]\n")
-                buf.write(resultant)
-                buf.seek(0)
-
-                instance = cls(buf, optionxformvalue=str, **kwargs)
-                instance._injected_default_section = True
-
-            return instance
-
-        def to_string(self) -> str:
-            resultant = str(self)
-            if self._injected_default_section:
-                resultant = "\n".join(resultant.splitlines()[1:])
-
-            if not resultant.endswith("\n"):
-                resultant += "\n"
-
-            return resultant
-
-        def merge_repeated_options(self) -> None:
-            for section_name in list(self):
-                section = self[section_name]
-                for container in section._lines:
-                    if not isinstance(container, ini.LineContainer):
-                        continue
-
-                    to_drop: typing.List[int] = []
-                    for idx, line in enumerate(container.contents):
-                        if not isinstance(line, ini.LineContainer):
+                os.unlink(entry.path)
+            except OSError:
+                pass  # evicted by another fork
+
+    def clear(self) -> None:
+        self._blobs.clear()
+        self._objects.clear()
+
+
+# parsed static (render_template=false) base documents
+BASE_CACHE = RunCache("base")
+
+
+def template_vars(
+    task_vars: typing.Mapping[str, typing.Any],
+    path: typing.Optional[str],
+    fullpath: str,
+    dest_path: typing.Optional[str],
+) -> typing.MutableMapping[str, typing.Any]:
+    """Return task_vars with the ansible template vars added.
+
+    task_vars (hostvars, groups, facts) may have thousands of keys, so
+    instead of copying it for every task the template vars are overlaid
+    on top of it. Writes go to the overlay, task_vars is never modified.
+    """
+    # NOTE in the case of ANSIBLE_DEBUG=1 task_vars is VarsWithSources(MutableMapping),
+    # ChainMap accepts any mapping
+    return ChainMap(
+        generate_ansible_template_vars(path, fullpath, dest_path),
+        task_vars,  # type: ignore[arg-type]
+    )
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def render_only_file(root: str, host: str, dest: str, src: str) -> dict:
+    """Store local file src as <root>/<host>/<dest> instead of a transfer.
+
+    Files are deduplicated by content: each distinct content is stored once
+    in <root>/.objects and hostname paths are hardlinks to it, so rendering
+    the same config for thousands of hosts costs one write per variant.
+    """
+    if not host or host in (".", "..") or os.sep in host:
+        raise AnsibleActionFail(f"Host name {host!r} can not be a directory name")
+    if dest.startswith("~"):
+        raise AnsibleActionFail(
+            f"[ dest ] {dest} is relative to a remote home directory,"
+            " [ render_only_to ] does not connect to the host to expand it"
+        )
+    host_root = os.path.join(os.path.abspath(root), host)
+    target = os.path.normpath(os.path.join(host_root, dest.lstrip("/")))
+    if dest.endswith("/"):
+        target = os.path.join(target, os.path.basename(src))
+    if not target.startswith(host_root + os.sep):
+        raise AnsibleActionFail(f"[ dest ] {dest} is outside of [ render_only_to ]")
+
+    digest = _file_sha256(src)
+    objects = os.path.join(os.path.abspath(root), ".objects", digest[:2])
+    obj = os.path.join(objects, digest)
+    result = {"dest": target, "config_sha256": digest, "changed": True}
+    try:
+        os.makedirs(objects, exist_ok=True)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not os.path.exists(obj):
+            # concurrent forks may write the same object, content is equal
+            fd, tmp_path = tempfile.mkstemp(dir=objects)
+            os.close(fd)
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, obj)
+
+        if os.path.exists(target) and os.path.samefile(target, obj):
+            result["changed"] = False
+            return result
+
+        tmp_path = os.path.join(os.path.dirname(target), f".{digest}.{os.getpid()}")
+        try:
+            os.link(obj, tmp_path)
+        except OSError:  # no hardlinks on the filesystem
+            shutil.copyfile(obj, tmp_path)
+        os.replace(tmp_path, target)
+    except OSError as ex:
+        raise AnsibleActionFail(f"Failed to write {target}: {ex}") from ex
+
+    return result
+
+
+def _canonical_key(key: typing.Any) -> typing.Tuple[bool, str]:
+    return not isinstance(key, str), str(key)
+
+
+def canonical_data(document: typing.Any) -> typing.Any:
+    """Return document as plain python types with sorted mapping keys.
+
+    ruamel.yaml and tomlkit round-trip types keep the formatting state of the
+    parsed source, plain types serialize the same for equal data.
+    """
+    if hasattr(document, "unwrap"):  # tomlkit
+        document = document.unwrap()
+
+    if isinstance(document, typing.Mapping):
+        return {
+            key: canonical_data(document[key])
+            for key in sorted(document, key=_canonical_key)
+        }
+    elif isinstance(document, (list, tuple)):
+        return [canonical_data(item) for item in document]
+    elif isinstance(document, bool):
+        return bool(document)
+    elif isinstance(document, int):
+        return int(document)
+    elif isinstance(document, float):
+        return float(document)
+    elif isinstance(document, str):
+        return str(document)
+
+    return document
+
+
+# digests of JSON Schemas that passed the meta-schema check
+SCHEMA_CACHE = RunCache("schema")
+
+# errors listed in the failure message
+SCHEMA_MAX_ERRORS = 10
+
+
+@functools.lru_cache(maxsize=32)
+def compile_schema(schema_json: str) -> typing.Any:
+    """Return a jsonschema validator for the schema (canonical JSON text).
+
+    The meta-schema check is the expensive part of compilation, so schemas
+    that passed it are remembered for the whole run in SCHEMA_CACHE.
+    """
+    jsonschema = optional_import("jsonschema")
+    if jsonschema is None:
+        raise AnsibleActionFail("[ schema ] requires the jsonschema python library")
+
+    schema = json.loads(schema_json)
+    cls = jsonschema.validators.validator_for(schema)
+    key = RunCache.make_key(cls.__name__, schema_json)
+    try:
+        SCHEMA_CACHE.get(key, shared=True)
+    except KeyError:
+        try:
+            cls.check_schema(schema)
+        except jsonschema.SchemaError as ex:
+            raise AnsibleActionFail(
+                f"[ schema ] is not a valid JSON Schema: {ex.message}"
+            ) from ex
+        SCHEMA_CACHE.set(key, True)
+
+    return cls(schema, format_checker=cls.FORMAT_CHECKER)
+
+
+def schema_errors(validator: typing.Any, document: typing.Any) -> typing.List[str]:
+    """Return validation errors of document as "<json pointer>: <message>\""""
+
+    def pointer(error: typing.Any) -> str:
+        return "".join(
+            "/" + str(part).replace("~", "~0").replace("/", "~1")
+            for part in error.absolute_path
+        )
+
+    return sorted(
+        f"{pointer(error) or '/'}: {error.message}"
+        for error in validator.iter_errors(document)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _ini_classes() -> typing.Dict[str, typing.Any]:
+    """Define iniparse based classes on first use"""
+    ini: typing.Any = optional_import("iniparse.ini")
+    if ini is not None:
+        ini_tidy = optional_import("iniparse.utils").tidy
+
+        # NOTE(vermakov): iniparse keeps its settings in module globals. The
+        # DEFAULT section handling is disabled once, here, and comment syntax
+        # is a property of our CommentLine, so parsing is re-entrant and may
+        # run in threads.
+        ini.DEFAULTSECT = "@@disable_default_section_special_handling"
+
+        class CommentLine(ini.CommentLine):
+            # ini.change_comment_syntax(";#", allow_rem=False)
+            regex = re.compile(r"^(?P<csep>[;#])(?P<comment>.*)$")
+
+        class OptionLine(ini.OptionLine):
+            indent = ""
+
+            regex = re.compile(
+                r"^(?P<indent>[\s]*)"
+                r"(?P<name>[^:=\s[][^:=]*)"
+                r"(?P<sep>[:=]\s*)"
+                r"(?P<value>.*)$"
+            )
+
+            indent_regex = re.compile(r"^(?P<indent>[\s]*)")
+
+            def to_string(self) -> str:
+                return self.indent + super().to_string()
+
+            @classmethod
+            def parse(cls, line: str) -> typing.Optional["OptionLine"]:
+                instance = super().parse(line)
+                if instance is not None:
+                    m = cls.indent_regex.match(line)
+                    if m:
+                        instance.indent = m.group("indent")
+
+                return instance
+
+        class INIConfig(ini.INIConfig):
+            _line_types = [
+                ini.EmptyLine,
+                CommentLine,
+                ini.SectionLine,
+                OptionLine,
+                ini.ContinuationLine,
+            ]
+            _injected_default_section: bool = False
+
+            @classmethod
+            def from_string(
+                cls, resultant: str, source: str = "<???>", **kwargs
+            ) -> "INIConfig":
+                if resultant.endswith("\n"):
+                    resultant = resultant[0:-1]
+
+                buf = StringIO(resultant)
+                buf.name = source
+
+                try:
+                    instance = cls(buf, optionxformvalue=str, **kwargs)
+                except ini.MissingSectionHeaderError:
+                    # Fallback for .env like files used by systemd
+                    buf.seek(0)
+                    buf.write("[DEFAULT]\n")
+                    buf.write(resultant)
+                    buf.seek(0)
+
+                    instance = cls(buf, optionxformvalue=str, **kwargs)
+                    instance._injected_default_section = True
+
+                return instance
+
+            def to_string(self) -> str:
+                resultant = str(self)
+                if self._injected_default_section:
+                    resultant = "\n".join(resultant.splitlines()[1:])
+
+                if not resultant.endswith("\n"):
+                    resultant += "\n"
+
+                return resultant
+
+            def merge_repeated_options(self) -> None:
+                for section_name in list(self):
+                    section = self[section_name]
+                    for container in section._lines:
+                        if not isinstance(container, ini.LineContainer):
                             continue
 
-                        opt = section._options[line.get_name()]
-                        if line is not opt:
-                            to_drop.append(idx)
-                            opt.extend(line.contents)
-                            opt.contents.sort(key=lambda x: x.line_number)
-
-                    for idx in sorted(to_drop, reverse=True):
-                        del container.contents[idx]
-
-        def tidy(self):
-            ini_tidy(self)
-
-        def as_dict(self) -> typing.Dict[str, dict]:
-            def yield_section(
-                sect,
-            ) -> typing.Generator[typing.Tuple[str, typing.Any], None, None]:
-                for name in sect:
-                    v = sect[name]
-                    if isinstance(v, str) and "\n" in v:
-                        yield name, v.splitlines()
-                        continue
-                    yield name, v
-
-            return {section: dict(yield_section(self[section])) for section in self}
-
-        def set_option(
-            self,
-            section: str,
-            key: str,
-            value: typing.Any,
-            args: typing.Optional["TaskArgs"] = None,
-        ):
-            if args is None:
-                args = TaskArgs()
+                        to_drop: typing.List[int] = []
+                        for idx, line in enumerate(container.contents):
+                            if not isinstance(line, ini.LineContainer):
+                                continue
 
-            if isinstance(value, list):
-                value = args.ini_list_sep.join(to_text(item) for item in value)
-            elif isinstance(value, dict):
-                value = json.dumps(value, sort_keys=True)
+                            opt = section._options[line.get_name()]
+                            if line is not opt:
+                                to_drop.append(idx)
+                                opt.extend(line.contents)
+                                opt.contents.sort(key=lambda x: x.line_number)
 
-            xkey = key.strip()
-            ind_idx = key.index(xkey)
-            if ind_idx > 0:
-                indent = key[0:ind_idx]
+                        for idx in sorted(to_drop, reverse=True):
+                            del container.contents[idx]
 
-                if section not in self:
-                    self._new_namespace(section)
+            def tidy(self):
+                ini_tidy(self)
 
-                sec = self[section]
-                if xkey in sec:
-                    sec[xkey] = value  # keep indentation
-                else:
-                    # See ini.INISection.__setitem__
-                    ol = OptionLine(xkey, value)
-                    ol.indent = indent
-                    obj = ini.LineContainer(ol)
-                    sec._lines[-1].add(obj)
-                    sec._options[xkey] = obj
+            def to_canonical_string(self, default_section: str = "DEFAULT") -> str:
+                """Render sections and options sorted, without comments.
 
-            else:
-                self[section][key] = value
+                Multi-line values are written as repeated options.
+                """
+                sections = self.as_dict()
+                lines: typing.List[str] = []
+                for section in sorted(
+                    sections, key=lambda s: (s != default_section, s)
+                ):
+                    if lines:
+                        lines.append("")
+                    if not (self._injected_default_section and section == "DEFAULT"):
+                        lines.append(f"[{section}]")
+                    for key, value in sorted(sections[section].items()):
+                        for item in value if isinstance(value, list) else [value]:
+                            lines.append(f"{key} = {item}".rstrip())
+
+                return "\n".join(lines) + "\n"
+
+            def as_dict(self) -> typing.Dict[str, dict]:
+                def yield_section(
+                    sect,
+                ) -> typing.Generator[typing.Tuple[str, typing.Any], None, None]:
+                    for name in sect:
+                        v = sect[name]
+                        if isinstance(v, str) and "\n" in v:
+                            yield name, v.splitlines()
+                            continue
+                        yield name, v
+
+                return {section: dict(yield_section(self[section])) for section in self}
+
+            def set_option(
+                self,
+                section: str,
+                key: str,
+                value: typing.Any,
+                args: typing.Optional["TaskArgs"] = None,
+            ):
+                if args is None:
+                    args = TaskArgs()
+
+                if isinstance(value, list):
+                    value = args.ini_list_sep.join(to_text(item) for item in value)
+                elif isinstance(value, dict):
+                    value = json.dumps(value, sort_keys=True)
+
+                xkey = key.strip()
+                ind_idx = key.index(xkey)
+                if ind_idx > 0:
+                    indent = key[0:ind_idx]
+
+                    if section not in self:
+                        self._new_namespace(section)
+
+                    sec = self[section]
+                    if xkey in sec:
+                        sec[xkey] = value  # keep indentation
+                    else:
+                        # See ini.INISection.__setitem__
+                        ol = OptionLine(xkey, value)
+                        ol.indent = indent
+                        obj = ini.LineContainer(ol)
+                        sec._lines[-1].add(obj)
+                        sec._options[xkey] = obj
 
-else:
+                else:
+                    self[section][key] = value
+
+        # module level names, so that parsed documents can be pickled
+        OptionLine.__qualname__ = "OptionLine"
+        INIConfig.__qualname__ = "INIConfig"
+        return {"OptionLine": OptionLine, "INIConfig": INIConfig}
 
     class INIConfig:  # type: ignore[no-redef]
         @classmethod
@@ -229,61 +716,850 @@ else:
                 "iniparse python package is required for config_type=ini"
             )
 
+    return {"INIConfig": INIConfig}
+
+
+_SIMPLE_MERGE_SPLIT_RE = re.compile(",|\n")
+_MISSING = object()
+
 
 @dataclasses.dataclass
 class SimpleMerger:
     new_items: _DocT
     list_extend: bool = True
     yml_multilines: bool = False
+    split_strings: bool = True  # "a,b" -> ["a", "b"]
 
     def apply(self, base_items: _DocT, in_place: bool = True) -> _DocT:
-        """Recursively merge new_items into base_items."""
-        if isinstance(self.new_items, dict):
-            for key, value in self.new_items.items():
-                if isinstance(value, dict):
-                    base_items[key] = SimpleMerger(
-                        value, self.list_extend, self.yml_multilines
-                    ).apply(
-                        base_items.get(key, {})  # type: ignore
-                    )
+        """Merge new_items into base_items.
 
-                elif isinstance(value, str) and (
-                    "," in value or ("\n" in value and not self.yml_multilines)
+        With in_place=False base_items is left intact: only the containers
+        touched by new_items are copied, untouched branches are shared with
+        base_items.
+        """
+        # NOTE: lists of new_items are copied into the document, a later
+        # layer extends or patches them in place and new_items are reused by
+        # every host and loop item of the task
+        if isinstance(self.new_items, list):
+            if not self.list_extend:
+                return copy.deepcopy(self.new_items)
+            if not in_place:
+                base_items = copy.copy(base_items)
+            base_items.extend(copy.deepcopy(self.new_items))  # type: ignore
+            return base_items
+
+        if not isinstance(self.new_items, dict):
+            return base_items
+
+        if not in_place:
+            base_items = copy.copy(base_items)
+
+        # iterative walk over (new_items, target) pairs, target is owned by us
+        stack: typing.List[typing.Tuple[dict, typing.Any]] = [
+            (self.new_items, base_items)
+        ]
+        while stack:
+            new_items, target = stack.pop()
+            for key, value in new_items.items():
+                if isinstance(value, dict):
+                    child = target.get(key, _MISSING)
+                    if child is _MISSING:
+                        child = {}
+                    elif not value:
+                        continue  # nothing to merge
+                    elif not isinstance(child, MutableMapping):
+                        child = {}
+                    elif not in_place:
+                        child = copy.copy(child)
+
+                    target[key] = child
+                    if value:
+                        stack.append((value, child))
+
+                elif (
+                    self.split_strings
+                    and isinstance(value, str)
+                    and ("," in value or ("\n" in value and not self.yml_multilines))
                 ):
-                    base_items[key] = re.split(",|\n", value)
-                    base_items[key] = [i.strip() for i in base_items[key] if i]
-                elif isinstance(value, list):
-                    if isinstance(base_items.get(key), list) and self.list_extend:  # type: ignore
-                        base_items[key].extend(value)
+                    target[key] = [
+                        i.strip() for i in _SIMPLE_MERGE_SPLIT_RE.split(value) if i
+                    ]
+                elif isinstance(value, (list, tuple, set)):
+                    value = copy.deepcopy(value)
+                    current = target.get(key)
+                    if not self.list_extend:
+                        target[key] = value
+                    elif isinstance(current, list):
+                        if not in_place:
+                            current = copy.copy(current)
+                        current.extend(value)
+                        target[key] = current
+                    elif isinstance(current, tuple) and not isinstance(value, list):
+                        target[key] = current + tuple(value)
                     else:
-                        base_items[key] = value
-                elif isinstance(value, (tuple, set)):
-                    if isinstance(base_items.get(key), tuple) and self.list_extend:  # type: ignore
-                        base_items[key] += tuple(value)
-                    elif isinstance(base_items.get(key), list) and self.list_extend:  # type: ignore
-                        base_items[key].extend(list(value))
-                    else:
-                        base_items[key] = value
+                        target[key] = value
                 else:
-                    base_items[key] = self.new_items[key]
+                    target[key] = value
+
+        return base_items
+
+
+_JSON_POINTER_INDEX_RE = re.compile(r"0|[1-9][0-9]*")
+
+
+class PatchPlan:
+    """Compiled RFC 6902 JSON Patch.
+
+    Pointers are parsed once at compile time. On apply, containers are
+    resolved through a prefix tree shared by all operations, so operations
+    under a common prefix do not walk the document from the root again.
+    With in_place=False only the touched containers are copied, the rest is
+    shared with the base document.
+    """
+
+    OPS = ("add", "remove", "replace", "move", "copy", "test")
+
+    def __init__(self, operations: list):
+        jsonpointer = optional_import("jsonpointer")  # dependency of jsonpatch
+        if jsonpointer is None:
+            raise AnsibleActionFail(
+                "jsonpatch python package is required for JSON Patch overrides"
+            )
+
+        self.steps: typing.List[tuple] = []
+        for idx, operation in enumerate(operations):
+            if not isinstance(operation, dict) or operation.get("op") not in self.OPS:
+                raise AnsibleActionFail(
+                    f"JSON Patch operation #{idx} is invalid: {operation!r}"
+                )
+            op = operation["op"]
+            try:
+                parts = tuple(jsonpointer.JsonPointer(operation["path"]).parts)
+                from_parts = None
+                if op in ("move", "copy"):
+                    from_parts = tuple(jsonpointer.JsonPointer(operation["from"]).parts)
+            except (KeyError, jsonpointer.JsonPointerException) as ex:
+                raise AnsibleActionFail(
+                    f"JSON Patch operation #{idx} is invalid: {ex}"
+                ) from ex
+
+            if op in ("add", "replace", "test") and "value" not in operation:
+                raise AnsibleActionFail(
+                    f"JSON Patch operation #{idx} '{op}' requires 'value'"
+                )
+            if op == "move" and parts[: len(from_parts)] == from_parts:  # type: ignore[arg-type]
+                if parts != from_parts:
+                    raise AnsibleActionFail(
+                        f"JSON Patch operation #{idx} cannot move a value into itself"
+                    )
+
+            self.steps.append(
+                (idx, op, operation["path"], parts, from_parts, operation.get("value"))
+            )
+
+    def apply(self, base_items: typing.Any, in_place: bool = True) -> typing.Any:
+        return _PatchRun(base_items, in_place).run(self.steps)
+
+
+class _PatchRun:
+    """State of a single PatchPlan.apply()"""
+
+    def __init__(self, document: typing.Any, in_place: bool):
+        self.in_place = in_place
+        # containers copied by this run, kept referenced so ids stay unique
+        self.owned: typing.Dict[int, typing.Any] = {}
+        # prefix tree: [container, {token: child node}]
+        self.root: list = [self._own(document), {}]
+
+    def _own(self, value: typing.Any) -> typing.Any:
+        if self.in_place or not isinstance(value, (MutableMapping, list)):
+            return value
+        if id(value) not in self.owned:
+            value = copy.copy(value)
+            self.owned[id(value)] = value
+        return value
+
+    @staticmethod
+    def _index(container: list, token: str, allow_end: bool = False) -> int:
+        if allow_end and token == "-":
+            return len(container)
+        if not _JSON_POINTER_INDEX_RE.fullmatch(token):
+            raise ValueError(f"invalid list index {token!r}")
+        idx = int(token)
+        if idx > len(container) or (idx == len(container) and not allow_end):
+            raise IndexError(f"list index {idx} out of range")
+        return idx
+
+    def _node(self, parts: typing.Sequence[str]) -> list:
+        node = self.root
+        for token in parts:
+            child = node[1].get(token)
+            if child is None:
+                container = node[0]
+                if isinstance(container, list):
+                    idx = self._index(container, token)
+                    value = container[idx]
+                    owned = self._own(value)
+                    if owned is not value:
+                        container[idx] = owned
+                elif isinstance(container, MutableMapping):
+                    value = container[token]
+                    owned = self._own(value)
+                    if owned is not value:
+                        container[token] = owned
+                else:
+                    raise KeyError(token)
+
+                child = node[1][token] = [owned, {}]
+            node = child
+
+        return node
+
+    @classmethod
+    def _equal(cls, first: typing.Any, second: typing.Any) -> bool:
+        # RFC 6902, 4.6: true and false are only equal to themselves
+        if isinstance(first, bool) or isinstance(second, bool):
+            return type(first) is type(second) and first == second
+        if isinstance(first, MutableMapping) and isinstance(second, MutableMapping):
+            return len(first) == len(second) and all(
+                key in second and cls._equal(value, second[key])
+                for key, value in first.items()
+            )
+        if isinstance(first, list) and isinstance(second, list):
+            return len(first) == len(second) and all(
+                cls._equal(a, b) for a, b in zip(first, second)
+            )
+        return first == second
+
+    def _get(self, parts: typing.Sequence[str]) -> typing.Any:
+        if not parts:
+            return self.root[0]
+        container = self._node(parts[:-1])[0]
+        if isinstance(container, list):
+            return container[self._index(container, parts[-1])]
+        return container[parts[-1]]
+
+    def _add(self, parts: typing.Sequence[str], value: typing.Any) -> None:
+        if not parts:
+            self.root = [self._own(value), {}]
+            return
+
+        node = self._node(parts[:-1])
+        container, token = node[0], parts[-1]
+        if isinstance(container, list):
+            container.insert(self._index(container, token, allow_end=True), value)
+            node[1].clear()  # indexes shifted
+        elif isinstance(container, MutableMapping):
+            container[token] = value
+            node[1].pop(token, None)
+        else:
+            raise TypeError("parent is not a container")
+
+    def _remove(self, parts: typing.Sequence[str]) -> typing.Any:
+        if not parts:
+            raise ValueError("cannot remove the whole document")
+
+        node = self._node(parts[:-1])
+        container, token = node[0], parts[-1]
+        if isinstance(container, list):
+            value = container.pop(self._index(container, token))
+            node[1].clear()
+        else:
+            value = container[token]
+            del container[token]
+            node[1].pop(token, None)
+        return value
+
+    def _replace(self, parts: typing.Sequence[str], value: typing.Any) -> None:
+        if not parts:
+            self.root = [self._own(value), {}]
+            return
+
+        node = self._node(parts[:-1])
+        container, token = node[0], parts[-1]
+        if isinstance(container, list):
+            container[self._index(container, token)] = value
+        else:
+            if token not in container:
+                raise KeyError(token)
+            container[token] = value
+        node[1].pop(token, None)
+
+    def run(self, steps: typing.List[tuple]) -> typing.Any:
+        for idx, op, path, parts, from_parts, value in steps:
+            try:
+                if op == "add":
+                    self._add(parts, copy.deepcopy(value))
+                elif op == "remove":
+                    self._remove(parts)
+                elif op == "replace":
+                    self._replace(parts, copy.deepcopy(value))
+                elif op == "move":
+                    if from_parts == parts:
+                        self._get(from_parts)  # must still exist
+                    else:
+                        self._add(parts, self._remove(from_parts))
+                elif op == "copy":
+                    self._add(parts, copy.deepcopy(self._get(from_parts)))
+                elif op == "test":
+                    if not self._equal(self._get(parts), value):
+                        raise ValueError("test failed")
+            except (KeyError, IndexError, TypeError, ValueError) as ex:
+                raise AnsibleActionFail(
+                    f"JSON Patch operation #{idx} '{op}' on {path!r} failed: {ex}"
+                ) from ex
+
+        return self.root[0]
+
+
+# compiled JSON Patch overrides
+PLAN_CACHE = RunCache("plan")
+
+
+# base documents with config_overrides_layers applied
+LAYER_CACHE = RunCache("layer")
 
-        elif isinstance(self.new_items, list):
-            if self.list_extend:
-                base_items.extend(self.new_items)  # type: ignore
-            else:
-                base_items = self.new_items
+
+@dataclasses.dataclass
+class _OriginNode:
+    """Key of LayeredPatcher.origins: label of the layer which set it, or None"""
+
+    label: typing.Optional[str] = None
+    children: typing.Dict[str, "_OriginNode"] = dataclasses.field(default_factory=dict)
+
+
+class LayeredPatcher:
+    """Applies config_overrides_layers in order, then config_overrides.
+
+    Layers (global, region, group...) are usually shared by many hosts, while
+    config_overrides is the thin per-host layer. When the base document comes
+    from the run cache, the base with each layer applied is cached too, keyed
+    by the base and the chain of layers, so hosts sharing the layers merge
+    only config_overrides.
+    """
+
+    def __init__(
+        self,
+        layers: typing.List[typing.Tuple[str, typing.Any, typing.Any]],
+        cached: int,
+        cache_salt: str = "",
+    ):
+        self.layers = layers  # (label, overrides, patcher)
+        self.cached = cached  # number of leading layers worth caching
+        self.cache_salt = cache_salt
+
+    def _cache_keys(self, cache_key: str) -> typing.List[str]:
+        keys = []
+        key = RunCache.make_key("layers", cache_key, self.cache_salt)
+        for label, overrides, _ in self.layers[: self.cached]:
+            try:
+                key = RunCache.make_key(key, label, pickle.dumps(overrides))
+            except (pickle.PicklingError, TypeError, AttributeError):
+                break
+            keys.append(key)
+        return keys
+
+    def apply(
+        self,
+        base_items: _DocT,
+        in_place: bool = True,
+        cache_key: typing.Optional[str] = None,
+    ) -> _DocT:
+        start = 0
+        keys = self._cache_keys(cache_key) if cache_key is not None else []
+        for start in range(len(keys), 0, -1):
+            try:
+                # shared cache entry when the caller patches copy-on-write
+                base_items = LAYER_CACHE.get(keys[start - 1], shared=not in_place)
+                break
+            except KeyError:
+                pass
+        else:
+            start = 0
+
+        for idx in range(start, len(self.layers)):
+            base_items = self.layers[idx][2].apply(base_items, in_place=in_place)
+            if idx < len(keys):
+                LAYER_CACHE.set(keys[idx], base_items)
 
         return base_items
 
+    @property
+    def origins(self) -> typing.Dict[str, str]:
+        """JSON Pointer of every key set by the overrides -> label of its layer
+
+        JSON Patch paths are reported as written in the operations.
+        """
+        root = _OriginNode()
+
+        def parent(parts: typing.Sequence[str]) -> _OriginNode:
+            node = root
+            for token in parts[:-1]:
+                node = node.children.setdefault(token, _OriginNode())
+            return node
+
+        for label, _, patcher in self.layers:
+            if isinstance(patcher, PatchPlan):
+                for _, op, _, parts, from_parts, _ in patcher.steps:
+                    if op in ("remove", "move"):
+                        drop: typing.Optional[typing.List[str]] = (
+                            from_parts if op == "move" else parts
+                        )
+                        if drop:
+                            parent(drop).children.pop(drop[-1], None)
+                    if op in ("add", "replace", "move", "copy"):
+                        if parts:
+                            parent(parts).children[parts[-1]] = _OriginNode(label)
+                        else:
+                            root.label, root.children = label, {}
+                continue
+
+            assert isinstance(patcher, SimpleMerger)
+            assert isinstance(patcher.new_items, dict)
+            stack: typing.List[typing.Tuple[_OriginNode, dict]] = [
+                (root, patcher.new_items)
+            ]
+            while stack:
+                node, items = stack.pop()
+                for key, value in items.items():
+                    key = str(key)
+                    if not isinstance(value, dict):
+                        node.children[key] = _OriginNode(label)
+                    elif value:
+                        child = node.children.setdefault(key, _OriginNode())
+                        child.label = None  # merged, set by its leaves
+                        stack.append((child, value))
+
+        origins: typing.Dict[str, str] = {}
+        pending: typing.List[typing.Tuple[str, _OriginNode]] = [("", root)]
+        while pending:
+            pointer, node = pending.pop()
+            if node.label is not None:
+                origins[pointer] = node.label
+            for token, child in node.children.items():
+                token = token.replace("~", "~0").replace("/", "~1")
+                pending.append((f"{pointer}/{token}", child))
+
+        return dict(sorted(origins.items()))
+
+
+def compile_overrides(
+    config_overrides: typing.Any,
+    list_extend: bool = False,
+    yml_multilines: bool = False,
+    layers: typing.Optional[list] = None,
+) -> typing.Union[None, PatchPlan, SimpleMerger, LayeredPatcher]:
+    """Return patcher for config_overrides, JSON Patch plans are cached"""
+    if layers:
+        compiled = [
+            (
+                f"config_overrides_layers[{idx}]",
+                overrides,
+                compile_overrides(overrides, list_extend, yml_multilines),
+            )
+            for idx, overrides in enumerate(layers)
+        ]
+        compiled = [layer for layer in compiled if layer[2] is not None]
+        cached = len(compiled)
+        patcher = compile_overrides(config_overrides, list_extend, yml_multilines)
+        if patcher is not None:
+            compiled.append(("config_overrides", config_overrides, patcher))
+
+        return LayeredPatcher(
+            compiled, cached, cache_salt=f"{list_extend}:{yml_multilines}"
+        )
+
+    if isinstance(config_overrides, dict):
+        return SimpleMerger(
+            new_items=config_overrides,
+            list_extend=list_extend,
+            yml_multilines=yml_multilines,
+        )
+    elif not isinstance(config_overrides, list):
+        return None
+
+    try:
+        key = RunCache.make_key("patch", pickle.dumps(config_overrides))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return PatchPlan(config_overrides)
+
+    try:
+        return PLAN_CACHE.get(key, shared=True)
+    except KeyError:
+        pass
+
+    plan = PatchPlan(config_overrides)
+    PLAN_CACHE.set(key, plan)
+    return plan
+
+
+_JSON_TOKEN_RE = re.compile(
+    r"[ \t\n\r]*(?:"
+    r"(?P<punct>[{}\[\]:,])"
+    r'|(?P<string>"(?:[^"\\\x00-\x1f]|\\.)*")'
+    r"|(?P<number>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?)"
+    r"|(?P<literal>true|false|null|NaN|Infinity|-Infinity)"
+    r")"
+)
+_JSON_WS_RE = re.compile(r"[ \t\n\r]*")
+_JSON_INT_RE = re.compile(r"-?[1-9][0-9]*|0")
+_NO_VALUE = object()
+
+
+class JsonStreamReader:
+    """Incremental JSON tokenizer.
+
+    Reads the file in chunks and yields (kind, raw) events, where kind is one
+    of start_map, end_map, start_array, end_array, key or scalar. Memory use is
+    bounded by the chunk size, the largest single token and nesting depth.
+
+    When bulk is set, the next container which fits in the read buffer is
+    decoded at once and yielded as ("value", object) event.
+    """
+
+    chunk_size = 1 << 16
+
+    def __init__(self, fp: typing.TextIO, source: str = "<???>"):
+        self.fp = fp
+        self.source = source
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bulk = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        data = self.fp.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def _error(self, msg: str) -> AnsibleActionFail:
+        return AnsibleActionFail(
+            f"{self.source}: {msg} near: {self.buf[self.pos :][:40]!r}"
+        )
+
+    def _token(self) -> typing.Optional[typing.Tuple[str, str]]:
+        while True:
+            m = _JSON_TOKEN_RE.match(self.buf, self.pos)
+            # token may be cut by the chunk border, e.g. "1.5e" of "1.5e+3"
+            if m is None or (
+                m.end() + 2 >= len(self.buf) and m.lastgroup != "punct" and not self.eof
+            ):
+                if self._fill():
+                    continue
+                if m is None:
+                    if _JSON_WS_RE.match(self.buf, self.pos).end() == len(self.buf):  # type: ignore[union-attr]
+                        return None
+                    raise self._error("invalid JSON")
+
+            self.pos = m.end()
+            kind = m.lastgroup
+            assert kind is not None
+            return kind, m.group(kind)
+
+    def _bulk_value(self) -> typing.Any:
+        self.pos -= 1  # step back to the opening bracket
+        if not self.eof and len(self.buf) - self.pos < self.chunk_size // 2:
+            self._fill()
+        try:
+            value, self.pos = self._decoder.raw_decode(self.buf, self.pos)
+        except ValueError:
+            # does not fit in the buffer (or broken), go token by token
+            self.pos += 1
+            return _NO_VALUE
+        return value
+
+    def _expect(self) -> typing.Tuple[str, str]:
+        token = self._token()
+        if token is None:
+            raise self._error("unexpected end of JSON document")
+        return token
+
+    def events(self) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+        # stack of containers: "{" or "["
+        stack: typing.List[str] = []
+        kind, raw = self._expect()
+        while True:
+            # kind/raw hold the token which starts a value
+            value = _NO_VALUE
+            if self.bulk and raw in ("{", "["):
+                value = self._bulk_value()
+
+            if value is not _NO_VALUE:
+                yield "value", value
+                kind, raw = self._expect() if stack else ("", "")
+            elif raw == "{":
+                yield "start_map", raw
+                stack.append("{")
+                kind, raw = self._expect()
+                if raw != "}":
+                    if kind != "string":
+                        raise self._error("expected object key")
+                    yield "key", raw
+                    if self._expect()[1] != ":":
+                        raise self._error("expected ':'")
+                    kind, raw = self._expect()
+                    continue
+            elif raw == "[":
+                yield "start_array", raw
+                stack.append("[")
+                kind, raw = self._expect()
+                if raw != "]":
+                    continue
+            elif kind in ("string", "number", "literal"):
+                yield "scalar", raw
+                kind, raw = self._expect() if stack else ("", "")
+            else:
+                raise self._error("expected value")
+
+            # close finished containers, move to the next value
+            while stack:
+                if raw == "," and stack[-1] == "{":
+                    kind, raw = self._expect()
+                    if kind != "string":
+                        raise self._error("expected object key")
+                    yield "key", raw
+                    if self._expect()[1] != ":":
+                        raise self._error("expected ':'")
+                    kind, raw = self._expect()
+                    break
+                elif raw == "," and stack[-1] == "[":
+                    kind, raw = self._expect()
+                    break
+                elif raw == "}" and stack[-1] == "{":
+                    yield "end_map", raw
+                elif raw == "]" and stack[-1] == "[":
+                    yield "end_array", raw
+                else:
+                    raise self._error("expected ',' or end of container")
+
+                stack.pop()
+                if stack:
+                    kind, raw = self._expect()
+
+            if not stack:
+                if self._token() is not None:
+                    raise self._error("extra data after JSON document")
+                return
+
+
+def _json_scalar(raw: str) -> str:
+    """Normalize scalar token the same way as json.dumps(json.loads(raw))"""
+    if raw[0] == '"':
+        if "\\" not in raw and raw.isascii():
+            return raw
+    elif raw[0] in "tfnNI" or (_JSON_INT_RE.fullmatch(raw) and raw != "-0"):
+        return raw
+
+    return json.dumps(json.loads(raw))
+
+
+class JsonStreamWriter:
+    """Incremental writer producing the same text as json.dumps()"""
+
+    def __init__(self, out: typing.TextIO, indent: typing.Optional[int] = None):
+        self.out = out
+        self.indent = indent
+        self.item_separator = "," if indent is not None else ", "
+        self.counts: typing.List[int] = []  # members of open containers
+        self.after_key = False
+        self._encoder = json.JSONEncoder(indent=indent)
+
+    def _newline(self) -> str:
+        return "\n" + " " * (self.indent * len(self.counts))  # type: ignore[operator]
+
+    def _member(self) -> None:
+        if self.after_key:
+            self.after_key = False
+            return
+        if not self.counts:
+            return
+
+        if self.counts[-1]:
+            self.out.write(self.item_separator)
+        self.counts[-1] += 1
+        if self.indent is not None:
+            self.out.write(self._newline())
+
+    def begin(self, char: str) -> None:
+        self._member()
+        self.out.write(char)
+        self.counts.append(0)
+
+    def end(self, char: str) -> None:
+        count = self.counts.pop()
+        if count and self.indent is not None:
+            self.out.write(self._newline())
+        self.out.write(char)
+
+    def key(self, key: str) -> None:
+        self._member()
+        self.out.write(json.dumps(key))
+        self.out.write(": ")
+        self.after_key = True
+
+    def raw_scalar(self, raw: str) -> None:
+        self._member()
+        self.out.write(_json_scalar(raw))
+
+    def value(self, value: typing.Any) -> None:
+        self._member()
+        resultant = self._encoder.encode(value)
+        if self.indent is not None and self.counts:
+            resultant = resultant.replace("\n", self._newline())
+        self.out.write(resultant)
+
+
+def _json_key(raw: str) -> str:
+    if "\\" not in raw:
+        return raw[1:-1]
+    return json.loads(raw)
+
+
+def stream_merge_json(
+    fin: typing.TextIO,
+    fout: typing.TextIO,
+    merger: typing.Optional[SimpleMerger],
+    indent: typing.Optional[int] = None,
+    source: str = "<???>",
+) -> None:
+    """Apply simple merge overrides while copying JSON document from fin to fout.
+
+    Override semantics match SimpleMerger.apply(), except that the source key
+    order is kept. Only the values replaced by overrides are ever loaded in
+    memory, the rest of the document is streamed token by token.
+    """
+    writer = JsonStreamWriter(fout, indent)
+    reader = JsonStreamReader(fin, source)
+    reader.bulk = merger is None
+    events = reader.events()
+
+    def new_value(key: str, value: typing.Any) -> typing.Any:
+        assert merger is not None
+        merged = dataclasses.replace(merger, new_items={key: value}).apply({})
+        assert isinstance(merged, dict)  # merged into a mapping
+        return merged[key]
+
+    def skip(kind: str) -> None:
+        if kind not in ("start_map", "start_array"):
+            return
+        depth = 1
+        reader.bulk = True
+        for kind, _ in events:
+            if kind in ("start_map", "start_array"):
+                depth += 1
+            elif kind in ("end_map", "end_array"):
+                depth -= 1
+                if depth == 0:
+                    return
+
+    # frames: [overrides dict or None, keys seen] for objects,
+    # [list to append or None] for arrays
+    frames: typing.List[list] = []
+    # override for the next value: (has override, key, override value)
+    pending: typing.Tuple[bool, str, typing.Any] = (
+        merger is not None,
+        "",
+        merger.new_items if merger is not None else None,
+    )
+
+    for kind, raw in events:
+        if kind == "key":
+            overrides = frames[-1][0]
+            key = _json_key(raw)
+            writer.key(key)
+            if overrides is not None and key in overrides:
+                frames[-1][1].add(key)
+                pending = (True, key, overrides[key])
+            else:
+                pending = (False, key, None)
+
+        elif kind == "end_map":
+            overrides, seen = frames.pop()
+            if overrides is not None:
+                for key, value in overrides.items():
+                    if key not in seen:
+                        writer.key(key)
+                        writer.value(new_value(key, value))
+            writer.end("}")
+
+        elif kind == "end_array":
+            (extend,) = frames.pop()
+            for item in extend or ():
+                writer.value(item)
+            writer.end("]")
+
+        else:
+            has_override, key, override = pending
+            pending = (False, "", None)
+
+            if kind == "value":
+                writer.value(raw)
+            elif not has_override or override == {}:
+                if kind == "start_map":
+                    writer.begin("{")
+                    frames.append([None, set()])
+                elif kind == "start_array":
+                    writer.begin("[")
+                    frames.append([None])
+                else:
+                    writer.raw_scalar(raw)
+
+            elif isinstance(override, dict) and kind == "start_map":
+                writer.begin("{")
+                frames.append([override, set()])
+
+            elif (
+                isinstance(override, (list, tuple, set))
+                and kind == "start_array"
+                and merger.list_extend  # type: ignore[union-attr]
+            ):
+                writer.begin("[")
+                frames.append([list(override)])
+
+            else:
+                skip(kind)
+                writer.value(new_value(key, override))
+
+        # values without overrides may be copied at once
+        has_override, _, override = pending
+        reader.bulk = not has_override or override == {}
+
+
+def stream_merge_jsonl(
+    fin: typing.TextIO,
+    fout: typing.TextIO,
+    patch: typing.Callable[[typing.Any], typing.Any],
+    loads: typing.Callable[[str], typing.Any] = json.loads,
+    sort_keys: bool = False,
+    source: str = "<???>",
+) -> None:
+    """Apply overrides to every document of a JSON Lines file"""
+    for lineno, line in enumerate(fin, 1):
+        if not line.strip():
+            continue
+        try:
+            document = loads(line)
+        except ValueError as ex:
+            raise AnsibleActionFail(f"{source}:{lineno}: {ex}") from ex
+        fout.write(json.dumps(patch(document), sort_keys=sort_keys))
+        fout.write("\n")
+
 
 @dataclasses.dataclass
 class TaskArgs:
     source: str = None  # type: ignore # src or temp file
     dest: str = None  # type: ignore # remote path, type: ignore
-    src: str = None  # type: ignore # local template file, type: ignore
+    src: typing.Union[str, typing.List[str]] = None  # type: ignore # local template file(s)
     remote_src: bool = False  # use remote file as source
     content: typing.Any = None  # content, will be placed to temp file
     config_overrides: typing.Optional[_DocT] = None
+    config_overrides_layers: typing.Optional[list] = None  # applied before overrides
     config_type: str = "ini"
     searchpath: list = dataclasses.field(default_factory=list)
     list_extend: bool = False
@@ -293,6 +1569,7 @@ class TaskArgs:
     ini_tidy: bool = True
     json_indent: int = 4
     json_sort_keys: bool = True
+    json_backend: str = "auto"
     yml_multilines: bool = False  # maybe unsupported
     yaml_indent_mapping: int = 2
     yaml_indent_sequence: int = 4
@@ -305,56 +1582,161 @@ class TaskArgs:
     comment_start_string: str = None  # type: ignore
     comment_end_string: str = None  # type: ignore
     render_template: bool = True
+    render_native: bool = False  # template evaluates to data, not text
+    passthrough: bool = False  # skip parsing when there is nothing to merge
+    passthrough_validate: bool = False  # still parse passthrough documents
+    stream: bool = False  # merge json/jsonl while reading, w/o loading whole doc
+    cache_base: bool = True  # cache parsed static sources for the run
+    canonical: bool = False  # byte-stable output for equal data
+    files: typing.Optional[list] = None  # batch: per-file args, one task
+    render_workers: int = 1  # merge pool size for files, 0 - cpu count
+    render_pool: str = "process"  # or thread
+    schema: typing.Any = None  # JSON Schema (dict) or path of a schema file
+    render_only_to: typing.Optional[str] = None  # local dir, instead of transfer
     state: str = None  # type: ignore # should not be set
     _temp_src: typing.Union[None, str] = None
     _patcher: typing.Optional[typing.Any] = None
+    _passthrough: bool = False  # output is the rendered source as is
+    _direct_src: bool = False  # source is transferred without local copy
+    _base_key: typing.Optional[str] = None  # run cache key of the base document
+    _fragments: list = dataclasses.field(
+        default_factory=list
+    )  # (src, source) after 1st
+    _schema: typing.Optional[str] = None  # canonical JSON of the schema
+    _copy_args: dict = dataclasses.field(default_factory=dict)  # copy module args
 
     @classmethod
     def from_args(cls, task_args: dict) -> "TaskArgs":
-        def field_has_type(field_type: typing.Any, target_type: type) -> bool:
-            if field_type is target_type:
-                return True
-            origin = typing.get_origin(field_type)
-            if origin is typing.Union:
-                return any(
-                    field_has_type(arg, target_type)
-                    for arg in typing.get_args(field_type)
-                )
-            return False
-
-        def yield_args() -> typing.Generator[typing.Tuple[str, typing.Any], None, None]:
-            for field in dataclasses.fields(cls):
-                if field.name not in task_args:
-                    continue
-                v = task_args[field.name]
-                if v is None:
-                    yield field.name, None
-                elif field_has_type(field.type, bool):
-                    yield field.name, boolean(v, strict=False)
-                elif field_has_type(field.type, str):
-                    yield field.name, ensure_type(v, "string")
-                elif field_has_type(field.type, int):
-                    yield field.name, ensure_type(v, "integer")
-                else:
-                    yield field.name, v
+        coerced = {}
+        for name, value in task_args.items():
+            try:
+                coerce = _TASK_ARGS_COERCIONS[name]
+            except KeyError:
+                continue  # not ours, e.g. copy module arguments
+            coerced[name] = value if value is None or coerce is None else coerce(value)
+
+        return cls(**coerced)
+
+
+def _field_coercion(
+    field_type: typing.Any,
+) -> typing.Optional[typing.Callable[[typing.Any], typing.Any]]:
+    def field_has_type(field_type: typing.Any, target_type: typing.Any) -> bool:
+        if field_type == target_type:
+            return True
+        origin = typing.get_origin(field_type)
+        if origin is typing.Union:
+            return any(
+                field_has_type(arg, target_type) for arg in typing.get_args(field_type)
+            )
+        return False
+
+    if field_has_type(field_type, bool):
+        return lambda v: boolean(v, strict=False)
+    elif field_has_type(field_type, typing.List[str]):
+        return lambda v: (
+            [ensure_type(item, "string") for item in v]
+            if isinstance(v, list)
+            else ensure_type(v, "string")
+        )
+    elif field_has_type(field_type, str):
+        return lambda v: ensure_type(v, "string")
+    elif field_has_type(field_type, int):
+        return lambda v: ensure_type(v, "integer")
+    return None
+
+
+# TaskArgs.from_args() runs for every task, so argument coercions are
+# resolved from the field types once, at import.
+_TASK_ARGS_FIELDS = tuple(field.name for field in dataclasses.fields(TaskArgs))
+_TASK_ARGS_COERCIONS = {
+    field.name: _field_coercion(field.type)
+    for field in dataclasses.fields(TaskArgs)
+    if not field.name.startswith("_")
+}
+
+# resolved template paths, a loop runs all of its items in one worker
+_NEEDLE_CACHE: typing.Dict[typing.Tuple[typing.Any, ...], str] = {}
+
+
+@functools.lru_cache(maxsize=64)
+def _template_searchpath(
+    search_path: typing.Tuple[str, ...], basedir: str, source_dir: str
+) -> typing.Tuple[str, ...]:
+    """Jinja searchpath: every path with its templates subdir, w/o duplicates"""
+    searchpath: typing.Dict[str, None] = {}
+    for p in (*search_path, basedir, source_dir):
+        searchpath.setdefault(os.path.join(p, "templates"))
+        searchpath.setdefault(p)
+    return tuple(searchpath)
+
+
+def _merge_job(
+    job: typing.Tuple[TaskArgs, _ResultantT],
+) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+    """Pool worker: merge one rendered file, return (content, error)"""
+    args, resultant = job
+    try:
+        return ActionModule.__new__(ActionModule)._merge(args, resultant), None
+    except Exception as ex:  # exceptions may not survive pickling
+        return None, to_text(ex)
+
+
+def _merge_files(
+    jobs: typing.List[typing.Tuple[TaskArgs, _ResultantT]],
+    workers: int = 1,
+    pool: str = "process",
+) -> typing.List[typing.Tuple[typing.Optional[str], typing.Optional[str]]]:
+    """Merge rendered files, in parallel for more than one worker"""
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [_merge_job(job) for job in jobs]
+
+    import concurrent.futures
+    import multiprocessing
+
+    executor: concurrent.futures.Executor
+    if pool == "process" and "fork" in multiprocessing.get_all_start_methods():
+        # NOTE: fork, a spawned child can not import the plugin without
+        # the ansible collection loader
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("fork")
+        )
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
 
-        return cls(**dict(yield_args()))
+    with executor:
+        return list(executor.map(_merge_job, jobs))
 
 
 class ActionModule(ActionBase):
     TRANSFERS_FILES = True
 
-    def type_merger(self, resultant: str, args: TaskArgs) -> typing.Tuple[str, _DocT]:
+    def _early_needs_tmp_path(self) -> bool:
+        # render_only_to writes local files and never connects to the host
+        if self._task.args.get("render_only_to"):
+            return False
+        return super()._early_needs_tmp_path()
+
+    def type_merger(
+        self, resultant: _ResultantT, args: TaskArgs
+    ) -> typing.Tuple[str, _DocT]:
         if args.config_type == "ini":
+            if not isinstance(resultant, str):
+                raise AnsibleActionFail(
+                    "Native rendering is not supported for config_type=ini"
+                )
             return self.return_config_overrides_ini(resultant, args)
         elif args.config_type == "json":
-            return self.return_config_overrides_json(resultant, args, json.loads)
+            backend = get_json_backend(args.json_backend)
+            return self.return_config_overrides_json(resultant, args, backend.loads)
         elif args.config_type == "hjson":
-            if hjson is None:
-                raise AnsibleActionFail(
-                    "hjson python package is required for config_type=hjson"
-                )
-            return self.return_config_overrides_json(resultant, args, hjson.loads)
+            backend = get_json_backend(args.json_backend)
+            return self.return_config_overrides_json(
+                resultant, args, lambda r: hjson_loads(r, backend)
+            )
+        elif args.config_type == "jsonl":
+            return self.return_config_overrides_jsonl(resultant, args)
         elif args.config_type == "yaml":
             return self.return_config_overrides_yaml(resultant, args)
         elif args.config_type == "toml":
@@ -366,29 +1748,40 @@ class ActionModule(ActionBase):
         self, resultant: str, args: TaskArgs
     ) -> typing.Tuple[str, _DocT]:
         """Returns string value from a modified config file and dict of merged config"""
-        config = INIConfig.from_string(resultant, args.source)
-        config.merge_repeated_options()
 
-        if isinstance(args._patcher, SimpleMerger):
-            if not isinstance(args.config_overrides, dict):
-                raise AnsibleActionFail(
-                    "Simple merge mode requires config_overrides to be a dictionary."
-                )
-            for section, items in args.config_overrides.items():
-                # If the items value is not a dictionary it is assumed that the
-                #  value is a default item for this config type.
-                if not isinstance(items, dict):
-                    config.set_option(args.default_section, section, items, args)
-                else:
+        def parse(resultant: str) -> typing.Any:
+            config = _ini_classes()["INIConfig"].from_string(resultant, args.source)
+            config.merge_repeated_options()
+            return config
+
+        config, _ = self._parse_base(args, resultant, parse)
+
+        if isinstance(args._patcher, LayeredPatcher):
+            patchers = [patcher for _, _, patcher in args._patcher.layers]
+        else:
+            patchers = [args._patcher]
+
+        for patcher in patchers:
+            if isinstance(patcher, SimpleMerger):
+                assert isinstance(patcher.new_items, dict)
+                for section, items in patcher.new_items.items():
+                    # If the items value is not a dictionary it is assumed that the
+                    #  value is a default item for this config type.
+                    if not isinstance(items, dict):
+                        config.set_option(args.default_section, section, items, args)
+                    else:
+                        for key, value in items.items():
+                            config.set_option(section, key, value, args)
+
+            elif isinstance(patcher, PatchPlan):
+                base_items = config.as_dict()
+                patcher.apply(base_items, in_place=True)
+                for section, items in base_items.items():
                     for key, value in items.items():
                         config.set_option(section, key, value, args)
 
-        elif JsonPatch is not None and isinstance(args._patcher, JsonPatch):
-            base_items = config.as_dict()
-            args._patcher.apply(base_items, in_place=True)
-            for section, items in base_items.items():
-                for key, value in items.items():
-                    config.set_option(section, key, value, args)
+        if args.canonical:
+            return config.to_canonical_string(args.default_section), config.as_dict()
 
         if args.ini_tidy:
             config.tidy()
@@ -397,7 +1790,7 @@ class ActionModule(ActionBase):
 
     def return_config_overrides_json(
         self,
-        resultant: str,
+        resultant: _ResultantT,
         args: TaskArgs,
         loads: typing.Callable[[typing.Any], typing.Any],
     ) -> typing.Tuple[str, _DocT]:
@@ -406,27 +1799,101 @@ class ActionModule(ActionBase):
         Its important to note that file ordering will not be preserved as the
         information within the json file will be sorted by keys.
         """
-        original_resultant = loads(resultant)
-        merged_resultant = self._patch(args, original_resultant)
+        shared = False
+        if isinstance(resultant, str):
+            original_resultant, shared = self._parse_base(args, resultant, loads)
+        else:
+            original_resultant = resultant
+        merged_resultant = self._patch(
+            args, original_resultant, in_place=not shared, cache_key=args._base_key
+        )
         indent = args.json_indent if args.json_indent > 0 else None
         return (
-            json.dumps(
+            get_json_backend(args.json_backend).dumps(
                 merged_resultant,
-                indent=indent,
-                sort_keys=args.json_sort_keys,
+                indent,
+                args.json_sort_keys or args.canonical,
+            ),
+            merged_resultant,
+        )
+
+    def return_config_overrides_jsonl(
+        self, resultant: _ResultantT, args: TaskArgs
+    ) -> typing.Tuple[str, _DocT]:
+        """Returns config json lines and list of merged documents"""
+        shared = False
+        if isinstance(resultant, str):
+            loads = get_json_backend(args.json_backend).loads
+            documents, shared = self._parse_base(
+                args,
+                resultant,
+                lambda r: [loads(ln) for ln in r.splitlines() if ln.strip()],
+            )
+        elif isinstance(resultant, list):
+            documents = resultant
+        else:
+            raise AnsibleActionFail("JSON Lines document must be a list")
+
+        merged_resultant = [
+            self._patch(args, doc, in_place=not shared) for doc in documents
+        ]
+        return (
+            "".join(
+                json.dumps(doc, sort_keys=args.json_sort_keys or args.canonical) + "\n"
+                for doc in merged_resultant
             ),
             merged_resultant,
         )
 
+    def stream_merger(
+        self, fin: typing.TextIO, fout: typing.TextIO, args: TaskArgs
+    ) -> None:
+        """Merge overrides into the document while copying it from fin to fout"""
+        if args.config_type == "json":
+            if args._patcher is not None and not isinstance(
+                args._patcher, SimpleMerger
+            ):
+                raise AnsibleActionFail(
+                    "Streaming config_type=json supports only simple merge overrides"
+                )
+            stream_merge_json(
+                fin,
+                fout,
+                args._patcher,
+                args.json_indent if args.json_indent > 0 else None,
+                args.source,
+            )
+        elif args.config_type == "jsonl":
+            stream_merge_jsonl(
+                fin,
+                fout,
+                lambda doc: self._patch(args, doc),
+                get_json_backend(args.json_backend).loads,
+                args.json_sort_keys or args.canonical,
+                args.source,
+            )
+        else:
+            raise AnsibleActionFail(
+                "[ stream ] supports only config_type json or jsonl"
+            )
+
     def return_config_overrides_yaml(
-        self, resultant: str, args: TaskArgs
+        self, resultant: _ResultantT, args: TaskArgs
     ) -> typing.Tuple[str, _DocT]:
         """Return config yaml and dict of merged config"""
-        if YAML is None:
+        ruamel_yaml = optional_import("ruamel.yaml")
+        if ruamel_yaml is None:
             raise AnsibleActionFail(
                 "ruamel.yaml python package is required for config_type=yaml"
             )
-        yaml = YAML(typ=args.strip_comments and "safe" or "rt")  # type: ignore
+        plain = args.strip_comments or args.canonical
+        if args.canonical:
+            # pure python emitter: output must not depend on libyaml
+            yaml = ruamel_yaml.YAML(typ="safe", pure=True)
+            yaml.allow_unicode = True
+            yaml.width = 80
+        else:
+            yaml = ruamel_yaml.YAML(typ=plain and "safe" or "rt")
         yaml.default_flow_style = False
         yaml.indent(
             mapping=args.yaml_indent_mapping,
@@ -434,7 +1901,7 @@ class ActionModule(ActionBase):
             offset=args.yaml_indent_offset,
         )
 
-        if not args.strip_comments:
+        if isinstance(resultant, str) and not plain:
             # NOTE(vermakov): see bigbang pwgen:
             # hide document start to preserve comments before it
             resultant, sep_count = re.subn(
@@ -448,13 +1915,24 @@ class ActionModule(ActionBase):
                     "More than one YAML document separator is not supported!"
                 )
 
-        original_resultant = yaml.load(StringIO(resultant)) or {}
-        merged_resultant = self._patch(args, original_resultant)
+        shared = False
+        if isinstance(resultant, str):
+            original_resultant, shared = self._parse_base(
+                args, resultant, lambda r: yaml.load(StringIO(r)) or {}
+            )
+        else:
+            original_resultant = resultant
+        merged_resultant = self._patch(
+            args, original_resultant, in_place=not shared, cache_key=args._base_key
+        )
 
         out = StringIO()
-        yaml.dump(merged_resultant, out)
+        yaml.dump(
+            canonical_data(merged_resultant) if args.canonical else merged_resultant,
+            out,
+        )
         resultant = out.getvalue()
-        if not args.strip_comments:
+        if not plain:
             # restore document start marker
             resultant = re.sub(
                 r"^#marker:---$",
@@ -469,15 +1947,28 @@ class ActionModule(ActionBase):
         )
 
     def return_config_overrides_toml(
-        self, resultant: str, args: TaskArgs
+        self, resultant: _ResultantT, args: TaskArgs
     ) -> typing.Tuple[str, _DocT]:
         """Returns config toml and dict of merged config"""
+        tomlkit = optional_import("tomlkit")
         if tomlkit is None:
             raise AnsibleActionFail(
                 "tomlkit python package is required for config_type=toml"
             )
-        original_resultant = tomlkit.loads(resultant)
-        merged_resultant = self._patch(args, original_resultant)
+        if isinstance(resultant, str):
+            original_resultant, _ = self._parse_base(args, resultant, tomlkit.loads)
+        elif isinstance(resultant, dict):
+            original_resultant = resultant
+        else:
+            raise AnsibleActionFail("TOML document root must be a table")
+        merged_resultant = self._patch(
+            args, original_resultant, cache_key=args._base_key
+        )
+        if args.canonical:
+            return (
+                tomlkit.dumps(canonical_data(merged_resultant), sort_keys=True),
+                merged_resultant,
+            )
         return (
             tomlkit.dumps(
                 merged_resultant,
@@ -485,29 +1976,216 @@ class ActionModule(ActionBase):
             merged_resultant,
         )
 
-    def _patch(self, args: TaskArgs, base_items: _DocT) -> _DocT:
-        if args._patcher is not None:
-            return args._patcher.apply(base_items, in_place=True)
+    def _patch(
+        self,
+        args: TaskArgs,
+        base_items: _DocT,
+        in_place: bool = True,
+        cache_key: typing.Optional[str] = None,
+    ) -> _DocT:
+        if isinstance(args._patcher, LayeredPatcher):
+            return args._patcher.apply(base_items, in_place, cache_key)
+        elif args._patcher is not None:
+            return args._patcher.apply(base_items, in_place=in_place)
 
         return base_items
 
-    def _load_task_args(self, task_vars: dict) -> TaskArgs:
+    def _parse_base(
+        self,
+        args: TaskArgs,
+        resultant: str,
+        parse: typing.Callable[[str], typing.Any],
+    ) -> typing.Tuple[typing.Any, bool]:
+        """Parse base document, using the run cache for static sources.
+
+        Returns the document and whether it is shared with the cache, in which
+        case it must be patched copy-on-write (in_place=False).
+        Documents of plain python types are shared, round-trip documents
+        (ruamel, tomlkit, iniparse) are handed out as private copies, as
+        copy-on-write would lose their comments and formatting.
+        """
+        if args.render_template or not args.cache_base:
+            return parse(resultant), False
+
+        plain = args.config_type in ("json", "hjson", "jsonl") or (
+            args.config_type == "yaml" and (args.strip_comments or args.canonical)
+        )
+        key = RunCache.make_key(
+            args.config_type,
+            str(args.strip_comments),
+            str(plain),
+            to_bytes(resultant, errors="surrogate_or_strict"),
+        )
+        args._base_key = key
+        try:
+            return BASE_CACHE.get(key, shared=plain), plain
+        except KeyError:
+            pass
+
+        document = parse(resultant)
+        BASE_CACHE.set(key, document)
+        return document, False
+
+    def _load_schema(self, schema: typing.Any) -> str:
+        """Return [ schema ] (a mapping or a JSON/YAML file) as canonical JSON"""
+        if isinstance(schema, str):
+            path = self._find_needle("files", schema)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+            except (OSError, UnicodeError) as ex:
+                raise AnsibleActionFail(
+                    f"Failed to read [ schema ] {path}: {ex}"
+                ) from ex
+            try:
+                schema = json.loads(text)
+            except ValueError:
+                try:
+                    schema = optional_import("ruamel.yaml").YAML(typ="safe").load(text)
+                except Exception as ex:
+                    raise AnsibleActionFail(
+                        f"[ schema ] {path} is neither JSON nor YAML: {ex}"
+                    ) from ex
+
+        if not isinstance(schema, (dict, bool)):
+            raise AnsibleActionFail(
+                "[ schema ] must be a JSON Schema or a path of a schema file"
+            )
+        try:
+            return json.dumps(schema, sort_keys=True, separators=(",", ":"))
+        except (TypeError, ValueError) as ex:
+            raise AnsibleActionFail(
+                f"[ schema ] is not JSON serializable: {ex}"
+            ) from ex
+
+    def _find_needle(self, dirname: str, needle: str) -> str:
+        """ActionBase._find_needle() cached per task search path (role, play)"""
+        path_stack = self._task.get_search_path()
+        key = (tuple(path_stack), dirname, needle)
+        try:
+            return _NEEDLE_CACHE[key]
+        except KeyError:
+            pass
+
+        path = self._loader.path_dwim_relative_stack(path_stack, dirname, needle)
+        _NEEDLE_CACHE[key] = path
+        return path
+
+    def _load_task_args(
+        self, task_vars: dict, task_args: typing.Optional[dict] = None
+    ) -> TaskArgs:
         """Return options and status from module load."""
 
-        args = TaskArgs.from_args(self._task.args)
-        if args.config_type not in ["ini", "yaml", "json", "hjson", "toml"]:
+        if task_args is None:
+            task_args = self._task.args
+        args = TaskArgs.from_args(task_args)
+        args._copy_args = {
+            key: value
+            for key, value in task_args.items()
+            if key not in _TASK_ARGS_FIELDS
+        }
+
+        if args.files is not None:
+            if not isinstance(args.files, list) or not all(
+                isinstance(item, dict) and "files" not in item for item in args.files
+            ):
+                raise AnsibleActionFail("[ files ] must be a list of dictionaries")
+            if args.render_pool not in ("process", "thread"):
+                raise AnsibleActionFail(
+                    "[ render_pool ] must be either process or thread"
+                )
+            if args.render_workers < 0:
+                raise AnsibleActionFail("[ render_workers ] must not be negative")
+            return args  # every item is loaded by _run_files()
+        if args.config_type not in ["ini", "yaml", "json", "jsonl", "hjson", "toml"]:
             raise AnsibleActionFail(
                 "No valid [ config_type ] was provided. Valid options are"
-                " ini, yaml, json, hjson or toml.",
+                " ini, yaml, json, jsonl, hjson or toml.",
             )
 
         if args.state is not None:
             raise AnsibleActionFail("template module do not support [ state ]")
 
-        if args.remote_src:
+        if args.render_native and (
+            args.config_type == "ini" or not args.render_template
+        ):
+            raise AnsibleActionFail(
+                "[ render_native ] requires [ render_template ] and"
+                " config_type json, hjson, yaml or toml."
+            )
+
+        if args.stream and (
+            args.config_type not in ("json", "jsonl") or args.render_template
+        ):
+            raise AnsibleActionFail(
+                "[ stream ] requires [ render_template ] to be disabled and"
+                " config_type json or jsonl."
+            )
+
+        if args.stream and args.canonical and args.config_type == "json":
+            raise AnsibleActionFail(
+                "[ canonical ] is not supported with [ stream ] for config_type json,"
+                " streaming keeps the source key order."
+            )
+
+        if args.schema is not None:
+            if args.stream:
+                raise AnsibleActionFail(
+                    "[ schema ] is not supported with [ stream ],"
+                    " the document is never loaded."
+                )
+            args._schema = self._load_schema(args.schema)
+            compile_schema(args._schema)  # fail on a bad schema before rendering
+
+        fragments: typing.List[str] = []
+        if isinstance(args.src, list):
             if not args.src:
                 raise AnsibleActionFail("No user [ src ] was provided")
+            args.src, fragments = args.src[0], args.src[1:]
+            if fragments and (
+                args.remote_src or args.stream or args.config_type == "jsonl"
+            ):
+                raise AnsibleActionFail(
+                    "[ src ] list is not supported with [ remote_src ], [ stream ]"
+                    " or config_type jsonl."
+                )
+
+        layers = args.config_overrides_layers
+        if layers is not None and (
+            not isinstance(layers, list)
+            or not all(isinstance(layer, (dict, list, type(None))) for layer in layers)
+        ):
+            raise AnsibleActionFail(
+                "[ config_overrides_layers ] must be a list of dictionaries"
+                " or JSON Patch lists."
+            )
+
+        args._passthrough = (
+            args.passthrough
+            and not args.config_overrides
+            and not any(layers or [])
+            and not fragments
+            and not args.render_native
+            and not args.strip_comments
+            and not args.canonical
+        )
+        args._direct_src = (
+            args._passthrough
+            and not args.render_template
+            and not args.passthrough_validate
+            and args._schema is None
+        )
 
+        if args.render_only_to and args.remote_src:
+            raise AnsibleActionFail(
+                "[ render_only_to ] does not connect to the host,"
+                " [ remote_src ] is not supported."
+            )
+
+        if args.remote_src and not args.src:
+            raise AnsibleActionFail("No user [ src ] was provided")
+
+        if args.remote_src and not args._direct_src:
             slurpee = self._execute_module(
                 module_name="ansible.legacy.slurp",
                 module_args=dict(src=args.src),
@@ -530,26 +2208,43 @@ class ActionModule(ActionBase):
             args._temp_src = content_tempfile
             args.content = ""
 
+        if args.remote_src and args._direct_src:
+            # copy module would copy the file in place on the remote
+            args.source = args.src
+        else:
+            try:
+                args.source = self._find_needle("templates", args.src)
+            except AnsibleError as ex:
+                if args._temp_src and os.path.exists(args._temp_src):
+                    os.unlink(args._temp_src)
+                raise AnsibleActionFail("failed to find template file") from ex
+
         try:
-            args.source = self._find_needle("templates", args.src)
+            args._fragments = [
+                (src, self._find_needle("templates", src)) for src in fragments
+            ]
         except AnsibleError as ex:
             if args._temp_src and os.path.exists(args._temp_src):
                 os.unlink(args._temp_src)
             raise AnsibleActionFail("failed to find template file") from ex
 
-        searchpath = list(task_vars.get("ansible_search_path", []))
-        searchpath.extend([self._loader._basedir, os.path.dirname(args.source)])
-
-        args.searchpath = []
-        for p in searchpath:
-            args.searchpath.append(os.path.join(p, "templates"))
-            args.searchpath.append(p)
+        args.searchpath = list(
+            _template_searchpath(
+                tuple(task_vars.get("ansible_search_path", [])),
+                self._loader._basedir,
+                os.path.dirname(args.source),
+            )
+        )
 
         if not args.dest:
             raise AnsibleActionFail("No [ dest ] was provided")
 
-        # Expand any user home dir specification
-        user_dest = self._remote_expand_user(args.dest)
+        # Expand any user home dir specification, render_only_to does not
+        # connect (render_only_file() rejects "~" dests)
+        if args.render_only_to:
+            user_dest = args.dest
+        else:
+            user_dest = self._remote_expand_user(args.dest)
         if user_dest.endswith(os.path.sep):
             user_dest = os.path.join(user_dest, os.path.basename(args.source))
 
@@ -559,35 +2254,133 @@ class ActionModule(ActionBase):
         # if args.config_overrides is None:
         #     args.config_overrides = {}
 
-        if isinstance(args.config_overrides, list):
-            if JsonPatch is None:
+        args._patcher = compile_overrides(
+            args.config_overrides,
+            args.list_extend,
+            args.yml_multilines,
+            args.config_overrides_layers,
+        )
+
+        return args
+
+    def _copy_file(
+        self, task_vars: dict, args: TaskArgs, src: str, remote_src: bool = False
+    ) -> dict:
+        """Transfer src to args.dest using copy action"""
+        if args.render_only_to:
+            host = to_text(task_vars.get("inventory_hostname", "localhost"))
+            return render_only_file(args.render_only_to, host, args.dest, src)
+
+        new_task = self._task.copy()
+        new_task.args.clear()
+        new_task.args.update(args._copy_args)
+
+        new_task.args.update(
+            dict(
+                src=src,
+                dest=args.dest,
+                follow=True,
+            )
+        )
+        if remote_src:
+            new_task.args["remote_src"] = True
+
+        # call with ansible.legacy prefix to eliminate collisions with collections while still allowing local override
+        copy_action = self._shared_loader_obj.action_loader.get(
+            "ansible.legacy.copy",
+            task=new_task,
+            connection=self._connection,
+            play_context=self._play_context,
+            loader=self._loader,
+            templar=self._templar,
+            shared_loader_obj=self._shared_loader_obj,
+        )
+        result = copy_action.run(task_vars=task_vars)
+        if not remote_src:
+            result["config_sha256"] = _file_sha256(src)
+        return result
+
+    def _parse_fragment(
+        self, args: TaskArgs, resultant: _ResultantT, label: str
+    ) -> dict:
+        """Parse rendered src fragment to a plain dict merged into the base"""
+        if not isinstance(resultant, str):
+            document = resultant
+        elif args.config_type == "ini":
+            config = _ini_classes()["INIConfig"].from_string(resultant, label)
+            document = {
+                section: {name: config[section][name] for name in config[section]}
+                for section in config
+            }
+        elif args.config_type == "json":
+            document = get_json_backend(args.json_backend).loads(resultant)
+        elif args.config_type == "hjson":
+            document = hjson_loads(resultant, get_json_backend(args.json_backend))
+        elif args.config_type == "yaml":
+            ruamel_yaml = optional_import("ruamel.yaml")
+            if ruamel_yaml is None:
                 raise AnsibleActionFail(
-                    "jsonpatch python package is required for JSON Patch overrides"
+                    "ruamel.yaml python package is required for config_type=yaml"
                 )
-            args._patcher = JsonPatch(args.config_overrides)
+            document = ruamel_yaml.YAML(typ="safe").load(resultant) or {}
+        elif args.config_type == "toml":
+            tomlkit = optional_import("tomlkit")
+            if tomlkit is None:
+                raise AnsibleActionFail(
+                    "tomlkit python package is required for config_type=toml"
+                )
+            document = tomlkit.loads(resultant).unwrap()
+        else:
+            raise AnsibleActionFail(
+                f"[ src ] list is not supported for config_type={args.config_type}"
+            )
 
-        elif isinstance(args.config_overrides, dict):
-            args._patcher = SimpleMerger(
-                new_items=args.config_overrides,
+        if not isinstance(document, dict):
+            raise AnsibleActionFail(f"{label} fragment must be a mapping")
+        return document
+
+    def _merge_fragments(
+        self, args: TaskArgs, fragments: typing.List[typing.Tuple[str, _ResultantT]]
+    ) -> None:
+        """Merge src fragments into the base before the override layers"""
+        layers: typing.List[typing.Tuple[str, typing.Any, typing.Any]] = []
+        for label, resultant in fragments:
+            document = self._parse_fragment(args, resultant, label)
+            # fragments are documents, their strings are not lists to split
+            merger = SimpleMerger(
+                new_items=document,
                 list_extend=args.list_extend,
                 yml_multilines=args.yml_multilines,
+                split_strings=False,
             )
+            layers.append((label, document, merger))
+
+        patcher = args._patcher
+        if isinstance(patcher, LayeredPatcher):
+            args._patcher = LayeredPatcher(
+                layers + patcher.layers,
+                len(layers) + patcher.cached,
+                patcher.cache_salt,
+            )
+            return
 
-        return args
-
-    def run(self, tmp=None, task_vars=None):
-        """Run the method"""
-
-        if task_vars is None:
-            task_vars = dict()
-
-        result = super().run(tmp, task_vars)
-        del tmp  # tmp no longer has any effect
-
-        args = self._load_task_args(task_vars=task_vars)
+        cached = len(layers)
+        if patcher is not None:
+            layers.append(("config_overrides", args.config_overrides, patcher))
+        args._patcher = LayeredPatcher(
+            layers, cached, cache_salt=f"{args.list_extend}:{args.yml_multilines}"
+        )
 
+    def _render(
+        self,
+        task_vars: dict,
+        args: TaskArgs,
+        src: str,
+        source: str,
+    ) -> typing.Tuple[_ResultantT, typing.MutableMapping[str, typing.Any]]:
+        """Render template source, return the resultant and template vars"""
         try:
-            with open(args.source, "rb") as f:
+            with open(source, "rb") as f:
                 try:
                     template_data = to_text(f.read(), errors="surrogate_or_strict")
                 except UnicodeError as ex:
@@ -596,13 +2389,7 @@ class ActionModule(ActionBase):
                     ) from ex
 
             # add ansible template vars
-            temp_vars = task_vars.copy()
-            # NOTE in the case of ANSIBLE_DEBUG=1 task_vars is VarsWithSources(MutableMapping)
-            # so | operator cannot be used as it can be used only on dicts
-            # https://peps.python.org/pep-0584/#what-about-mapping-and-mutablemapping
-            temp_vars.update(
-                generate_ansible_template_vars(args.src, args.source, args.dest)
-            )
+            temp_vars = template_vars(task_vars, src, source, args.dest)
 
             if args.render_template:
                 template_overrides = {
@@ -618,10 +2405,20 @@ class ActionModule(ActionBase):
                     if value is not None
                 }
 
+                env_overrides = {}
+                if args.render_native:
+                    # NOTE(vermakov): template should be a single expression
+                    # like "{{ policy }}", so trailing newline must not count.
+                    template_data = template_data.strip()
+                    if AnsibleNativeEnvironment is not None:
+                        env_overrides["environment_class"] = AnsibleNativeEnvironment
+
                 templar = self._templar.copy_with_new_env(
                     searchpath=args.searchpath,
                     available_variables=temp_vars,
+                    **env_overrides,
                 )
+                template_data = trust_as_template(template_data)
                 if hasattr(templar, "template"):
                     resultant = templar.template(
                         template_data,
@@ -644,11 +2441,90 @@ class ActionModule(ActionBase):
             raise
         except Exception as ex:
             raise AnsibleActionFail(to_text(ex)) from ex
+
+        return resultant, temp_vars
+
+    def _merge(self, args: TaskArgs, resultant: _ResultantT) -> typing.Optional[str]:
+        """Return merged file content, None to transfer the source as is"""
+        if not args._passthrough:
+            content, document = self.type_merger(resultant, args)
+            self._validate_schema(args, document)
+            return content
+
+        if args.passthrough_validate or args._schema:
+            # parse only to fail on a broken document, result is unused
+            self._validate_schema(args, self.type_merger(resultant, args)[1])
+
+        if not args.render_template and not args._temp_src:
+            return None
+
+        return resultant  # type: ignore[return-value]
+
+    def _validate_schema(self, args: TaskArgs, document: _DocT) -> None:
+        """Fail on a merged document not matching [ schema ]"""
+        if args._schema is None:
+            return
+
+        validator = compile_schema(args._schema)
+        if args.config_type == "ini":
+            # overrides stay native until written, validate them as text
+            document = {
+                section: {
+                    key: value if isinstance(value, list) else to_text(value)
+                    for key, value in options.items()
+                }
+                for section, options in document.items()  # type: ignore[union-attr]
+            }
+
+        if args.config_type == "jsonl":
+            errors = [
+                f"line {idx}: {error}"
+                for idx, item in enumerate(document, 1)  # type: ignore[arg-type]
+                for error in schema_errors(validator, item)
+            ]
+        else:
+            errors = schema_errors(validator, document)
+
+        if errors:
+            shown = errors[:SCHEMA_MAX_ERRORS]
+            if len(errors) > len(shown):
+                shown.append(f"... and {len(errors) - len(shown)} more")
+            raise AnsibleActionFail(
+                f"{args.dest}: merged document does not match [ schema ]: "
+                + "; ".join(shown),
+                result={"schema_errors": errors},
+            )
+
+    def _render_file(
+        self, task_vars: dict, args: TaskArgs
+    ) -> typing.Tuple[_ResultantT, typing.MutableMapping[str, typing.Any]]:
+        """Render src and its fragments"""
+        assert isinstance(args.src, str)  # a src list is split by _load_task_args
+        try:
+            resultant, temp_vars = self._render(task_vars, args, args.src, args.source)
+            fragments = [
+                (f"src[{idx}]", self._render(task_vars, args, src, source)[0])
+                for idx, (src, source) in enumerate(args._fragments, 1)
+            ]
         finally:
             if args._temp_src and os.path.exists(args._temp_src):
                 os.unlink(args._temp_src)
 
-        resultant, config_base = self.type_merger(resultant, args)
+        if fragments:
+            self._merge_fragments(args, fragments)
+
+        return resultant, temp_vars
+
+    def _write_file(
+        self,
+        task_vars: dict,
+        args: TaskArgs,
+        resultant: typing.Optional[str],
+        temp_vars: typing.Mapping[str, typing.Any],
+    ) -> dict:
+        """Transfer merged content (or the source if it is None) to dest"""
+        if resultant is None:
+            return self._copy_file(task_vars, args, args.source)
 
         if args.strip_comments and args.config_type == "ini":
             lines = [
@@ -663,10 +2539,6 @@ class ActionModule(ActionBase):
                     resultant += "\n"
                 resultant += line + "\n"
 
-        new_task = self._task.copy()
-        for field in dataclasses.fields(args):
-            new_task.args.pop(field.name, None)
-
         local_tempdir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
         try:
             result_file = os.path.join(local_tempdir, os.path.basename(args.source))
@@ -675,25 +2547,7 @@ class ActionModule(ActionBase):
                     to_bytes(resultant, encoding="utf-8", errors="surrogate_or_strict")
                 )
 
-            new_task.args.update(
-                dict(
-                    src=result_file,
-                    dest=args.dest,
-                    follow=True,
-                )
-            )
-
-            # call with ansible.legacy prefix to eliminate collisions with collections while still allowing local override
-            copy_action = self._shared_loader_obj.action_loader.get(
-                "ansible.legacy.copy",
-                task=new_task,
-                connection=self._connection,
-                play_context=self._play_context,
-                loader=self._loader,
-                templar=self._templar,
-                shared_loader_obj=self._shared_loader_obj,
-            )
-            result.update(copy_action.run(task_vars=task_vars))
+            result = self._copy_file(task_vars, args, result_file)
 
         finally:
             shutil.rmtree(to_bytes(local_tempdir, errors="surrogate_or_strict"))
@@ -710,6 +2564,125 @@ class ActionModule(ActionBase):
         #         {"prepared": json.dumps(mods, indent=4, sort_keys=True)}
         #     )
 
+        if isinstance(args._patcher, LayeredPatcher):
+            result["override_origins"] = args._patcher.origins
+
+        return result
+
+    def _stream_file(self, task_vars: dict, args: TaskArgs) -> dict:
+        """Merge and transfer a json/jsonl source without loading it"""
+        local_tempdir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
+        try:
+            result_file = os.path.join(local_tempdir, os.path.basename(args.source))
+            try:
+                with (
+                    open(args.source, encoding="utf-8") as fin,
+                    open(result_file, "w", encoding="utf-8") as fout,
+                ):
+                    self.stream_merger(fin, fout, args)
+            except UnicodeError as ex:
+                raise AnsibleActionFail(
+                    "Template source files must be utf-8 encoded"
+                ) from ex
+            finally:
+                if args._temp_src and os.path.exists(args._temp_src):
+                    os.unlink(args._temp_src)
+
+            result = self._copy_file(task_vars, args, result_file)
+
+        finally:
+            shutil.rmtree(to_bytes(local_tempdir, errors="surrogate_or_strict"))
+
+        if isinstance(args._patcher, LayeredPatcher):
+            result["override_origins"] = args._patcher.origins
+        return result
+
+    def _run_file(self, task_vars: dict, args: TaskArgs) -> dict:
+        if args._direct_src:
+            # Nothing to render nor merge: let copy transfer the source as is
+            return self._copy_file(task_vars, args, args.source, args.remote_src)
+
+        if args.stream:
+            return self._stream_file(task_vars, args)
+
+        resultant, temp_vars = self._render_file(task_vars, args)
+        return self._write_file(
+            task_vars, args, self._merge(args, resultant), temp_vars
+        )
+
+    def _run_files(self, task_vars: dict, args: TaskArgs) -> dict:
+        """Render every item of [ files ], merge them in a pool, transfer them
+
+        Rendering and transfers use the templar and the connection, so they
+        stay sequential; parsing, merging and serialization of the rendered
+        documents is the CPU-heavy part and runs in render_workers.
+        """
+        task_args = {
+            key: value
+            for key, value in self._task.args.items()
+            if key not in ("files", "render_workers", "render_pool")
+        }
+
+        results: typing.List[typing.Optional[dict]] = []
+        jobs: typing.List[typing.Tuple[int, TaskArgs, _ResultantT, typing.Any]] = []
+        assert args.files is not None
+        for item in args.files:
+            try:
+                item_args = self._load_task_args(task_vars, task_args | item)
+                if item_args._direct_src or item_args.stream:
+                    results.append(self._run_file(task_vars, item_args))
+                    continue
+
+                resultant, temp_vars = self._render_file(task_vars, item_args)
+            except AnsibleAction as ex:
+                results.append(ex.result)
+                continue
+
+            jobs.append((len(results), item_args, resultant, temp_vars))
+            results.append(None)
+
+        merged = _merge_files(
+            [(item_args, resultant) for _, item_args, resultant, _ in jobs],
+            args.render_workers,
+            args.render_pool,
+        )
+
+        for (idx, item_args, _, temp_vars), (content, error) in zip(jobs, merged):
+            if error is not None:
+                results[idx] = {"failed": True, "msg": error}
+                continue
+            try:
+                results[idx] = self._write_file(
+                    task_vars, item_args, content, temp_vars
+                )
+            except AnsibleAction as ex:
+                results[idx] = ex.result
+
+        result: dict = {
+            "results": results,
+            "changed": any(r.get("changed", False) for r in results),  # type: ignore[union-attr]
+        }
+        if any(r.get("failed", False) for r in results):  # type: ignore[union-attr]
+            result["failed"] = True
+            result["msg"] = "One or more items failed"
+        return result
+
+    def run(self, tmp=None, task_vars=None):
+        """Run the method"""
+
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super().run(tmp, task_vars)
+        del tmp  # tmp no longer has any effect
+
+        args = self._load_task_args(task_vars=task_vars)
+
+        if args.files is not None:
+            result.update(self._run_files(task_vars, args))
+        else:
+            result.update(self._run_file(task_vars, args))
+
         self._remove_tmp_path(self._connection._shell.tmpdir)
 
         return result
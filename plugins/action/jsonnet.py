@@ -4,11 +4,19 @@
 
 # https://github.com/luqasn/ansible_jsonnet_template_action
 
+import functools
+import hashlib
 import json
 import os
+import pickle
+import re
+import select
+import shlex
 import shutil
+import signal
 import stat
 import tempfile
+import time
 import typing
 from io import StringIO
 
@@ -21,33 +29,859 @@ from ansible.errors import (
     AnsibleFileNotFound,
 )
 from ansible.module_utils.common.text.converters import to_bytes, to_native, to_text
+from ansible.module_utils.common.text.formatters import human_to_bytes
 from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.plugins.action import ActionBase
-from ansible.template import generate_ansible_template_vars
+from ansible.utils.display import Display
+
+from .config_template import ActionModule as ConfigTemplateAction
+from .config_template import (
+    RunCache,
+    TaskArgs,
+    compile_overrides,
+    get_json_backend,
+    optional_import,
+    render_only_file,
+    template_vars,
+)
+
+display = Display()
+
+# resolved import paths (None - not found), shared by all forks of the run
+IMPORT_CACHE = RunCache("jsonnet_import")
+
+# imported files and decrypted (vault) sources read by this worker; kept in
+# memory only, so that decrypted sources never hit the disk. The scope is one
+# fork, i.e. the loop items of one host: other hosts read (and decrypt) them
+# again, for plain files no slower than a shared RunCache entry would be
+_CONTENT_CACHE: typing.Dict[str, bytes] = {}
+_SOURCE_CACHE: typing.Dict[str, str] = {}
+_DIGEST_CACHE: typing.Dict[str, str] = {}
+
+# evaluation results and manifests, shared by all forks of the run
+EVAL_CACHE = RunCache("jsonnet_eval")
+
+# manifests (import closure, ext vars) remembered per source; evaluations of
+# one source import different files only when they branch on ext vars
+EVAL_MANIFESTS = 8
+
+# (imports as (dir, rel), ext var names, var native names) of an evaluation
+_ManifestT = typing.Tuple[
+    typing.Tuple[typing.Tuple[str, str], ...],
+    typing.Tuple[str, ...],
+    typing.Tuple[str, ...],
+]
+
+_EXT_VAR_RE = re.compile(
+    r"""std\s*\.\s*extVar\s*\(\s*(?:"([\w.-]*)"|'([\w.-]*)')\s*\)"""
+)
+_EXT_VAR_UNDEFINED = "\0undefined"
+_EXT_VAR_UNDEFINED_RE = re.compile(r"undefined external variable: (.*)")
+# import/importstr/importbin and its path: "", '' or verbatim @"", @'' string
+_IMPORT_RE = re.compile(
+    r"""\b(import|importstr|importbin)\b\s*"""
+    r"""(?:"((?:[^"\\]|\\.)*)"|'((?:[^'\\]|\\.)*)'|@"((?:[^"]|"")*)"|@'((?:[^']|'')*)')?"""
+)
+
+FORMATS = ("json", "yaml", "yaml_stream", "ini", "toml", "env")
+
+# multi output files formatted by their extension
+_EXTENSION_FORMATS = {
+    ".json": "json",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+    ".ini": "ini",
+    ".toml": "toml",
+    ".env": "env",
+}
+
+_ENV_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*\Z")
+
+# json.dumps(indent=3) tokens that jsonnet formats differently, at the end
+# of a line: a line holding a string value ends with a quote
+_JSON_EMPTY_OBJECT_RE = re.compile(r"\{\}(?=,?$)", re.M)
+_JSON_EMPTY_ARRAY_RE = re.compile(r"\[\](?=,?$)", re.M)
+_JSON_FLOAT_RE = re.compile(r"-?[0-9]+[.eE][0-9eE+-]*(?=,?$)", re.M)
+_JSON_C1_RE = re.compile("[\x7f-\x9f]")
+
+# interval of RSS checks of a limited evaluation worker, seconds
+LIMIT_POLL_INTERVAL = 0.05
+
+_T = typing.TypeVar("_T")
+
+
+def _read_cached(path: str) -> bytes:
+    try:
+        return _CONTENT_CACHE[path]
+    except KeyError:
+        pass
+
+    with open(path, "rb") as f:
+        content = f.read()
+    _CONTENT_CACHE[path] = content
+    return content
+
+
+def _file_digest(path: str) -> str:
+    try:
+        return _DIGEST_CACHE[path]
+    except KeyError:
+        pass
+
+    digest = hashlib.sha256(_read_cached(path)).hexdigest()
+    _DIGEST_CACHE[path] = digest
+    return digest
+
+
+@functools.lru_cache(maxsize=None)
+def _yaml() -> typing.Any:
+    ruamel_yaml = optional_import("ruamel.yaml")
+    if ruamel_yaml is None:
+        raise AnsibleActionFail(
+            "ruamel.yaml python package is required for format=yaml"
+        )
+    yaml = ruamel_yaml.YAML(typ="safe")  # C emitter when ruamel.yaml.clib is there
+    yaml.default_flow_style = False
+    yaml.indent(
+        mapping=2,
+        sequence=4,
+        offset=2,
+    )
+    return yaml
+
+
+def dump_yaml(documents: typing.List[typing.Any]) -> str:
+    """Return documents as YAML, a stream for more than one document"""
+    yaml = _yaml()
+    out = StringIO()
+    if len(documents) == 1:
+        yaml.dump(documents[0], out)
+    else:
+        yaml.explicit_start = True
+        try:
+            yaml.dump_all(documents, out)
+        finally:
+            yaml.explicit_start = None
+    return out.getvalue()
+
+
+def format_document(document: typing.Any, format: str) -> str:
+    """Return a decoded evaluation result as file content"""
+    if format == "yaml_stream":
+        if not isinstance(document, list):
+            raise AnsibleActionFail("format yaml_stream requires an array of documents")
+        return dump_yaml(document)
+    elif format == "yaml":
+        return dump_yaml([document])
+
+    return manifest_json(document)
+
+
+def manifest_json(document: typing.Any) -> str:
+    """Return a decoded document as JSON formatted like jsonnet output
+
+    json.dumps() with jsonnet's layout and sorted keys, then the tokens
+    jsonnet writes differently (empty containers, floats, C1 control
+    characters) are replaced. No jsonnet evaluation, this runs for every
+    file of multi outputs and for every host merging config_overrides.
+    """
+    text = json.dumps(
+        document,
+        indent=3,
+        sort_keys=True,
+        separators=(",", ": "),
+        ensure_ascii=False,
+        default=to_text,
+    )
+    text = _JSON_EMPTY_OBJECT_RE.sub("{ }", text)
+    text = _JSON_EMPTY_ARRAY_RE.sub("[ ]", text)
+    text = _JSON_FLOAT_RE.sub(_jsonnet_float, text)
+    text = _JSON_C1_RE.sub(lambda m: "\\u%04x" % ord(m.group()), text)
+    return text + "\n"
+
+
+def _jsonnet_float(m: "re.Match[str]") -> str:
+    value = float(m.group())
+    return "%.0f" % value if value.is_integer() else "%.17g" % value
+
+
+def dump_env(document: typing.Any) -> str:
+    """Return an object as NAME=value lines, quoted for sh and systemd EnvironmentFile"""
+    if not isinstance(document, dict):
+        raise AnsibleActionFail("format env requires an object of variables")
+
+    lines = []
+    for name, value in document.items():
+        if not _ENV_NAME_RE.match(name):
+            raise AnsibleActionFail(f"{name!r} is not an environment variable name")
+        if value is None:
+            continue  # unset, e.g. by config_overrides
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif not isinstance(value, str):
+            value = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+        lines.append(f"{name}={shlex.quote(value)}\n")
+    return "".join(lines)
+
+
+def merge_document(
+    document: typing.Any,
+    format: str,
+    config_overrides: typing.Any = None,
+    list_extend: bool = False,
+    source: str = "",
+) -> str:
+    """Return a decoded evaluation result merged with config_overrides as file content.
+
+    ini and toml are serialized by the config_template engines, a string
+    result (std.manifestIni(), std.manifestTomlEx()) is parsed by them.
+    """
+    if format in ("ini", "toml"):
+        args = TaskArgs(config_type=format, source=source, list_extend=list_extend)
+        if format == "ini" and not isinstance(document, str):
+            if not isinstance(document, dict):
+                raise AnsibleActionFail("format ini requires an object of sections")
+            # the engine merges into parsed INI only, start from an empty file
+            args._patcher = compile_overrides(
+                config_overrides, list_extend, layers=[document]
+            )
+            document = ""
+        else:
+            args._patcher = compile_overrides(config_overrides, list_extend)
+        engine = ConfigTemplateAction.__new__(ConfigTemplateAction)
+        return engine.type_merger(document, args)[0]
+
+    if isinstance(document, str):
+        raise AnsibleActionFail(
+            f"format {format} with config_overrides requires the template"
+            " to evaluate to data, not to a manifested string"
+        )
+    patcher = compile_overrides(config_overrides, list_extend)
+    if patcher is not None:
+        if format == "yaml_stream" and isinstance(document, list):
+            document = [patcher.apply(item) for item in document]
+        else:
+            document = patcher.apply(document)
+
+    if format == "env":
+        return dump_env(document)
+    return format_document(document, format)
 
-try:
-    import _jsonnet
-except ImportError:
-    _jsonnet = None  # type: ignore[assignment]
-try:
-    from ruamel.yaml import YAML
-except ImportError:
-    YAML = None  # type: ignore[assignment,misc]
+
+def format_output(resultant: str, format: str) -> str:
+    """Return evaluated JSON text as file content.
+
+    The result is decoded once and dumped straight to YAML; a string result
+    is a std.manifestYamlDoc() / std.manifestYamlStream() text, which is
+    reformatted for yaml and written as is for json.
+    """
+    if format == "json" and not resultant.lstrip().startswith('"'):
+        return resultant  # jsonnet already formats JSON
+
+    document = get_json_backend().loads(resultant)
+    if not isinstance(document, str):
+        return resultant if format == "json" else format_document(document, format)
+    if format == "json":
+        return document
+
+    documents = list(_yaml().load_all(document))
+    if not documents:
+        return document  # empty stream
+    return dump_yaml(documents)
+
+
+def split_outputs(
+    result_obj: typing.Any, format: str
+) -> typing.List[typing.Tuple[str, str]]:
+    """Return (file name, content) of a multi-output evaluation, like jsonnet -m"""
+    if not isinstance(result_obj, dict):
+        raise AnsibleActionFail(
+            "multi requires the template to evaluate to an object of file names"
+        )
+
+    outputs = []
+    for name, document in sorted(result_obj.items()):
+        if not name or name in (".", "..") or "/" in name or os.sep in name:
+            raise AnsibleActionFail(f"multi output name {name!r} is not a file name")
+
+        # std.manifestYamlDoc() and friends are written as is
+        if isinstance(document, str):
+            outputs.append((name, document))
+            continue
+
+        file_format = _EXTENSION_FORMATS.get(os.path.splitext(name)[1], format)
+        outputs.append((name, merge_document(document, file_format)))
+
+    return outputs
+
+
+def _plain(value: typing.Any) -> typing.Any:
+    """Filters return generators for lists, jsonnet needs a list"""
+    if isinstance(value, (str, bytes, dict)) or not hasattr(value, "__iter__"):
+        return value
+    return list(value)
+
+
+class NativeFilters:
+    """Collection filters as jsonnet native callbacks, e.g. std.native("port")(key).
+
+    Natives take primitive arguments only, the list forms of the filters are
+    left to std.map().
+
+    Results are memoized per evaluation. Variables read by the filters are
+    recorded, the evaluation cache keys on them like on ext vars; pure is
+    cleared by a filter result that depends on the current time.
+    """
+
+    def __init__(
+        self, temp_vars: typing.Mapping[str, typing.Any], templar: typing.Any = None
+    ):
+        self.temp_vars = temp_vars
+        self.templar = templar
+        self.var_names: typing.Set[str] = set()
+        self.pure = True
+        self._memo: typing.Dict[str, typing.Any] = {}
+        self._values: typing.Dict[str, typing.Any] = {}
+
+    def value(self, name: str) -> typing.Any:
+        """Templated variable as plain JSON data, converted on first use"""
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+
+        value = self.temp_vars[name]
+        if self.templar is not None:
+            value = self.templar.template(value)
+        value = self._values[name] = json.loads(json.dumps(value, default=to_text))
+        return value
+
+    def fingerprint(self, name: str) -> str:
+        """Evaluation cache key part of a variable read by a native"""
+        if name not in self.temp_vars:
+            return _EXT_VAR_UNDEFINED
+        return json.dumps(self.value(name), sort_keys=True)
+
+    def resolve(self, name: str) -> typing.Any:
+        """jinja2 context interface of the port filter"""
+        self.var_names.add(name)
+        return self.value(name) if name in self.temp_vars else {}
+
+    def _var(self, name: str) -> typing.Any:
+        self.var_names.add(name)
+        if name not in self.temp_vars:
+            raise ValueError(f"Undefined variable: {name}")
+        return self.value(name)
+
+    def _memoized(
+        self, name: str, func: typing.Callable[..., typing.Any]
+    ) -> typing.Callable[..., typing.Any]:
+        def call(*args: typing.Any) -> typing.Any:
+            key = json.dumps([name, args], sort_keys=True, default=str)
+            try:
+                return self._memo[key]
+            except KeyError:
+                pass
+            value = self._memo[key] = _plain(func(*args))
+            return value
+
+        return call
+
+    def _port(self, key: str) -> typing.Any:
+        from ..filter.port import port
+
+        return port(self, key)
+
+    def _dur2sec(self, dur: str) -> typing.Any:
+        from ..filter.duration_go import dur2sec
+
+        return dur2sec(dur)
+
+    def _sec2dur(self, sec: float) -> typing.Any:
+        from ..filter.duration_go import sec2dur
+
+        return sec2dur(float(sec))
+
+    def _oncalendar_dur(
+        self, spec: str, start_time: typing.Optional[str], iter_max: float
+    ) -> typing.Any:
+        from ..filter.oncalendar_dur import oncalendar_dur
+
+        if iter_max < 1:
+            raise ValueError("oncalendar_dur iter_max must be positive")
+        if start_time is None:
+            self.pure = False  # counted from now
+        return oncalendar_dur(spec, start_time, iter_max=int(iter_max))
+
+    def _url_replace(
+        self,
+        url: str,
+        pathadd: typing.Optional[str],
+        path: typing.Optional[str],
+        port: typing.Union[None, bool, str, float],
+    ) -> str:
+        from ..filter.urlreplace import url_replace
+
+        # null keeps the port, false removes it
+        if port is None:
+            port = 0
+        elif port is False:
+            port = None
+        elif isinstance(port, float):
+            port = int(port)
+        return url_replace(self, url, pathadd=pathadd, path=path, port=port)
+
+    def callbacks(
+        self,
+    ) -> typing.Dict[str, typing.Tuple[typing.Tuple[str, ...], typing.Any]]:
+        """native_callbacks argument of _jsonnet.evaluate_snippet()"""
+        # NOTE: filter modules are imported on the first call, a worker
+        # evaluates once and most templates call no natives
+
+        # NOTE: one letter parameter names, _jsonnet mixes up the names of
+        # a native with more than one multi-letter parameter
+        natives: typing.Dict[
+            str, typing.Tuple[typing.Tuple[str, ...], typing.Callable[..., typing.Any]]
+        ] = {
+            "var": (("n",), self._var),
+            "port": (("k",), self._port),
+            "dur2sec": (("d",), self._dur2sec),
+            "sec2dur": (("s",), self._sec2dur),
+            "url_replace": (("u", "a", "p", "n"), self._url_replace),
+            "oncalendar_dur": (("c", "s", "n"), self._oncalendar_dur),
+        }
+        return {
+            name: (params, self._memoized(name, func))
+            for name, (params, func) in natives.items()
+        }
+
+
+def _worker_rss(pid: int) -> typing.Optional[int]:
+    """Resident set size of a process in bytes, None if unknown"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def run_limited(
+    func: typing.Callable[[], _T],
+    timeout: typing.Optional[float] = None,
+    max_memory: typing.Optional[int] = None,
+) -> _T:
+    """Run func() in a forked worker, killed past timeout seconds or max_memory bytes of RSS.
+
+    The worker shares the caller's state copy-on-write, so func may close over
+    the templar, loader and task vars; its result must be picklable.
+    Limit violations and worker errors raise AnsibleActionFail.
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # worker
+        try:
+            os.close(rfd)
+            if max_memory and not os.path.exists("/proc/self/statm"):
+                # no RSS to poll, cap the address space instead
+                import resource
+
+                resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+            try:
+                payload = pickle.dumps((True, func()))
+            except BaseException as ex:
+                payload = pickle.dumps((False, "%s: %s" % (type(ex).__name__, ex)))
+            with os.fdopen(wfd, "wb") as f:
+                f.write(payload)
+        finally:
+            os._exit(0)
+
+    os.close(wfd)
+    deadline = time.monotonic() + timeout if timeout else None
+    chunks: typing.List[bytes] = []
+    error = None
+    try:
+        while True:
+            wait = LIMIT_POLL_INTERVAL if max_memory else None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    error = "jsonnet evaluation timed out after %s seconds" % timeout
+                    break
+                wait = remaining if wait is None else min(wait, remaining)
+
+            if select.select([rfd], [], [], wait)[0]:
+                chunk = os.read(rfd, 1 << 20)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            elif max_memory and (_worker_rss(pid) or 0) > max_memory:
+                error = (
+                    "jsonnet evaluation exceeded memory limit of %d bytes" % max_memory
+                )
+                break
+    finally:
+        os.close(rfd)
+        if error is not None:
+            os.kill(pid, signal.SIGKILL)
+        _, status = os.waitpid(pid, 0)
+
+    if error is not None:
+        raise AnsibleActionFail(error)
+    if os.WIFSIGNALED(status):
+        raise AnsibleActionFail(
+            "jsonnet evaluation worker died with signal %d" % os.WTERMSIG(status)
+        )
+    try:
+        ok, value = pickle.loads(b"".join(chunks))
+    except Exception:
+        raise AnsibleActionFail("jsonnet evaluation worker returned no result")
+    if not ok:
+        raise AnsibleActionFail(value)
+    return value
+
+
+def ext_var_names(code: str) -> typing.Optional[typing.FrozenSet[str]]:
+    """Return names read by std.extVar() in code, None if a name is computed.
+
+    Evaluation depends only on the ext vars it reads, so the values of these
+    names (of the source and its imports) key the evaluation cache.
+    """
+    names = [a or b for a, b in _EXT_VAR_RE.findall(code)]
+    if code.count("extVar") != len(names):
+        return None  # e.g. std.extVar(name) or local ev = std.extVar
+    return frozenset(names)
 
 
 class ActionModule(ActionBase):
     TRANSFERS_FILES = True
 
-    def import_callback(self, dirs, rel) -> typing.Tuple[str, bytes]:
+    def _early_needs_tmp_path(self) -> bool:
+        # render_only_to writes local files and never connects to the host
+        if self._task.args.get("render_only_to"):
+            return False
+        return super()._early_needs_tmp_path()
+
+    def _find_import(self, d: str, rel: str) -> typing.Optional[str]:
+        """Resolve import rel in d, cached for the run"""
+        # _find_needle() falls back to the role and play dirs, also for an
+        # absolute d, so the resolution depends on the task search path
+        key = RunCache.make_key(d, rel, *self._task.get_search_path())
+
+        try:
+            return IMPORT_CACHE.get(key, shared=True)
+        except KeyError:
+            pass
+
+        try:
+            full_path: typing.Optional[str] = self._find_needle(d, rel)
+        except AnsibleError:
+            full_path = None
+        IMPORT_CACHE.set(key, full_path)
+        return full_path
+
+    def _resolve_import(self, dirs, rel) -> typing.Optional[str]:
         for d in dirs:
-            try:
-                full_path = self._find_needle(d, rel)
-                with open(full_path, "rb") as f:
-                    return full_path, f.read()
-            except AnsibleError:
-                continue
+            full_path = self._find_import(d, rel)
+            if full_path is not None:
+                return full_path
+        return None
+
+    def import_callback(self, dirs, rel) -> typing.Tuple[str, bytes]:
+        full_path = self._resolve_import(dirs, rel)
+        if full_path is None:
+            raise AnsibleError(
+                "Unable to find '%s' in expected paths." % to_native(rel)
+            )
+        return full_path, _read_cached(full_path)
+
+    def _eval_key(
+        self,
+        manifest_key: str,
+        manifest: _ManifestT,
+        temp_vars: typing.Mapping[str, typing.Any],
+        natives: NativeFilters,
+        include_dir: str,
+    ) -> typing.Optional[str]:
+        """Key of an evaluation following manifest, None if an import is gone
+
+        Imports are resolved again, a file shadowing an import (e.g. added to
+        the role since a persisted evaluation) changes the key.
+        """
+        imports, ext_names, native_names = manifest
+        parts = [manifest_key]
+        try:
+            for d, rel in imports:
+                path = self._resolve_import([d, include_dir], rel)
+                if path is None:
+                    return None
+                parts += [d, rel, path, _file_digest(path)]
+        except OSError:
+            return None
+        for name in ext_names:
+            value = temp_vars[name] if name in temp_vars else _EXT_VAR_UNDEFINED
+            parts += [name, str(value)]
+        parts.append("\0natives")
+        for name in native_names:
+            parts += [name, natives.fingerprint(name)]
+        return RunCache.make_key(*parts)
+
+    def _ext_var_scan(
+        self, source: str, template_data: str, include_dir: str
+    ) -> typing.Tuple[typing.FrozenSet[str], bool]:
+        """Return ext var names read by source and its import closure.
+
+        Imports take literal paths only, so the closure is found without
+        evaluation. The names are complete unless a file computes ext var
+        names, or has an import which is not understood or not found (maybe
+        in a comment); then only the literal names found are returned.
+        """
+        names: typing.Set[str] = set()
+        complete = True
+        seen = {source}
+        stack = [(source, template_data)]
+        while stack:
+            path, code = stack.pop()
+            code_names = ext_var_names(code)
+            if code_names is None:
+                complete = False
+                code_names = frozenset(a or b for a, b in _EXT_VAR_RE.findall(code))
+            names |= code_names
+
+            for kind, dquoted, squoted, dverbatim, sverbatim in _IMPORT_RE.findall(
+                code
+            ):
+                if dquoted or squoted:
+                    rel = dquoted or squoted
+                    if "\\" in rel:
+                        complete = False  # escapes, left to the interpreter
+                        continue
+                elif dverbatim or sverbatim:
+                    rel = dverbatim.replace('""', '"') or sverbatim.replace("''", "'")
+                else:
+                    complete = False  # not a literal path, e.g. a text block
+                    continue
+                try:
+                    full_path, content = self.import_callback(
+                        [os.path.dirname(path) + "/", include_dir], rel
+                    )
+                except AnsibleError:
+                    complete = False
+                    continue
+                if kind != "import":
+                    continue  # data, not code
+                if full_path not in seen:
+                    seen.add(full_path)
+                    stack.append((full_path, to_text(content, errors="replace")))
+
+        return frozenset(names), complete
+
+    def _evaluate(
+        self,
+        source: str,
+        template_data: str,
+        temp_vars: typing.Mapping[str, typing.Any],
+        include_dir: str,
+        cache: typing.Optional[RunCache],
+        options: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+        timeout: typing.Optional[float] = None,
+        max_memory: typing.Optional[int] = None,
+    ) -> str:
+        """Evaluate jsonnet source, reusing results of equal inputs.
+
+        options are extra evaluate_snippet() arguments (max_stack, gc_*);
+        with timeout or max_memory set evaluation runs in a limited worker.
+        """
+        _jsonnet = optional_import("_jsonnet")
+        imports: typing.Dict[str, bytes] = {}
+        resolved: typing.Set[typing.Tuple[str, str]] = set()
+        natives = NativeFilters(temp_vars, self._templar)
+
+        def import_callback(d: str, rel: str) -> typing.Tuple[str, bytes]:
+            full_path, content = self.import_callback([d, include_dir], rel)
+            imports[full_path] = content
+            resolved.add((d, rel))
+            return full_path, content
+
+        def evaluate() -> str:
+            # NOTE: str() of every var (hostvars, groups...) costs megabytes
+            # per host, pass only the ext vars the template can read
+            read, complete = self._ext_var_scan(source, template_data, include_dir)
+            string_vars = {key: str(temp_vars[key]) for key in read if key in temp_vars}
+            while True:
+                try:
+                    return _jsonnet.evaluate_snippet(
+                        source,
+                        template_data,
+                        ext_vars=string_vars,
+                        import_callback=import_callback,
+                        native_callbacks=natives.callbacks(),
+                        **(options or {}),
+                    )
+                except RuntimeError as e:
+                    # names the scan could not see are added on demand
+                    m = None if complete else _EXT_VAR_UNDEFINED_RE.search(str(e))
+                    if (
+                        m is None
+                        or m.group(1) not in temp_vars
+                        or m.group(1) in string_vars
+                    ):
+                        raise
+                    display.vvv(
+                        f"jsonnet: {source} reads ext var {m.group(1)!r}"
+                        " not found by the scan, evaluating again"
+                    )
+                    string_vars[m.group(1)] = str(temp_vars[m.group(1)])
+
+        if timeout or max_memory:
+            evaluate_inline = evaluate
+
+            def evaluate() -> str:
+                # imports and natives state is recorded by the worker
+                (
+                    resultant,
+                    worker_imports,
+                    worker_resolved,
+                    var_names,
+                    pure,
+                    values,
+                ) = run_limited(
+                    lambda: (
+                        evaluate_inline(),
+                        imports,
+                        resolved,
+                        natives.var_names,
+                        natives.pure,
+                        natives._values,
+                    ),
+                    timeout,
+                    max_memory,
+                )
+                imports.update(worker_imports)
+                resolved.update(worker_resolved)
+                natives.var_names |= var_names
+                natives.pure = natives.pure and pure
+                natives._values.update(values)
+                return resultant
+
+        if cache is None:
+            return evaluate()
+
+        manifest_key = RunCache.make_key(
+            "manifest",
+            "3",  # format of manifests
+            _jsonnet.version,
+            source,
+            template_data,
+            include_dir,
+            *self._task.get_search_path(),
+        )
+        manifests: typing.List[_ManifestT]
+        try:
+            # tuples come back as lists from a persisted (JSON) cache
+            manifests = [
+                (tuple(map(tuple, imported)), tuple(ext_names), tuple(native_names))
+                for imported, ext_names, native_names in cache.get(manifest_key)
+            ]
+        except KeyError:
+            manifests = []
+
+        for manifest in manifests:
+            key = self._eval_key(
+                manifest_key, manifest, temp_vars, natives, include_dir
+            )
+            if key is not None:
+                try:
+                    return cache.get(key)
+                except KeyError:
+                    pass
+
+        resultant = evaluate()
+
+        if not natives.pure:
+            return resultant
+
+        names: typing.Set[str] = set()
+        for code in [template_data] + [
+            to_text(c, errors="replace") for c in imports.values()
+        ]:
+            code_names = ext_var_names(code)
+            if code_names is None:
+                return resultant  # reads computed ext vars, not cacheable
+            names |= code_names
+
+        manifest = (
+            tuple(sorted(resolved)),
+            tuple(sorted(names)),
+            tuple(sorted(natives.var_names)),
+        )
+        key = self._eval_key(manifest_key, manifest, temp_vars, natives, include_dir)
+        if key is not None:
+            cache.set(key, resultant)
+            if manifest not in manifests:
+                cache.set(manifest_key, (manifests + [manifest])[-EVAL_MANIFESTS:])
+        return resultant
+
+    def _transfer(
+        self,
+        task_vars: dict,
+        new_task: typing.Any,
+        result_file: str,
+        dest: str,
+        follow: bool,
+        render_only_to: typing.Optional[str],
+    ) -> dict:
+        """Transfer local result_file to dest with the copy action"""
+        if render_only_to:
+            host = to_text(task_vars.get("inventory_hostname", "localhost"))
+            return render_only_file(render_only_to, host, dest, result_file)
+
+        new_task = new_task.copy()
+        new_task.args.update(
+            dict(
+                src=result_file,
+                dest=dest,
+                follow=follow,
+            ),
+        )
+        # call with ansible.legacy prefix to eliminate collisions with collections while still allowing local override
+        copy_action = self._shared_loader_obj.action_loader.get(
+            "ansible.legacy.copy",
+            task=new_task,
+            connection=self._connection,
+            play_context=self._play_context,
+            loader=self._loader,
+            templar=self._templar,
+            shared_loader_obj=self._shared_loader_obj,
+        )
+        return copy_action.run(task_vars=task_vars)
+
+    def _read_source(self, source: str) -> str:
+        """Return template text, decrypting vaulted sources once per worker (host)"""
+        try:
+            return _SOURCE_CACHE[source]
+        except KeyError:
+            pass
+
+        # Get vault decrypted tmp file
+        try:
+            tmp_source = self._loader.get_real_file(source)
+        except AnsibleFileNotFound as e:
+            raise AnsibleActionFail("could not find src=%s, %s" % (source, to_text(e)))
+        b_tmp_source = to_bytes(tmp_source, errors="surrogate_or_strict")
 
-        raise AnsibleError("Unable to find '%s' in expected paths." % to_native(rel))
+        try:
+            with open(b_tmp_source, "rb") as f:
+                try:
+                    template_data = to_text(f.read(), errors="surrogate_or_strict")
+                except UnicodeError:
+                    raise AnsibleActionFail(
+                        "Template source files must be utf-8 encoded"
+                    )
+        finally:
+            self._loader.cleanup_tmp_file(b_tmp_source)
+
+        _SOURCE_CACHE[source] = template_data
+        return template_data
 
     def run(self, tmp=None, task_vars=None):
         """handler for template operations"""
@@ -73,7 +907,28 @@ class ActionModule(ActionBase):
         # booleans
         try:
             follow = boolean(self._task.args.get("follow", False), strict=False)
-        except TypeError as e:
+            multi = boolean(self._task.args.get("multi", False), strict=False)
+            list_extend = boolean(
+                self._task.args.get("list_extend", False), strict=False
+            )
+            eval_cache = boolean(self._task.args.get("eval_cache", True), strict=False)
+            eval_cache_max_entries = int(
+                self._task.args.get("eval_cache_max_entries", 10000)
+            )
+            eval_timeout = float(self._task.args.get("eval_timeout", 0) or 0)
+            eval_max_memory = human_to_bytes(
+                self._task.args.get("eval_max_memory", 0) or 0
+            )
+            eval_options = {
+                name: conv(self._task.args[name])
+                for name, conv in (
+                    ("max_stack", int),
+                    ("gc_min_objects", int),
+                    ("gc_growth_trigger", float),
+                )
+                if self._task.args.get(name) is not None
+            }
+        except (TypeError, ValueError) as e:
             raise AnsibleActionFail(to_native(e))
 
         # assign to local vars for ease of use
@@ -82,10 +937,14 @@ class ActionModule(ActionBase):
         state = self._task.args.get("state", None)
         format = self._task.args.get("format", "json")
         include_dir = self._task.args.get("include_dir", "templates")
+        eval_cache_dir = self._task.args.get("eval_cache_dir", None)
+        render_only_to = self._task.args.get("render_only_to", None)
+        config_overrides = self._task.args.get("config_overrides", None)
 
         output_encoding = self._task.args.get("output_encoding", "utf-8") or "utf-8"
 
         try:
+            _jsonnet = optional_import("_jsonnet")
             if _jsonnet is None:
                 raise AnsibleActionFail(
                     "jsonnet python package is required for jsonnet action plugin"
@@ -96,8 +955,18 @@ class ActionModule(ActionBase):
                 raise AnsibleActionFail("'state' cannot be specified on a template")
             elif source is None or dest is None:
                 raise AnsibleActionFail("src and dest are required")
-            elif format not in ["json", "yaml"]:
-                raise AnsibleActionFail("format needs to be either json or yaml")
+            elif format not in FORMATS:
+                raise AnsibleActionFail(
+                    "format needs to be one of %s" % ", ".join(FORMATS)
+                )
+            elif config_overrides is not None and not isinstance(
+                config_overrides, (dict, list)
+            ):
+                raise AnsibleActionFail(
+                    "config_overrides must be a dictionary or a JSON Patch list"
+                )
+            elif multi and config_overrides is not None:
+                raise AnsibleActionFail("config_overrides is not supported with multi")
             else:
                 try:
                     source = self._find_needle("templates", source)
@@ -108,75 +977,58 @@ class ActionModule(ActionBase):
             if mode == "preserve":
                 mode = "0%03o" % stat.S_IMODE(os.stat(source).st_mode)
 
-            # Get vault decrypted tmp file
-            try:
-                tmp_source = self._loader.get_real_file(source)
-            except AnsibleFileNotFound as e:
-                raise AnsibleActionFail(
-                    "could not find src=%s, %s" % (source, to_text(e))
-                )
-            b_tmp_source = to_bytes(tmp_source, errors="surrogate_or_strict")
-
             # template the source data locally & get ready to transfer
             try:
-                with open(b_tmp_source, "rb") as f:
-                    try:
-                        template_data = to_text(f.read(), errors="surrogate_or_strict")
-                    except UnicodeError:
-                        raise AnsibleActionFail(
-                            "Template source files must be utf-8 encoded"
-                        )
+                template_data = self._read_source(source)
 
                 # add ansible 'template' vars
-                temp_vars = task_vars.copy()
-                # NOTE in the case of ANSIBLE_DEBUG=1 task_vars is VarsWithSources(MutableMapping)
-                # so | operator cannot be used as it can be used only on dicts
-                # https://peps.python.org/pep-0584/#what-about-mapping-and-mutablemapping
-                temp_vars.update(
-                    generate_ansible_template_vars(
-                        self._task.args.get("src", None), source, dest
-                    )
+                temp_vars = template_vars(
+                    task_vars, self._task.args.get("src", None), source, dest
                 )
 
-                string_vars = {key: str(value) for (key, value) in temp_vars.items()}
+                cache: typing.Optional[RunCache] = None
+                if eval_cache and eval_cache_dir:
+                    cache = RunCache(
+                        "jsonnet_eval",
+                        root=os.path.expanduser(eval_cache_dir),
+                        max_entries=eval_cache_max_entries,
+                    )
+                    cache.verify_root()
+                elif eval_cache:
+                    cache = EVAL_CACHE
 
-                resultant = _jsonnet.evaluate_snippet(
+                resultant = self._evaluate(
                     source,
                     template_data,
-                    ext_vars=string_vars,
-                    import_callback=lambda dir, rel: self.import_callback(
-                        [dir, include_dir], rel
-                    ),
+                    temp_vars,
+                    include_dir,
+                    cache,
+                    eval_options,
+                    eval_timeout,
+                    eval_max_memory,
                 )
 
-                # std.manifestYamlDoc() resultant is a string inside what resulting yaml
-                result_obj: typing.Any = json.loads(resultant)
-                if isinstance(result_obj, str):
-                    resultant = result_obj
-
-                if format == "yaml":
-                    if YAML is None:
-                        raise AnsibleActionFail(
-                            "ruamel.yaml python package is required for format=yaml"
-                        )
-                    yaml = YAML(typ="safe")
-                    yaml.default_flow_style = False
-                    yaml.indent(
-                        mapping=2,
-                        sequence=4,
-                        offset=2,
+                if multi:
+                    outputs = split_outputs(get_json_backend().loads(resultant), format)
+                elif config_overrides is not None or format not in (
+                    "json",
+                    "yaml",
+                    "yaml_stream",
+                ):
+                    content = merge_document(
+                        get_json_backend().loads(resultant),
+                        format,
+                        config_overrides,
+                        list_extend,
+                        source,
                     )
-
-                    original_resultant = yaml.load(StringIO(resultant))
-                    out = StringIO()
-                    yaml.dump(original_resultant, out)
-                    resultant = out.getvalue()
+                    outputs = [("", content)]
+                else:
+                    outputs = [("", format_output(resultant, format))]
             except AnsibleAction:
                 raise
             except Exception as e:
                 raise AnsibleActionFail("%s: %s" % (type(e).__name__, to_text(e)))
-            finally:
-                self._loader.cleanup_tmp_file(b_tmp_source)
 
             new_task = self._task.copy()
             # mode is either the mode from task.args or the mode of the source file if the task.args
@@ -184,45 +1036,72 @@ class ActionModule(ActionBase):
             new_task.args["mode"] = mode
 
             # remove 'template only' options:
-            for remove in ("output_encoding", "format", "include_dir"):
+            for remove in (
+                "output_encoding",
+                "format",
+                "include_dir",
+                "render_only_to",
+                "eval_cache",
+                "eval_cache_dir",
+                "eval_cache_max_entries",
+                "eval_timeout",
+                "eval_max_memory",
+                "max_stack",
+                "gc_min_objects",
+                "gc_growth_trigger",
+                "multi",
+                "config_overrides",
+                "list_extend",
+            ):
                 new_task.args.pop(remove, None)
 
             local_tempdir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
 
             try:
-                result_file = os.path.join(local_tempdir, os.path.basename(source))
-                with open(
-                    to_bytes(result_file, errors="surrogate_or_strict"), "wb"
-                ) as f:
-                    f.write(
-                        to_bytes(
-                            resultant,
-                            encoding=output_encoding,
-                            errors="surrogate_or_strict",
-                        )
+                results = []
+                for name, content in outputs:
+                    result_file = os.path.join(
+                        local_tempdir, name or os.path.basename(source)
                     )
+                    with open(
+                        to_bytes(result_file, errors="surrogate_or_strict"), "wb"
+                    ) as f:
+                        f.write(
+                            to_bytes(
+                                content,
+                                encoding=output_encoding,
+                                errors="surrogate_or_strict",
+                            )
+                        )
 
-                new_task.args.update(
-                    dict(
-                        src=result_file,
-                        dest=dest,
-                        follow=follow,
-                    ),
-                )
-                # call with ansible.legacy prefix to eliminate collisions with collections while still allowing local override
-                copy_action = self._shared_loader_obj.action_loader.get(
-                    "ansible.legacy.copy",
-                    task=new_task,
-                    connection=self._connection,
-                    play_context=self._play_context,
-                    loader=self._loader,
-                    templar=self._templar,
-                    shared_loader_obj=self._shared_loader_obj,
-                )
-                result.update(copy_action.run(task_vars=task_vars))
+                    try:
+                        results.append(
+                            self._transfer(
+                                task_vars,
+                                new_task,
+                                result_file,
+                                os.path.join(dest, name) if multi else dest,
+                                follow,
+                                render_only_to,
+                            )
+                        )
+                    except AnsibleAction as e:
+                        if not multi:
+                            raise
+                        results.append(e.result)
             finally:
                 shutil.rmtree(to_bytes(local_tempdir, errors="surrogate_or_strict"))
 
+            if not multi:
+                result.update(results[0])
+            else:
+                result["dest"] = dest
+                result["results"] = results
+                result["changed"] = any(r.get("changed", False) for r in results)
+                if any(r.get("failed", False) for r in results):
+                    result["failed"] = True
+                    result["msg"] = "One or more files failed"
+
         except AnsibleAction as e:
             result.update(e.result)
         finally:
@@ -9,18 +9,21 @@ from datetime import timedelta
 
 from ansible.errors import AnsibleFilterTypeError
 
-try:
-    import durationpy
-except ImportError:
-    durationpy = None  # type: ignore[assignment]
-
 _StrOrList = typing.Union[str, typing.Iterable[str]]
 _FloatOrList = typing.Union[float, typing.Iterable[float]]
 
 
+def _durationpy():
+    # imported on first use: filter plugins are loaded for every task
+    try:
+        import durationpy
+    except ImportError as ex:
+        raise AnsibleFilterTypeError("durationpy python package is required") from ex
+    return durationpy
+
+
 def dur2sec(dur: _StrOrList) -> _FloatOrList:
-    if durationpy is None:
-        raise AnsibleFilterTypeError("durationpy python package is required")
+    durationpy = _durationpy()
 
     if not isinstance(dur, (str, Iterable)):
         raise AnsibleFilterTypeError(f"dur should be string or list, got: {dur!r}")
@@ -33,8 +36,7 @@ def dur2sec(dur: _StrOrList) -> _FloatOrList:
 
 
 def sec2dur(sec: _FloatOrList) -> _StrOrList:
-    if durationpy is None:
-        raise AnsibleFilterTypeError("durationpy python package is required")
+    durationpy = _durationpy()
 
     if not isinstance(sec, (float, Iterable)):
         raise AnsibleFilterTypeError(f"sec should be float or list, got: {sec!r}")
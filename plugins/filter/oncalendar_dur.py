@@ -7,11 +7,6 @@ import typing
 
 from ansible.errors import AnsibleFilterTypeError
 
-try:
-    from oncalendar import OnCalendar
-except ImportError:
-    OnCalendar = None  # type: ignore[assignment,misc]
-
 
 def oncalendar(
     spec: str,
@@ -21,8 +16,11 @@ def oncalendar(
 ) -> typing.Iterable[dt.datetime]:
     """Parse systemd OnCalendar spec and return to stream of next invocation dates"""
 
-    if OnCalendar is None:
-        raise AnsibleFilterTypeError("oncalendar python package is required")
+    # imported on first use: filter plugins are loaded for every task
+    try:
+        from oncalendar import OnCalendar
+    except ImportError as ex:
+        raise AnsibleFilterTypeError("oncalendar python package is required") from ex
 
     if isinstance(start_time, str):
         start_time = dt.datetime.fromisoformat(start_time)
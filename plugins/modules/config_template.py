@@ -17,18 +17,25 @@ description:
     set there are available to be set here.
 notes:
   - O(config_type=hjson) converted to JSON on the output.
+  - O(config_type=jsonl) (JSON Lines) applies O(config_overrides) to every document (line) of the file.
   - Has alias C(vooon.config.template).
 options:
   src:
     description:
       - Path of a Jinja2 formatted template on the local server. This can be a relative
         or absolute path.
-    required: true
+      - A list of templates of the same O(config_type) may be given (version 3.2.0). The first one is
+        the base document, the others are fragments rendered and deep merged into it in order, on the
+        controller, before O(config_overrides_layers) and O(config_overrides). Unlike
+        O(config_overrides), strings of the fragments are not split into lists.
+      - A list is not supported with O(remote_src), O(stream) or O(config_type=jsonl).
+      - Required unless O(files) is set.
+    type: raw
     default: null
   dest:
     description:
       - Location to render the template to on the remote machine.
-    required: true
+      - Required unless O(files) is set.
     default: null
   config_overrides:
     description:
@@ -41,13 +48,28 @@ options:
         headers.
       - >-
         B(JSON Patch). A list of dicts like C({"op": "add", "path": "/foo", "value": "bar"})
+      - JSON Patch operations are compiled once per playbook run and applied without
+        copying the parts of the document they do not touch.
     type: json
+  config_overrides_layers:
+    description:
+      - A list of overrides (simple merge dictionaries or JSON Patch lists) applied in order before
+        O(config_overrides), e.g. global, region and group layers. O(config_overrides) is meant for
+        the thin per-host layer.
+      - With O(cache_base) the source with the layers applied is cached for the rest of the playbook
+        run, so hosts sharing the same layers merge only O(config_overrides).
+      - The task result contains C(override_origins), a dictionary mapping the JSON Pointer of every
+        key set by the overrides to the layer which set it last.
+    type: list
+    elements: raw
+    version_added: "3.2.0"
   config_type:
     description:
       - A string value describing the target config type.
     choices:
       - ini
       - json
+      - jsonl
       - hjson
       - yaml
       - toml
@@ -88,6 +110,131 @@ options:
         sections but is not in need of rendering.
     type: bool
     default: true
+  render_native:
+    description:
+      - Render the template with Jinja native types, so a template consisting of a single
+        expression, like C({{ policy }}), produces a data structure instead of text.
+      - The data is merged with O(config_overrides) and serialized directly, skipping
+        the text parse step and the quoting/escaping issues that come with it.
+      - If the template renders to text it is parsed as usual.
+      - Not supported for O(config_type=ini). Requires O(render_template=true).
+    type: bool
+    default: false
+    version_added: "3.2.0"
+  passthrough:
+    description:
+      - When there is nothing to merge (O(config_overrides) is unset or empty), skip parsing
+        and serialization and deploy the rendered template exactly as is.
+      - With O(render_template=false) the source file is handed to the copy step directly,
+        without reading it or writing a local temporary copy. With O(remote_src=true) the
+        file is copied in place on the remote host.
+      - Ignored when O(strip_comments) or O(render_native) is set, as both need the parsed document.
+    type: bool
+    default: false
+    version_added: "3.2.0"
+  passthrough_validate:
+    description:
+      - Parse passthrough documents anyway to fail on broken syntax. The parsed result is
+        discarded and the output is still the unmodified source.
+    type: bool
+    default: false
+    version_added: "3.2.0"
+  stream:
+    description:
+      - Merge O(config_overrides) while reading the source and write the result
+        incrementally, so memory use is proportional to the nesting depth, not the document size.
+        Intended for very large JSON documents.
+      - Supported for O(config_type=json) with simple merge overrides, and for O(config_type=jsonl)
+        which is processed line by line.
+      - Requires O(render_template=false).
+      - Source key order is kept, O(json_sort_keys) is not applied for O(config_type=json).
+      - With O(remote_src=true) the file is still fetched into memory before it is streamed.
+    type: bool
+    default: false
+    version_added: "3.2.0"
+  cache_base:
+    description:
+      - With O(render_template=false) the parsed source document is cached for the rest of the
+        playbook run, keyed by the source content hash and O(config_type). Every host then applies
+        its O(config_overrides) to a copy of the cached document instead of parsing the source again.
+      - The cache is kept in the controller temporary directory (C(ANSIBLE_LOCAL_TEMP)) and is
+        removed together with it when the run ends.
+    type: bool
+    default: true
+    version_added: "3.2.0"
+  canonical:
+    description:
+      - Write a canonical, byte-stable serialization of the merged document, so equal data always
+        produces the same file, regardless of the source formatting, parser state or controller
+        Python version.
+      - Comments and formatting of the source are dropped. Mapping keys, INI sections and options
+        are sorted, YAML is written by the pure python emitter and INI multi-line values are
+        written as repeated options.
+      - Not supported with O(stream) for O(config_type=json).
+      - Independently of this option the task result contains C(config_sha256), the SHA-256 of
+        the generated file, which may be used as a cache key or restart trigger.
+    type: bool
+    default: false
+    version_added: "3.2.0"
+  files:
+    description:
+      - Render a batch of files in a single task. Every item is a dictionary of task options
+        (O(src), O(dest), O(config_overrides), ...) applied over the options of the task itself.
+      - Templates are rendered and files are transferred one by one, the parsing, merging and
+        serialization of the rendered documents runs in a pool of O(render_workers) on the
+        controller.
+      - The task result contains C(results), a result per item in the same order, it is changed
+        when any item changed and failed when any item failed; an item failure does not stop the
+        other items.
+    type: list
+    elements: dict
+    version_added: "3.2.0"
+  render_workers:
+    description:
+      - Size of the merge pool for O(files), V(0) uses the number of controller CPUs.
+      - V(1) merges the files sequentially in the worker of the task. Every Ansible fork runs its own
+        pool, so the controller runs up to C(forks) times O(render_workers) merge processes.
+    type: int
+    default: 1
+    version_added: "3.2.0"
+  render_pool:
+    description:
+      - Kind of the merge pool for O(files).
+      - V(process) forks the task worker and scales with the controller CPUs; V(thread) avoids
+        the fork but merges only as fast as one CPU allows. Platforms without C(fork) always
+        use V(thread).
+    type: str
+    default: process
+    choices: [process, thread]
+    version_added: "3.2.0"
+  schema:
+    description:
+      - JSON Schema the merged document must match, as a mapping or as a path of a JSON or YAML
+        schema file on the controller (looked up in C(files/) like other role files).
+      - Validation runs on the controller before the transfer, so a broken config fails without
+        touching the remote host; it may replace most remote O(validate) commands.
+      - For O(config_type=jsonl) every document (line) is validated. For O(config_type=ini) the
+        document is a mapping of sections to mappings of option names to string values,
+        multi-line values are lists of lines.
+      - The meta-schema check of the schema is done once per run. Errors are listed with the JSON
+        Pointer of the failed value, the task result contains all of them in C(schema_errors).
+      - Requires the C(jsonschema) python library on the controller. Not supported with
+        O(stream).
+    type: raw
+    version_added: "3.2.0"
+  render_only_to:
+    description:
+      - Render plan mode. Instead of the transfer, the file is written on the controller to
+        C(<render_only_to>/<inventory_hostname>/<dest>) and the host is never contacted; together with
+        disabled fact gathering this renders the configs of a whole inventory for review in CI.
+      - Hosts are rendered in parallel by the Ansible forks, use O(files) to also merge the files of a
+        host in parallel.
+      - Equal files are stored once in C(<render_only_to>/.objects) and hardlinked to every host
+        path. The task is changed when the host path did not have the same content yet.
+      - Copy options like O(ignore:mode) and O(ignore:owner) are not applied. Not supported with
+        O(remote_src), or with a O(dest) relative to the remote home directory (C(~/)).
+    type: path
+    version_added: "3.2.0"
   strip_comments:
     description:
       - Strip all comment and empty lines in INI
@@ -103,6 +250,17 @@ options:
       - Sort dict keys in JSON result
     type: bool
     default: false
+  json_backend:
+    description:
+      - JSON parser used for O(config_type=json) and O(config_type=hjson).
+      - V(auto) picks the fastest available backend, C(orjson) when it is installed.
+      - For O(config_type=hjson) the strict JSON parser is tried first, falling back
+        to the C(hjson) parser only when the input is not plain JSON.
+      - Output is always serialized with the same rules, so it is byte-identical for every backend.
+    type: str
+    default: auto
+    choices: [auto, json, orjson]
+    version_added: "3.2.0"
   yaml_indent_mapping:
     description:
       - YAML mapping indent
@@ -138,6 +296,62 @@ EXAMPLES = """
     config_overrides: {}
     config_type: json
 
+- name: compose config from a base template and role fragments
+  config_template:
+    src:
+      - templates/service.yaml.j2
+      - "{{ role_path }}/files/service-logging.yaml"
+      - templates/service-tls.yaml.j2
+    dest: /etc/service/service.yaml
+    config_type: yaml
+
+- name: render configs of all services in one task
+  config_template:
+    files:
+      - src: templates/nova.conf.j2
+        dest: /etc/nova/nova.conf
+        config_overrides: "{{ nova_conf_overrides }}"
+      - src: templates/neutron.conf.j2
+        dest: /etc/neutron/neutron.conf
+        config_overrides: "{{ neutron_conf_overrides }}"
+    config_type: ini
+    mode: "0640"
+
+- name: validate the merged config on the controller before transfer
+  config_template:
+    src: templates/service.yaml.j2
+    dest: /etc/service/service.yaml
+    config_overrides: "{{ service_overrides }}"
+    config_type: yaml
+    schema: service.schema.json  # files/service.schema.json
+
+- name: render configs of every host to a local tree for review
+  config_template:
+    src: templates/nova.conf.j2
+    dest: /etc/nova/nova.conf
+    config_overrides: "{{ nova_conf_overrides }}"
+    config_type: ini
+    render_only_to: "{{ config_render_plan_dir | default(omit) }}"
+
+- name: run config template json from native data
+  config_template:
+    src: templates/policy.json.j2  # contains only "{{ policy }}"
+    dest: /tmp/policy.json
+    config_type: json
+    render_native: true
+
+- name: run config template json with layered overrides
+  config_template:
+    src: files/vendor.json
+    dest: /tmp/service.json
+    render_template: false
+    config_overrides_layers:
+      - "{{ global_overrides }}"
+      - "{{ region_overrides }}"
+      - "{{ group_overrides }}"
+    config_overrides: "{{ host_overrides }}"
+    config_type: json
+
 - name: run config template yaml
   config_template:
     src: templates/test.yaml.j2
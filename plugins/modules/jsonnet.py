@@ -9,6 +9,25 @@ version_added: "2.6.0"
 description:
   - The module is an extension of the P(ansible.builtin.copy#module) module and all of attributes that can be
     set there are available to be set here.
+notes:
+  - "Collection filters are available as native functions (version 3.2.0):
+    C(std.native('port')(key)), C(std.native('dur2sec')(dur)), C(std.native('sec2dur')(seconds)),
+    C(std.native('url_replace')(url, pathadd, path, port)) where a null argument keeps the part and
+    port false removes it, and C(std.native('oncalendar_dur')(spec, start_time, count)).
+    Results are memoized per evaluation."
+  - Native functions take primitive arguments only, use C(std.map()) for lists.
+  - The C(port) and C(url_replace) natives read the C(ports_overrides) and C(ports) variables, their values
+    key O(eval_cache) like ext vars; C(oncalendar_dur) with a null start_time depends on the current
+    time and disables O(eval_cache) for the evaluation.
+  - "Only the variables referenced by literal C(std.extVar('name')) calls in the template and its imports
+    are passed as ext vars, as strings (version 3.2.0). Templates computing ext var names, or with imports which can not be followed
+    (not found, e.g. in a comment, or not a plain string path), get the other variables they read on demand, evaluating
+    again for each one.
+    C(std.native('var')(name)) returns the templated variable with its type kept, e.g. C(std.native('var')('groups'))
+    is an object of lists, and fails on undefined variables."
+  - Resolved import paths and O(eval_cache) results are shared by all hosts of the run. The template
+    source (vault decrypted) and imported files are read once per forked worker, which serves the loop
+    items of one host, not other hosts; decrypted sources are kept in memory only and never written to disk.
 options:
   src:
     description:
@@ -24,12 +43,118 @@ options:
   format:
     description:
       - Template result format
+      - V(yaml) dumps the evaluated value without reparsing it; a string value, e.g. the output of
+        C(std.manifestYamlDoc()) or C(std.manifestYamlStream()), is taken as YAML text and
+        reformatted, keeping all documents of a stream.
+      - V(yaml_stream) (version 3.2.0) writes every element of the evaluated array as a document
+        of a YAML stream.
+      - V(ini) and V(toml) (version 3.2.0) are written by the P(vooon.config.config_template#module) engines.
+        For V(ini) the template evaluates to an object of sections, top level values go to the
+        C(DEFAULT) section; a string value, e.g. C(std.manifestIni()), is parsed as the file.
+      - V(env) (version 3.2.0) writes an object as C(NAME=value) lines quoted for C(sh) and systemd
+        C(EnvironmentFile), non-string values as JSON, null values are skipped.
     default: json
-    choices: [json, yaml]
+    choices: [json, yaml, yaml_stream, ini, toml, env]
+  config_overrides:
+    description:
+      - Overrides merged into the evaluated document before it is written, as in
+        P(vooon.config.config_template#module), a simple merge dictionary or a JSON Patch list.
+      - For V(yaml_stream) the overrides apply to every document.
+      - The evaluated value must be data, not a manifested string, except for O(format=ini) and O(format=toml).
+      - Not supported with O(multi).
+      - JSON is written in the jsonnet output formatting, keys added by the overrides are sorted in
+        and numbers are double precision, as in jsonnet. Without overrides the evaluation result is written as is.
+    type: raw
+    version_added: "3.2.0"
+  list_extend:
+    description:
+      - Simple merge O(config_overrides) lists extend lists of the document instead of replacing them.
+    type: bool
+    default: false
+    version_added: "3.2.0"
   include_dir:
     description:
       - Template include dir
     default: templates
+  multi:
+    description:
+      - Multi-output mode, like C(jsonnet -m). The template evaluates to an object of file names
+        to documents, every document is written to a file of that name in the O(dest) directory.
+      - Files named C(*.json) are written as JSON, C(*.yaml) and C(*.yml) as YAML, C(*.ini), C(*.toml)
+        and C(*.env) in those formats, others in O(format). String documents, e.g. C(std.manifestIniFile()), are written as is.
+      - JSON files are formatted exactly like C(jsonnet -m) writes them.
+      - One evaluation produces all the files, the task result contains C(results) with the result
+        of every file, it is changed when any file changed.
+      - File names must not contain directories, the O(dest) directory must exist.
+    type: bool
+    default: false
+    version_added: "3.2.0"
+  eval_cache:
+    description:
+      - Reuse the evaluation result for equal inputs instead of evaluating the template again,
+        e.g. for every host of a play when the template does not read host specific variables.
+      - Inputs are the template, the content of every imported file and the values of the ext
+        vars read by literal C(std.extVar("name")) calls in them. Templates computing the ext var
+        name are always evaluated.
+      - Results are shared by all hosts and tasks of the run.
+    type: bool
+    default: true
+    version_added: "3.2.0"
+  eval_cache_dir:
+    description:
+      - Controller directory keeping evaluation results across runs, instead of the temporary
+        directory of the run.
+      - The rendered results are stored there as JSON, use a directory that is not readable by others.
+        The task fails when the directory is not owned by the controller user or is writable by group or others.
+      - Imports are resolved again on every lookup, a file which now shadows an import invalidates the result.
+    type: path
+    version_added: "3.2.0"
+  eval_cache_max_entries:
+    description:
+      - Number of entries kept in O(eval_cache_dir), the least recently used ones are evicted.
+    type: int
+    default: 10000
+    version_added: "3.2.0"
+  eval_timeout:
+    description:
+      - Fail the task when evaluation takes longer than this number of seconds.
+      - With O(eval_timeout) or O(eval_max_memory) set, evaluation runs in a forked worker process
+        which is killed on the limit violation.
+      - V(0) disables the limit.
+    type: float
+    default: 0
+    version_added: "3.2.0"
+  eval_max_memory:
+    description:
+      - Fail the task when the evaluation worker resident set size grows over this size,
+        in bytes or with a unit, e.g. V(512M).
+      - Where RSS can not be polled (non-Linux controllers) the address space of the worker is limited instead.
+      - V(0) disables the limit.
+    type: raw
+    default: 0
+    version_added: "3.2.0"
+  max_stack:
+    description:
+      - Maximum Jsonnet stack depth, the interpreter default is V(500).
+    type: int
+    version_added: "3.2.0"
+  gc_min_objects:
+    description:
+      - Number of objects allocated before the Jsonnet garbage collector runs, the interpreter default is V(1000).
+    type: int
+    version_added: "3.2.0"
+  gc_growth_trigger:
+    description:
+      - Heap growth factor which triggers the Jsonnet garbage collector, the interpreter default is V(2.0).
+    type: float
+    version_added: "3.2.0"
+  render_only_to:
+    description:
+      - Write the result on the controller to C(<render_only_to>/<inventory_hostname>/<dest>)
+        instead of the transfer, without contacting the host.
+      - Equal files are hardlinked to one copy, see P(vooon.config.config_template#module).
+    type: path
+    version_added: "3.2.0"
 
 # extends_documentation_fragment:
 #   - action_common_attributes
@@ -50,4 +175,19 @@ EXAMPLES = """
     src: node.jsonnet
     dest: /etc/prometheus/rules/node.yml
     format: yaml
+
+- name: Render all dashboards from one evaluation
+  jsonnet:
+    src: dashboards.jsonnet  # { ['%s.json' % d.uid]: d for d in dashboards }
+    dest: /var/lib/grafana/dashboards
+    multi: true
+
+- name: Render a service config with per-host overrides
+  jsonnet:
+    src: service.jsonnet  # { main: { port: 80, workers: 4 } }
+    dest: /etc/service.ini
+    format: ini
+    config_overrides:
+      main:
+        workers: "{{ ansible_processor_vcpus }}"
 """
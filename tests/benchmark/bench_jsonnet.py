@@ -0,0 +1,423 @@
+# Copyright: (c) 2024, Sardina Systems Ltd.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Jsonnet action benchmark.
+
+Runs the jsonnet action plugin with a local connection for a number of fake
+hosts over a synthetic libsonnet tree, and reports time and peak RSS of every
+phase of the action, as a table or as JSON for tracking regressions.
+
+Every host runs in a forked worker, like Ansible task workers do, so per
+worker caches start cold for every host.
+
+    python -m tests.benchmark.bench_jsonnet --hosts 20 --depth 6 --width 3
+    python -m tests.benchmark.bench_jsonnet --items 20000 --json result.json
+
+Phases nest: "evaluate" includes "import_callback" and the typed variable
+reads of "ext_vars"; "run" is the whole action.
+"""
+
+import argparse
+import functools
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import typing
+
+PHASES = ("run", "ext_vars", "evaluate", "import_callback", "format", "transfer")
+
+_HWM_RESET = "/proc/self/clear_refs"
+
+
+class PhaseRecorder:
+    """Time and peak RSS of (nested) phases of one worker.
+
+    On Linux the peak RSS (VmHWM) is reset at every phase boundary, so a
+    phase reports its own peak; elsewhere the peak of the worker so far.
+    """
+
+    def __init__(self) -> None:
+        self.stats: typing.Dict[str, typing.Dict[str, float]] = {}
+        self._open: typing.List[str] = []
+        self._peaks: typing.Dict[str, int] = {}
+        self._can_reset = os.access(_HWM_RESET, os.W_OK)
+
+    def _peak_rss(self) -> int:
+        if self._can_reset:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _boundary(self) -> None:
+        peak = self._peak_rss()
+        for name in self._open:
+            self._peaks[name] = max(self._peaks.get(name, 0), peak)
+        if self._can_reset:
+            with open(_HWM_RESET, "w") as f:
+                f.write("5")
+
+    def begin(self, name: str) -> float:
+        self._boundary()
+        self._open.append(name)
+        return time.perf_counter()
+
+    def end(self, name: str, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self._boundary()
+        self._open.remove(name)
+        stat = self.stats.setdefault(
+            name, {"calls": 0, "total_s": 0.0, "max_s": 0.0, "peak_rss": 0}
+        )
+        stat["calls"] += 1
+        stat["total_s"] += elapsed
+        stat["max_s"] = max(stat["max_s"], elapsed)
+        stat["peak_rss"] = max(stat["peak_rss"], self._peaks.pop(name, 0))
+
+    def add(self, name: str, elapsed: float) -> None:
+        """Account time measured by the caller, without RSS"""
+        stat = self.stats.setdefault(
+            name, {"calls": 0, "total_s": 0.0, "max_s": 0.0, "peak_rss": 0}
+        )
+        stat["calls"] += 1
+        stat["total_s"] += elapsed
+        stat["max_s"] = max(stat["max_s"], elapsed)
+
+    def wrap(self, owner: typing.Any, attr: str, name: str) -> None:
+        """Record calls of owner.attr as phase name, nested calls count once"""
+        func = getattr(owner, attr)
+        recorder = self
+
+        def wrapper(*args, **kwargs):
+            if name in recorder._open:
+                return func(*args, **kwargs)
+            started = recorder.begin(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.end(name, started)
+
+        setattr(owner, attr, wrapper)
+
+
+def make_tree(
+    root: str,
+    depth: int,
+    width: int,
+    items: int,
+    ext_vars: int,
+    computed_ext_var: bool,
+) -> None:
+    """Write templates/main.jsonnet and a layered import graph of libsonnet files.
+
+    Every file of a level imports every file of the next level, leaves read
+    the ext vars round robin.
+    """
+    templates = os.path.join(root, "templates")
+    os.makedirs(os.path.join(templates, "lib"), exist_ok=True)
+
+    for level in range(depth):
+        for idx in range(width):
+            if level + 1 < depth:
+                deps = [f"l{level + 1}_{j}" for j in range(width)]
+                body = "".join(
+                    f"local {dep} = import '{dep}.libsonnet';\n" for dep in deps
+                )
+                fields = f"deps: [{', '.join(dep + '.name' for dep in deps)}],"
+            else:
+                body = ""
+                names = [f"e_{k}" for k in range(ext_vars) if k % width == idx] or [
+                    "inventory_hostname"
+                ]
+                fields = "vars: {%s}," % ", ".join(
+                    f"{n}: std.extVar('{n}')" for n in names
+                )
+            path = os.path.join(templates, "lib", f"l{level}_{idx}.libsonnet")
+            with open(path, "w") as f:
+                f.write(f"{body}{{ name: 'l{level}_{idx}', {fields} }}\n")
+
+    libs = [f"l0_{idx}" for idx in range(width)] if depth else []
+    computed = "computed: std.extVar(std.extVar('name'))," if computed_ext_var else ""
+    with open(os.path.join(templates, "main.jsonnet"), "w") as f:
+        f.write(
+            "".join(f"local {lib} = import 'lib/{lib}.libsonnet';\n" for lib in libs)
+            + "local host = std.extVar('inventory_hostname');\n"
+            + "{\n"
+            + "  host: host,\n"
+            + f"  libs: [{', '.join(libs)}],\n"
+            + f"  {computed}\n"
+            + "  items: [\n"
+            + "    { id: i, name: 'item-' + i, host: host, tags: ['a', 'b'],"
+            + " value: { x: i, y: [i, i + 1] } }\n"
+            + f"    for i in std.range(1, {items})\n"
+            + "  ],\n"
+            + "}\n"
+        )
+
+
+def make_task_vars(
+    hosts: int, ext_vars: int, facts: int
+) -> typing.Dict[str, typing.Any]:
+    """Vars shared by all hosts: hostvars with fake facts, groups and ext vars"""
+    names = [f"host{idx:05d}" for idx in range(hosts)]
+    hostvars = {
+        name: {
+            "inventory_hostname": name,
+            "ansible_host": f"10.{idx >> 16 & 255}.{idx >> 8 & 255}.{idx & 255}",
+            "ansible_facts": {
+                f"fact_{k}": f"value {k} of {name}" for k in range(facts)
+            },
+        }
+        for idx, name in enumerate(names)
+    }
+    task_vars: typing.Dict[str, typing.Any] = {
+        "hostvars": hostvars,
+        "groups": {"all": names, "ungrouped": names},
+        "ansible_facts": {},
+        "ansible_python_interpreter": sys.executable,
+        "name": "e_0",
+    }
+    task_vars.update({f"e_{k}": f"value-{k}-" + "x" * 32 for k in range(ext_vars)})
+    return task_vars
+
+
+def run_benchmark(opts: argparse.Namespace, work: str) -> typing.Dict[str, typing.Any]:
+    os.environ["ANSIBLE_LOCAL_TEMP"] = os.path.join(work, "tmp")
+    os.environ.setdefault("ANSIBLE_DEPRECATION_WARNINGS", "False")
+
+    from ansible import context
+    from ansible.module_utils.common.collections import ImmutableDict
+
+    context.CLIARGS = ImmutableDict(
+        connection="local", verbosity=0, check=False, diff=False
+    )
+
+    import ansible.plugins.loader as plugin_loader
+    from ansible.parsing.dataloader import DataLoader
+    from ansible.playbook.play_context import PlayContext
+    from ansible.playbook.task import Task
+    from ansible.template import Templar
+
+    # the collection is this checkout
+    collections = os.path.join(work, "collections")
+    os.makedirs(os.path.join(collections, "ansible_collections", "vooon"))
+    os.symlink(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        os.path.join(collections, "ansible_collections", "vooon", "config"),
+    )
+    plugin_loader.init_plugin_loader([collections])
+
+    import _jsonnet
+    from ansible_collections.vooon.config.plugins.action import (
+        jsonnet as action_jsonnet,
+    )
+
+    make_tree(
+        work, opts.depth, opts.width, opts.items, opts.ext_vars, opts.computed_ext_var
+    )
+    shared_vars = make_task_vars(opts.hosts, opts.ext_vars, opts.facts)
+    out_dir = os.path.join(work, "out")
+    os.makedirs(out_dir)
+
+    args: typing.Dict[str, typing.Any] = {
+        "src": "main.jsonnet",
+        "dest": "main." + ("yml" if opts.format.startswith("yaml") else opts.format),
+        "format": opts.format,
+        "eval_cache": opts.eval_cache,
+    }
+    if not opts.copy:
+        args["render_only_to"] = out_dir
+
+    loader = DataLoader()
+    loader.set_basedir(work)
+
+    def run_host(hostname: str) -> typing.Dict[str, typing.Any]:
+        recorder = PhaseRecorder()
+        action_cls = action_jsonnet.ActionModule
+        recorder.wrap(action_cls, "import_callback", "import_callback")
+        recorder.wrap(action_cls, "_transfer", "transfer")
+        recorder.wrap(action_jsonnet.NativeFilters, "value", "ext_vars")
+        for func in ("format_output", "merge_document", "split_outputs"):
+            recorder.wrap(action_jsonnet, func, "format")
+
+        # ext var marshalling: from the import closure scan to the interpreter
+        scan = action_cls._ext_var_scan
+        evaluate_snippet = _jsonnet.evaluate_snippet
+        scan_started: typing.List[float] = []
+
+        def timed_scan(self, *a, **kw):
+            scan_started.append(time.perf_counter())
+            return scan(self, *a, **kw)
+
+        def timed_evaluate_snippet(*a, **kw):
+            if scan_started:
+                recorder.add("ext_vars", time.perf_counter() - scan_started.pop())
+            started = recorder.begin("evaluate")
+            try:
+                return evaluate_snippet(*a, **kw)
+            finally:
+                recorder.end("evaluate", started)
+
+        action_cls._ext_var_scan = timed_scan
+        _jsonnet.evaluate_snippet = timed_evaluate_snippet
+
+        task_vars = dict(shared_vars, inventory_hostname=hostname)
+        task_args = dict(args)
+        if opts.copy:
+            task_args["dest"] = os.path.join(out_dir, f"{hostname}.{args['dest']}")
+        task = Task.load(
+            {"name": "bench", "vooon.config.jsonnet": task_args}, loader=loader
+        )
+        play_context = PlayContext()
+        play_context.connection = "local"
+        connection = plugin_loader.connection_loader.get(
+            "local", play_context, os.devnull
+        )
+        action = action_cls(
+            task,
+            connection,
+            play_context,
+            loader,
+            Templar(loader=loader, variables=task_vars),
+            plugin_loader,
+        )
+
+        started = recorder.begin("run")
+        result = action.run(task_vars=task_vars)
+        recorder.end("run", started)
+        if result.get("failed"):
+            raise RuntimeError(f"{hostname}: {result.get('msg')}")
+        return recorder.stats
+
+    started = time.perf_counter()
+    phases: typing.Dict[str, typing.Dict[str, float]] = {}
+    for idx in range(opts.hosts):
+        host_stats = action_jsonnet.run_limited(
+            functools.partial(run_host, f"host{idx:05d}")
+        )
+        for name, stat in host_stats.items():
+            total = phases.setdefault(
+                name, {"calls": 0, "total_s": 0.0, "max_s": 0.0, "peak_rss": 0}
+            )
+            total["calls"] += stat["calls"]
+            total["total_s"] += stat["total_s"]
+            total["max_s"] = max(total["max_s"], stat["max_s"])
+            total["peak_rss"] = max(total["peak_rss"], stat["peak_rss"])
+    wall = time.perf_counter() - started
+
+    output_bytes = sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, filenames in os.walk(out_dir)
+        for name in filenames
+    )
+    return {
+        "params": {
+            key: value
+            for key, value in vars(opts).items()
+            if key not in ("json", "keep")
+        },
+        "jsonnet_version": _jsonnet.version,
+        "python": sys.version.split()[0],
+        "wall_s": wall,
+        "output_bytes": output_bytes,
+        "phases": {
+            name: dict(
+                phases[name],
+                mean_s=phases[name]["total_s"] / phases[name]["calls"],
+            )
+            for name in PHASES
+            if name in phases
+        },
+    }
+
+
+def format_table(report: typing.Dict[str, typing.Any]) -> str:
+    lines = [
+        "%-16s %7s %10s %10s %10s %14s"
+        % ("phase", "calls", "total s", "mean ms", "max ms", "peak RSS MiB")
+    ]
+    for name, stat in report["phases"].items():
+        lines.append(
+            "%-16s %7d %10.3f %10.2f %10.2f %14s"
+            % (
+                name,
+                stat["calls"],
+                stat["total_s"],
+                stat["mean_s"] * 1000,
+                stat["max_s"] * 1000,
+                "%.1f" % (stat["peak_rss"] / 2**20) if stat["peak_rss"] else "-",
+            )
+        )
+    lines.append(
+        "hosts %d, wall %.3f s, output %d bytes"
+        % (report["params"]["hosts"], report["wall_s"], report["output_bytes"])
+    )
+    return "\n".join(lines)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--hosts", type=int, default=10, help="number of fake hosts")
+    parser.add_argument(
+        "--depth", type=int, default=5, help="levels of the import graph"
+    )
+    parser.add_argument(
+        "--width", type=int, default=3, help="libsonnet files per level"
+    )
+    parser.add_argument("--items", type=int, default=2000, help="items in the output")
+    parser.add_argument(
+        "--ext-vars", type=int, default=100, help="ext vars read by the template"
+    )
+    parser.add_argument(
+        "--facts", type=int, default=50, help="fake facts per host in hostvars"
+    )
+    parser.add_argument(
+        "--computed-ext-var",
+        action="store_true",
+        help="read an ext var by a computed name, every var is passed then",
+    )
+    parser.add_argument(
+        "--format",
+        default="yaml",
+        choices=["json", "yaml", "yaml_stream", "ini", "toml", "env"],
+    )
+    parser.add_argument("--eval-cache", action="store_true", help="enable eval_cache")
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="deploy with the copy module instead of render_only_to",
+    )
+    parser.add_argument(
+        "--json", metavar="PATH", help="write the report as JSON, - for stdout"
+    )
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    opts = parser.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix="bench_jsonnet_")
+    try:
+        report = run_benchmark(opts, work)
+    finally:
+        if opts.keep:
+            print(f"work directory: {work}", file=sys.stderr)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    if opts.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print(format_table(report))
+        if opts.json:
+            with open(opts.json, "w") as f:
+                json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,8 +5,13 @@
 Test config_template funcs
 """
 
+import copy
+import json
 import pathlib
 import sys
+import tracemalloc
+
+import pytest
 
 actions_path = pathlib.Path(__file__).parent / ".." / ".." / "plugins" / "action"
 sys.path.insert(0, str(actions_path.absolute()))
@@ -272,3 +277,881 @@ def test_simple_merger_splits_comma_and_newline_strings():
 
     assert out["csv_like"] == ["foo", "bar"]
     assert out["multiline_text"] == ["foo", "bar"]
+
+
+def test_type_merger_accepts_native_documents():
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    native = {"policy": {"quote": 'say "hi"\\', "rules": ["a", "b"]}}
+
+    args = config_template.TaskArgs(config_type="json", json_indent=0)
+    args._patcher = config_template.SimpleMerger(
+        new_items={"policy": {"rules": ["c"]}}, list_extend=True
+    )
+    resultant, merged = action.type_merger(native, args)
+    assert resultant == (
+        '{"policy": {"quote": "say \\"hi\\"\\\\", "rules": ["a", "b", "c"]}}'
+    )
+    assert merged["policy"]["rules"] == ["a", "b", "c"]
+
+    args = config_template.TaskArgs(config_type="yaml")
+    resultant, _ = action.type_merger({"key": 'say "hi"'}, args)
+    assert resultant == 'key: say "hi"\n'
+
+    args = config_template.TaskArgs(config_type="toml")
+    resultant, _ = action.type_merger({"table": {"key": 1}}, args)
+    assert resultant == "[table]\nkey = 1\n"
+
+
+def test_type_merger_native_ini_fails():
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    args = config_template.TaskArgs(config_type="ini")
+
+    with pytest.raises(config_template.AnsibleActionFail, match="Native"):
+        action.type_merger({"DEFAULT": {}}, args)
+
+
+class _FakeTask:
+    def __init__(self, args):
+        self.args = args
+
+
+class _FakeLoader:
+    _basedir = "/nonexistent"
+
+
+def _action_with_args(task_args):
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    action._task = _FakeTask(task_args)
+    action._loader = _FakeLoader()
+    action._find_needle = lambda dirname, needle: needle  # type: ignore[method-assign]
+    action._remote_expand_user = lambda path: path  # type: ignore[method-assign]
+    return action
+
+
+def test_passthrough_without_overrides_transfers_source_directly():
+    action = _action_with_args(
+        {
+            "src": "/srv/vendor/nova.conf.sample",
+            "dest": "/etc/nova/nova.conf",
+            "render_template": False,
+            "passthrough": True,
+        }
+    )
+
+    args = action._load_task_args(task_vars={})
+
+    assert args._passthrough is True
+    assert args._direct_src is True
+    assert args.source == "/srv/vendor/nova.conf.sample"
+
+
+def test_passthrough_disabled_by_overrides_and_validate():
+    action = _action_with_args(
+        {
+            "src": "nova.conf.j2",
+            "dest": "/etc/nova/nova.conf",
+            "render_template": False,
+            "passthrough": True,
+            "config_overrides": {"DEFAULT": {"debug": True}},
+        }
+    )
+    args = action._load_task_args(task_vars={})
+    assert args._passthrough is False
+    assert args._direct_src is False
+
+    action = _action_with_args(
+        {
+            "src": "nova.conf.j2",
+            "dest": "/etc/nova/nova.conf",
+            "render_template": False,
+            "passthrough": True,
+            "passthrough_validate": True,
+        }
+    )
+    args = action._load_task_args(task_vars={})
+    assert args._passthrough is True
+    assert args._direct_src is False
+
+
+def test_simple_merger_copy_on_write_shares_untouched_branches():
+    base = {
+        "touched": {"a": 1, "list": [1]},
+        "untouched": {"deep": {"x": 1}},
+    }
+    merger = config_template.SimpleMerger(
+        new_items={"touched": {"b": 2, "list": [2]}}, list_extend=True
+    )
+
+    out = merger.apply(base, in_place=False)
+
+    assert out == {
+        "touched": {"a": 1, "b": 2, "list": [1, 2]},
+        "untouched": {"deep": {"x": 1}},
+    }
+    assert base == {
+        "touched": {"a": 1, "list": [1]},
+        "untouched": {"deep": {"x": 1}},
+    }
+    assert out["untouched"] is base["untouched"]
+    assert out["touched"] is not base["touched"]
+
+
+def test_simple_merger_deep_nesting_is_not_recursive():
+    depth = sys.getrecursionlimit() * 2
+    new_items: dict = {}
+    node = new_items
+    for _ in range(depth):
+        node["n"] = {}
+        node = node["n"]
+    node["leaf"] = "a,b"
+
+    out = config_template.SimpleMerger(new_items=new_items).apply({})
+
+    for _ in range(depth):
+        out = out["n"]
+    assert out == {"leaf": ["a", "b"]}
+
+
+def test_static_base_parsed_once_per_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(config_template.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(config_template, "BASE_CACHE", config_template.RunCache("t"))
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    calls = []
+
+    def loads(resultant):
+        calls.append(resultant)
+        return config_template.json.loads(resultant)
+
+    source = '{"common": {"a": 1}, "hosts": []}'
+    outputs = []
+    for host in ("h1", "h2", "h3"):
+        # every host runs in a new fork: only the on-disk cache survives
+        config_template.BASE_CACHE._blobs.clear()
+        args = config_template.TaskArgs(
+            config_type="json", render_template=False, json_indent=0
+        )
+        args._patcher = config_template.SimpleMerger(
+            new_items={"hosts": [host]}, list_extend=True
+        )
+        outputs.append(action.return_config_overrides_json(source, args, loads)[0])
+
+    # same fork, loop over items: shared document, merged copy-on-write
+    for host in ("h4", "h5"):
+        args = config_template.TaskArgs(
+            config_type="json", render_template=False, json_indent=0
+        )
+        args._patcher = config_template.SimpleMerger(
+            new_items={"hosts": [host]}, list_extend=True
+        )
+        outputs.append(action.return_config_overrides_json(source, args, loads)[0])
+
+    assert len(calls) == 1
+    assert outputs == [
+        '{"common": {"a": 1}, "hosts": ["%s"]}' % host
+        for host in ("h1", "h2", "h3", "h4", "h5")
+    ]
+
+
+PATCH_BASE = {
+    "a": {"b": [1, 2, 3], "c": True},
+    "untouched": {"deep": {"x": 1}},
+}
+
+PATCH_OPERATIONS = [
+    [{"op": "add", "path": "/a/b/-", "value": 4}],
+    [{"op": "add", "path": "/a/b/0", "value": 0}, {"op": "remove", "path": "/a/b/1"}],
+    [{"op": "replace", "path": "/a/c", "value": {"n": 1}}],
+    [{"op": "move", "from": "/a/b", "path": "/moved"}],
+    [{"op": "copy", "from": "/untouched", "path": "/a/copy"}],
+    [{"op": "test", "path": "/a/c", "value": True}],
+    [{"op": "test", "path": "/a/b/0", "value": True}],
+    [{"op": "remove", "path": "/missing"}],
+    [{"op": "add", "path": "/a/b/9", "value": 1}],
+    [{"op": "move", "from": "/a/b", "path": "/a/b"}],
+    [{"op": "move", "from": "/missing", "path": "/missing"}],
+    [{"op": "add", "path": "", "value": {"root": 1}}],
+]
+
+
+@pytest.mark.parametrize("in_place", [False, True])
+@pytest.mark.parametrize("operations", PATCH_OPERATIONS)
+def test_patch_plan_matches_jsonpatch(operations, in_place):
+    jsonpatch = pytest.importorskip("jsonpatch")
+    base = copy.deepcopy(PATCH_BASE)
+
+    try:
+        expected = jsonpatch.JsonPatch(operations).apply(copy.deepcopy(base))
+    except (jsonpatch.JsonPatchException, jsonpatch.JsonPointerException):
+        with pytest.raises(config_template.AnsibleActionFail):
+            config_template.PatchPlan(operations).apply(base, in_place=in_place)
+    else:
+        out = config_template.PatchPlan(operations).apply(base, in_place=in_place)
+        assert out == expected
+
+    if not in_place:
+        assert base == PATCH_BASE
+
+
+def test_patch_plan_copy_on_write_shares_untouched_branches():
+    base = copy.deepcopy(PATCH_BASE)
+    plan = config_template.PatchPlan(
+        [{"op": "add", "path": "/a/b/-", "value": i} for i in range(2000)]
+    )
+
+    out = plan.apply(base, in_place=False)
+
+    assert out["a"]["b"] == [1, 2, 3] + list(range(2000))
+    assert base == PATCH_BASE
+    assert out["untouched"] is base["untouched"]
+
+
+def test_patch_plan_rejects_invalid_operations():
+    with pytest.raises(config_template.AnsibleActionFail, match="#1"):
+        config_template.PatchPlan(
+            [{"op": "test", "path": "/a", "value": 1}, {"op": "add", "path": "/a"}]
+        )
+    with pytest.raises(config_template.AnsibleActionFail, match="into itself"):
+        config_template.PatchPlan([{"op": "move", "from": "/a", "path": "/a/b"}])
+
+
+def test_compile_overrides_caches_patch_plans(tmp_path, monkeypatch):
+    monkeypatch.setattr(config_template.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(config_template, "PLAN_CACHE", config_template.RunCache("t"))
+    operations = [{"op": "add", "path": "/a", "value": 1}]
+
+    first = config_template.compile_overrides(operations)
+    second = config_template.compile_overrides(copy.deepcopy(operations))
+    third = config_template.compile_overrides(copy.deepcopy(operations))
+
+    assert isinstance(first, config_template.PatchPlan)
+    assert second.steps == first.steps
+    assert third is second
+    assert isinstance(
+        config_template.compile_overrides({"a": 1}), config_template.SimpleMerger
+    )
+    assert config_template.compile_overrides(None) is None
+
+
+LAYERS = [
+    {"log": {"level": "info", "targets": ["file"]}, "region": "none"},
+    None,
+    [{"op": "add", "path": "/region", "value": "eu-1"}],
+    {"log": {"targets": ["syslog"]}},
+]
+
+
+def test_layered_overrides_match_sequential_merge():
+    base = {"log": {"level": "debug"}, "keep": 1}
+    patcher = config_template.compile_overrides(
+        {"log": {"level": "warn"}}, list_extend=True, layers=LAYERS
+    )
+
+    out = patcher.apply(copy.deepcopy(base))
+
+    assert out == {
+        "log": {"level": "warn", "targets": ["file", "syslog"]},
+        "region": "eu-1",
+        "keep": 1,
+    }
+    assert patcher.origins == {
+        "/log/level": "config_overrides",
+        "/log/targets": "config_overrides_layers[3]",
+        "/region": "config_overrides_layers[2]",
+    }
+
+
+def test_layered_overrides_shared_layers_applied_once_per_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(config_template.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(config_template, "BASE_CACHE", config_template.RunCache("b"))
+    monkeypatch.setattr(config_template, "LAYER_CACHE", config_template.RunCache("l"))
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    applied = []
+
+    class CountingMerger(config_template.SimpleMerger):
+        def apply(self, base_items, in_place=True):
+            applied.append(self.new_items)
+            return super().apply(base_items, in_place)
+
+    source = '{"hosts": [], "region": "none"}'
+    outputs = []
+    for host in ("h1", "h2", "h3"):
+        # every host runs in a new fork: only the on-disk caches survive
+        config_template.BASE_CACHE.clear()
+        config_template.LAYER_CACHE.clear()
+        args = config_template.TaskArgs(
+            config_type="json", render_template=False, json_indent=0
+        )
+        host_layer = CountingMerger(new_items={"hosts": [host]})
+        args._patcher = config_template.LayeredPatcher(
+            [
+                ("global", {"region": "eu"}, CountingMerger({"region": "eu"})),
+                ("host", {"hosts": [host]}, host_layer),
+            ],
+            cached=1,
+        )
+        outputs.append(action.return_config_overrides_json(source, args, json.loads)[0])
+
+    assert outputs == [
+        '{"hosts": ["%s"], "region": "eu"}' % host for host in ("h1", "h2", "h3")
+    ]
+    assert applied.count({"region": "eu"}) == 1
+    assert len(applied) == 4
+
+
+@pytest.mark.parametrize("in_place", [True, False])
+def test_layered_overrides_do_not_alias_layer_lists(in_place):
+    layers = [{"servers": ["a"]}, {"servers": ["b"]}, ["c"]]
+    patcher = config_template.compile_overrides(
+        {"servers": ["d"]}, list_extend=True, layers=layers[:2]
+    )
+
+    for _ in range(2):
+        assert patcher.apply({"other": 1}, in_place=in_place) == {
+            "other": 1,
+            "servers": ["a", "b", "d"],
+        }
+    assert layers[:2] == [{"servers": ["a"]}, {"servers": ["b"]}]
+
+    merger = config_template.SimpleMerger(layers[2], list_extend=False)
+    merger.apply([]).append("e")
+    assert layers[2] == ["c"]
+
+
+def test_layered_overrides_origins_follow_json_patch():
+    patcher = config_template.compile_overrides(
+        [{"op": "move", "from": "/a/b", "path": "/c"}],
+        layers=[{"a": {"b": 1, "d": 2}}, [{"op": "remove", "path": "/a/d"}]],
+    )
+
+    assert patcher.origins == {"/c": "config_overrides"}
+
+
+@pytest.mark.parametrize("layers", [{"a": 1}, ["a"], "a"])
+def test_layered_overrides_rejects_invalid_layers(layers):
+    action = _action_with_args(
+        {"src": "a.json", "dest": "/tmp/a.json", "config_type": "json"}
+        | {"config_overrides_layers": layers}
+    )
+    with pytest.raises(config_template.AnsibleActionFail, match="layers"):
+        action._load_task_args(task_vars={})
+
+
+CANONICAL_SOURCES = {
+    "json": [
+        '{"b": 1, "a": {"y": [1, 2], "x": "été"}}',
+        '{"a":{"x":"été","y":[1,2]},"b":1}',
+    ],
+    "yaml": [
+        "# comment\nb: 1\na: {y: [1, 2], x: 'été'}\n",
+        "---\na:\n    x: été  # comment\n    y:\n    - 1\n    - 2\nb: 1\n",
+    ],
+    "toml": [
+        'b = 1\n[a]\ny = [1, 2]\nx = "été"\n',
+        '# comment\nb=1\na.x="été"\na.y=[1,2]\n',
+    ],
+    "ini": [
+        "[b]\nz=1\ny = 2\n[a]\nk: v\n",
+        "; comment\n[a]\nk = v\n\n[b]\ny=2\nz =1\n",
+    ],
+}
+
+
+@pytest.mark.parametrize("config_type", sorted(CANONICAL_SOURCES))
+def test_canonical_output_is_byte_stable(config_type):
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    outputs = set()
+    for source in CANONICAL_SOURCES[config_type]:
+        args = config_template.TaskArgs(
+            config_type=config_type,
+            canonical=True,
+            json_sort_keys=False,
+            config_overrides={"b": {"n": "1"}},
+        )
+        args._patcher = config_template.compile_overrides(args.config_overrides)
+        outputs.add(action.type_merger(source, args)[0])
+
+    assert len(outputs) == 1
+
+
+def test_canonical_ini_sorts_sections_and_options():
+    config = config_template.INIConfig.from_string(
+        "# comment\n[b]\nz = 1\n[DEFAULT]\nk = v\n  cont\n"
+    )
+
+    assert config.to_canonical_string() == "[DEFAULT]\nk = v\nk = cont\n\n[b]\nz = 1\n"
+
+
+def test_canonical_rejects_json_stream():
+    action = _action_with_args(
+        {
+            "src": "a.json",
+            "dest": "/tmp/a.json",
+            "config_type": "json",
+            "render_template": False,
+            "stream": True,
+            "canonical": True,
+        }
+    )
+    with pytest.raises(config_template.AnsibleActionFail, match="canonical"):
+        action._load_task_args(task_vars={})
+
+
+def test_template_searchpath_has_no_duplicates():
+    searchpath = config_template._template_searchpath(
+        ("/play/roles/r", "/play"), "/play", "/play/roles/r/templates"
+    )
+
+    assert searchpath == (
+        "/play/roles/r/templates",
+        "/play/roles/r",
+        "/play/templates",
+        "/play",
+        "/play/roles/r/templates/templates",
+    )
+
+
+def test_find_needle_cached_per_search_path():
+    calls = []
+
+    class Task(_FakeTask):
+        def get_search_path(self):
+            return ["/play/roles/r", "/play"]
+
+    class Loader(_FakeLoader):
+        def path_dwim_relative_stack(self, paths, dirname, needle):
+            calls.append(needle)
+            return f"/play/{dirname}/{needle}"
+
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    action._task = Task({})
+    action._loader = Loader()
+    config_template._NEEDLE_CACHE.clear()
+
+    for _ in range(3):
+        assert action._find_needle("templates", "a.j2") == "/play/templates/a.j2"
+    action._find_needle("templates", "b.j2")
+
+    assert calls == ["a.j2", "b.j2"]
+
+
+def test_task_fixed_overhead_is_cached(monkeypatch):
+    """The per-task work done before rendering is resolved once per worker"""
+    task_args = {
+        "src": "a.json.j2",
+        "dest": "/etc/a.json",
+        "config_type": "json",
+        "config_overrides": {"a": 1},
+        "list_extend": "yes",
+        "json_indent": "2",
+        "mode": "0644",
+    }
+    task_vars = {"ansible_search_path": ["/play/roles/r", "/play", "/play"]}
+
+    fields_calls = []
+    fields = config_template.dataclasses.fields
+    monkeypatch.setattr(
+        config_template.dataclasses,
+        "fields",
+        lambda obj: fields_calls.append(obj) or fields(obj),
+    )
+    config_template._template_searchpath.cache_clear()
+
+    for _ in range(3):
+        args = _action_with_args(dict(task_args))._load_task_args(task_vars)
+        assert args.list_extend is True and args.json_indent == 2
+
+    # coercions were precomputed at import, the searchpath is reused
+    assert fields_calls == []
+    cache_info = config_template._template_searchpath.cache_info()
+    assert (cache_info.misses, cache_info.hits) == (1, 2)
+
+
+def test_template_vars_overlay_does_not_copy_task_vars(tmp_path):
+    template = tmp_path / "a.j2"
+    template.write_text("")
+    # 5000 hosts inventory: groups and thousands of top level vars
+    task_vars = {f"var{i}": i for i in range(3000)}
+    task_vars["groups"] = {"all": [f"host{i}" for i in range(5000)]}
+    task_vars["template_path"] = "shadowed"
+
+    tracemalloc.start()
+    try:
+        overlay = config_template.template_vars(
+            task_vars, "a.j2", str(template), "/etc/a"
+        )
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # a dict copy of task_vars alone takes ~100KiB
+    assert allocated < 16 * 1024
+    assert overlay["var42"] == 42
+    assert overlay["template_path"] == "a.j2"
+    assert overlay["template_fullpath"] == str(template)
+    overlay["var42"] = "changed"
+    assert task_vars["var42"] == 42
+
+
+def test_src_list_splits_base_and_fragments():
+    action = _action_with_args(
+        {
+            "src": ["base.json.j2", "role_a.json", "role_b.json"],
+            "dest": "/etc/a.json",
+            "config_type": "json",
+            "passthrough": True,
+        }
+    )
+
+    args = action._load_task_args(task_vars={})
+
+    assert args.src == "base.json.j2"
+    assert args._fragments == [
+        ("role_a.json", "role_a.json"),
+        ("role_b.json", "role_b.json"),
+    ]
+    assert args._passthrough is False
+
+
+@pytest.mark.parametrize(
+    "config_type,base,fragments,expected",
+    [
+        (
+            "json",
+            '{"a": {"x": 1}, "hosts": ["h1"]}',
+            ['{"a": {"y": "p,q"}}', '{"hosts": ["h2"], "b": 2}'],
+            '{"a": {"x": "9", "y": "p,q"}, "b": 2, "hosts": ["h1", "h2"]}',
+        ),
+        (
+            "yaml",
+            "a:\n  x: 1  # kept\n",
+            ["a:\n  y: p,q\n", "b: [1]\n"],
+            "a:\n  x: '9' # kept\n  y: p,q\nb:\n  - 1\n",
+        ),
+        (
+            "ini",
+            "[a]\nx = 1\n",
+            ["[a]\ny = p,q\n", "[b]\nz = 3\n"],
+            "[a]\nx = 9\ny = p,q\n\n[b]\nz = 3\n",
+        ),
+    ],
+)
+def test_src_fragments_merged_before_overrides(config_type, base, fragments, expected):
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    args = config_template.TaskArgs(
+        config_type=config_type,
+        config_overrides={"a": {"x": "9"}},
+        list_extend=True,
+        json_indent=0,
+    )
+    args._patcher = config_template.compile_overrides(args.config_overrides)
+    action._merge_fragments(
+        args, [(f"src[{idx}]", doc) for idx, doc in enumerate(fragments, 1)]
+    )
+
+    resultant, _ = action.type_merger(base, args)
+
+    assert resultant == expected
+    assert args._patcher.origins["/a/x"] == "config_overrides"
+    assert args._patcher.origins["/a/y"] == "src[1]"
+
+
+@pytest.mark.parametrize("extra", [{"remote_src": True}, {"config_type": "jsonl"}])
+def test_src_list_rejects_unsupported_modes(extra):
+    action = _action_with_args(
+        {"src": ["a.json", "b.json"], "dest": "/tmp/a.json", "config_type": "json"}
+        | extra
+    )
+    with pytest.raises(config_template.AnsibleActionFail, match="src"):
+        action._load_task_args(task_vars={})
+
+
+def test_iniparse_reentrant_in_threads():
+    import concurrent.futures
+
+    docs = [f"[s{i}]\nREM = {i}\n# comment\nopt = {i}\n" for i in range(200)]
+
+    def parse(doc):
+        return config_template.INIConfig.from_string(doc, "doc").as_dict()
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        parsed = list(executor.map(parse, docs))
+
+    assert parsed == [{f"s{i}": {"REM": str(i), "opt": str(i)}} for i in range(200)]
+
+
+def _merge_jobs():
+    jobs = []
+    for i in range(8):
+        args = config_template.TaskArgs(
+            config_type="ini" if i % 2 else "json",
+            config_overrides={"a": {"x": i}},
+            json_indent=0,
+        )
+        args._patcher = config_template.compile_overrides(args.config_overrides)
+        jobs.append((args, "[a]\ny = 1\n" if i % 2 else '{"a": {"y": 1}}'))
+    return jobs
+
+
+def test_merge_files_pool_is_opt_in(monkeypatch):
+    # every ansible fork would start a pool of controller CPUs processes
+    assert config_template.TaskArgs.from_args({"files": []}).render_workers == 1
+
+    import concurrent.futures
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("pool started")
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", no_pool)
+    monkeypatch.setattr(concurrent.futures, "ThreadPoolExecutor", no_pool)
+    assert len(config_template._merge_files(_merge_jobs())) == len(_merge_jobs())
+
+
+@pytest.mark.parametrize("pool", ["process", "thread"])
+def test_merge_files_pool_matches_sequential(pool):
+    jobs = _merge_jobs()
+    jobs.append((copy.copy(jobs[0][0]), "{broken"))
+
+    merged = config_template._merge_files(jobs, 4, pool)
+
+    assert merged[:-1] == config_template._merge_files(jobs[:-1], 1)
+    assert merged[1] == ("[a]\ny = 1\nx = 1\n", None)
+    assert merged[-1][0] is None
+    assert merged[-1][1]
+
+
+@pytest.mark.parametrize("workers,pool", [(1, "process"), (2, "thread")])
+def test_files_items_share_list_layers(workers, pool):
+    layers = [{"servers": ["a"]}, {"servers": ["b"]}]
+    task_args = {
+        "config_type": "json",
+        "json_indent": 0,
+        "list_extend": True,
+        "config_overrides_layers": layers,
+        "config_overrides": {"servers": ["c"]},
+    }
+    action = _action_with_args({"files": []})
+
+    # as _run_files(): items get the task level overrides objects
+    jobs = [
+        (action._load_task_args({}, task_args | item), '{"other": 1}')
+        for item in (
+            {"src": "a.json", "dest": "/etc/a.json"},
+            {"src": "b.json", "dest": "/etc/b.json"},
+        )
+    ]
+    merged = config_template._merge_files(jobs, workers, pool)
+
+    assert [json.loads(content) for content, _ in merged] == [
+        {"other": 1, "servers": ["a", "b", "c"]}
+    ] * 2
+    assert layers == [{"servers": ["a"]}, {"servers": ["b"]}]
+    assert task_args["config_overrides"] == {"servers": ["c"]}
+
+
+@pytest.mark.parametrize(
+    "files,extra,match",
+    [
+        ("a.ini", {}, "files"),
+        ([{"src": "a", "files": []}], {}, "files"),
+        ([{"src": "a"}], {"render_pool": "greenlet"}, "render_pool"),
+        ([{"src": "a"}], {"render_workers": -1}, "render_workers"),
+    ],
+)
+def test_files_validation(files, extra, match):
+    action = _action_with_args({"files": files} | extra)
+    with pytest.raises(config_template.AnsibleActionFail, match=match):
+        action._load_task_args(task_vars={})
+
+
+def test_files_item_args_keep_copy_arguments():
+    action = _action_with_args({"files": [], "mode": "0640"})
+    args = action._load_task_args(
+        task_vars={}, task_args={"src": "a.json", "dest": "/etc/a.json", "mode": "0600"}
+    )
+
+    assert args._copy_args == {"mode": "0600"}
+
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "server": {
+            "type": "object",
+            "properties": {"port": {"type": "integer", "maximum": 65535}},
+            "required": ["port"],
+        }
+    },
+}
+
+INI_SCHEMA = {
+    "type": "object",
+    "required": ["server"],
+    "properties": {
+        "server": {
+            "type": "object",
+            "properties": {"port": {"type": "string", "pattern": "^[0-9]+$"}},
+            "additionalProperties": False,
+        }
+    },
+}
+
+
+@pytest.mark.parametrize(
+    "config_type,source,schema",
+    [
+        ("json", '{"server": {"port": 80}}', SCHEMA),
+        ("yaml", "server:\n  port: 80  # http\n", SCHEMA),
+        ("toml", "[server]\nport = 80\n", SCHEMA),
+        ("jsonl", '{"server": {"port": 80}}\n{"server": {"port": 81}}\n', SCHEMA),
+        ("ini", "[server]\nport = 80\n", INI_SCHEMA),
+    ],
+)
+def test_schema_validates_merged_document(config_type, source, schema):
+    action = config_template.ActionModule.__new__(config_template.ActionModule)
+    action._task = _FakeTask({})
+    args = config_template.TaskArgs(config_type=config_type, dest="/etc/a")
+    args._schema = action._load_schema(schema)
+
+    args._patcher = config_template.compile_overrides({"server": {"port": 443}})
+    assert "443" in action._merge(args, source)
+
+    bad = {"port": 70000} if config_type != "ini" else {"port": "http", "x": 1}
+    args._patcher = config_template.compile_overrides({"server": bad})
+    with pytest.raises(config_template.AnsibleActionFail) as exc:
+        action._merge(args, source)
+
+    assert "/server/" in str(exc.value)
+    assert exc.value.result["schema_errors"]
+
+
+def test_schema_file_and_compile_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config_template.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    schema_file = tmp_path / "schema.yaml"
+    schema_file.write_text("type: object\nrequired: [a]\n")
+    action = _action_with_args(
+        {
+            "src": "a.json",
+            "dest": "/etc/a.json",
+            "config_type": "json",
+            "passthrough": True,
+            "render_template": False,
+            "schema": str(schema_file),
+        }
+    )
+
+    args = action._load_task_args(task_vars={})
+
+    assert args._schema == '{"required":["a"],"type":"object"}'
+    assert args._passthrough is True
+    assert args._direct_src is False  # the source is parsed for validation
+    with pytest.raises(config_template.AnsibleActionFail, match="'a' is a required"):
+        action._merge(args, "{}")
+    assert action._merge(args, '{"a": 1}') is None  # source is copied as is
+
+    validator = config_template.compile_schema(args._schema)
+    assert config_template.compile_schema(args._schema) is validator
+    assert list((tmp_path / "vooon_config_schema").iterdir())
+
+
+@pytest.mark.parametrize(
+    "extra,match",
+    [
+        ({"schema": {"type": 1}}, "not a valid JSON Schema"),
+        ({"schema": ["a"]}, "must be a JSON Schema"),
+        ({"schema": {}, "stream": True, "render_template": False}, "stream"),
+    ],
+)
+def test_schema_rejected(extra, match):
+    action = _action_with_args(
+        {"src": "a.json", "dest": "/etc/a.json", "config_type": "json"} | extra
+    )
+    with pytest.raises(config_template.AnsibleActionFail, match=match):
+        action._load_task_args(task_vars={})
+
+
+def test_render_only_file_dedups_by_hardlink(tmp_path):
+    root = tmp_path / "plan"
+    nova = tmp_path / "nova.conf"
+    nova.write_text("[DEFAULT]\nx = 1\n")
+    other = tmp_path / "other.conf"
+    other.write_text("[DEFAULT]\nx = 2\n")
+
+    results = [
+        config_template.render_only_file(
+            str(root), f"host{i}", "/etc/nova/nova.conf", str(nova)
+        )
+        for i in range(3)
+    ]
+    results.append(
+        config_template.render_only_file(
+            str(root), "host3", "/etc/nova/nova.conf", str(other)
+        )
+    )
+
+    assert all(result["changed"] for result in results)
+    assert results[0]["dest"] == str(root / "host0" / "etc" / "nova" / "nova.conf")
+    inodes = {pathlib.Path(result["dest"]).stat().st_ino for result in results}
+    assert len(inodes) == 2
+    assert len(list((root / ".objects").glob("*/*"))) == 2
+    assert (
+        root / "host1" / "etc" / "nova" / "nova.conf"
+    ).read_text() == nova.read_text()
+
+    again = config_template.render_only_file(
+        str(root), "host0", "/etc/nova/nova.conf", str(nova)
+    )
+    assert again["changed"] is False
+    moved = config_template.render_only_file(
+        str(root), "host0", "/etc/nova/nova.conf", str(other)
+    )
+    assert moved["changed"] is True
+    assert (
+        root / "host0" / "etc" / "nova" / "nova.conf"
+    ).read_text() == other.read_text()
+
+    in_dir = config_template.render_only_file(
+        str(root), "host0", "/etc/nova/", str(nova)
+    )
+    assert in_dir["dest"] == str(root / "host0" / "etc" / "nova" / "nova.conf")
+
+
+@pytest.mark.parametrize(
+    "host,dest",
+    [("..", "/etc/a"), ("host0", "/../../etc/a"), ("host0", "~/a"), ("host0", "~u/a")],
+)
+def test_render_only_file_stays_in_root(tmp_path, host, dest):
+    src = tmp_path / "a"
+    src.write_text("a")
+    with pytest.raises(config_template.AnsibleActionFail):
+        config_template.render_only_file(str(tmp_path / "plan"), host, dest, str(src))
+
+
+def test_render_only_to_does_not_connect():
+    action = _action_with_args(
+        {"src": "a.json", "dest": "/a", "render_only_to": "plan"}
+    )
+    assert action._early_needs_tmp_path() is False
+
+    action = _action_with_args(
+        {"src": "a.json", "dest": "/a", "render_only_to": "plan", "remote_src": True}
+    )
+    with pytest.raises(config_template.AnsibleActionFail, match="remote_src"):
+        action._load_task_args(task_vars={})
+
+
+def test_render_only_to_does_not_expand_remote_home(tmp_path):
+    action = _action_with_args(
+        {"src": "a.json", "dest": "~/a.json", "render_only_to": "plan"}
+    )
+
+    def expand_user(path):
+        raise AssertionError("connected to expand ~")
+
+    action._remote_expand_user = expand_user  # type: ignore[method-assign]
+    args = action._load_task_args(task_vars={})
+
+    assert args.dest == "~/a.json"
+    src = tmp_path / "a"
+    src.write_text("a")
+    with pytest.raises(config_template.AnsibleActionFail, match="remote home"):
+        config_template.render_only_file(str(tmp_path), "h1", args.dest, str(src))
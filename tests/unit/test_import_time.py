@@ -0,0 +1,75 @@
+# Copyright: (c) 2024, Sardina Systems Ltd.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Test plugins import their optional backends only on use (python -X importtime)
+"""
+
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).parent / ".." / ".."
+
+# parser/filter backends, each costs several ms per task and worker
+BACKENDS = {
+    "_jsonnet",
+    "durationpy",
+    "hjson",
+    "iniparse",
+    "jsonpatch",
+    "jsonpointer",
+    "jsonschema",
+    "oncalendar",
+    "orjson",
+    "ruamel",
+    "tomlkit",
+}
+
+
+def _imported_modules(statement: str) -> dict:
+    """Return {module: cumulative import time in us} imported by statement"""
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            # ansible itself is loaded by the worker before any plugin
+            f"import ansible.plugins.action, ansible.template\n{statement}",
+        ],
+        cwd=ROOT.absolute(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "plugins.action.config_template",
+        "plugins.action.jsonnet",
+        "plugins.filter.duration_go",
+        "plugins.filter.oncalendar_dur",
+    ],
+)
+def test_plugin_import_does_not_load_backends(module):
+    before = _imported_modules("pass")
+    imported = _imported_modules(f"import {module}")
+
+    loaded = sorted(
+        name for name in set(imported) - set(before) if name.split(".")[0] in BACKENDS
+    )
+    assert loaded == [], f"{module} imports {loaded} at load time"
@@ -0,0 +1,101 @@
+# Copyright: (c) 2024, Sardina Systems Ltd.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Test JSON backends produce byte-identical config_template output
+"""
+
+import json
+import pathlib
+import sys
+
+import pytest
+
+actions_path = pathlib.Path(__file__).parent / ".." / ".." / "plugins" / "action"
+sys.path.insert(0, str(actions_path.absolute()))
+
+import config_template  # noqa
+
+JSON_CORPUS = [
+    "{}",
+    "[]",
+    '{"b": 1, "a": [1, 2.5, -0.0, 1e16, 5e-324], "c": {"z": null, "y": true}}',
+    '{"unicode": "\\u00e9t\\u00e9 \\ud83d\\ude00", "raw": "été"}',
+    '{"big": 123456789012345678901234567890, "u64": 18446744073709551615}',
+    '{"i64": [9223372036854775807, -9223372036854775808, -9223372036854775809]}',
+    '{"neg19": -9999999999999999999, "u64over": 18446744073709551616}',
+    '{"nan": NaN, "inf": Infinity, "ninf": -Infinity}',
+    '{"dup": 1, "dup": 2}',
+    '[{"nested": [[[{"deep": "x"}]]]}, "tail"]',
+]
+
+HJSON_CORPUS = [
+    '{"strict": "json", "n": [1, 2]}',
+    "{\n  # comment\n  key: value\n  list: [1, 2]\n}",
+]
+
+
+def _action():
+    return config_template.ActionModule.__new__(config_template.ActionModule)
+
+
+@pytest.mark.parametrize("backend_name", sorted(config_template.JSON_BACKENDS))
+@pytest.mark.parametrize("json_indent", [0, 2, 4])
+@pytest.mark.parametrize("json_sort_keys", [False, True])
+@pytest.mark.parametrize("document", JSON_CORPUS)
+def test_json_backends_byte_identical(
+    backend_name, json_indent, json_sort_keys, document
+):
+    args = config_template.TaskArgs(
+        config_type="json",
+        json_indent=json_indent,
+        json_sort_keys=json_sort_keys,
+        json_backend=backend_name,
+    )
+
+    resultant, _ = _action().type_merger(document, args)
+
+    expected = json.dumps(
+        json.loads(document),
+        indent=json_indent if json_indent > 0 else None,
+        sort_keys=json_sort_keys,
+    )
+    assert resultant == expected
+
+
+@pytest.mark.parametrize("backend_name", sorted(config_template.JSON_BACKENDS))
+@pytest.mark.parametrize("document", JSON_CORPUS)
+def test_json_backends_parse_exactly(backend_name, document):
+    backend = config_template.get_json_backend(backend_name)
+    expected = json.loads(document)
+
+    for resultant in (document, document.encode("utf-8")):
+        parsed = backend.loads(resultant)
+        # NaN != NaN, compare the serialized form, which also tells int from float
+        assert json.dumps(parsed) == json.dumps(expected)
+
+
+@pytest.mark.parametrize("backend_name", sorted(config_template.JSON_BACKENDS))
+@pytest.mark.parametrize("document", HJSON_CORPUS)
+def test_hjson_tries_strict_json_first(backend_name, document):
+    args = config_template.TaskArgs(config_type="hjson", json_backend=backend_name)
+
+    resultant, merged = _action().type_merger(document, args)
+
+    hjson = pytest.importorskip("hjson")
+    assert merged == hjson.loads(document)
+    assert resultant == json.dumps(hjson.loads(document), indent=4, sort_keys=True)
+
+
+def test_json_backend_auto_prefers_orjson():
+    backend = config_template.get_json_backend("auto")
+
+    if config_template.orjson is None:
+        assert backend.name == "json"
+    else:
+        assert backend.name == "orjson"
+
+
+def test_json_backend_unknown_name_fails():
+    with pytest.raises(config_template.AnsibleActionFail, match="json_backend"):
+        config_template.get_json_backend("simdjson")
@@ -0,0 +1,90 @@
+# Copyright: (c) 2024, Sardina Systems Ltd.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Test config_template streaming JSON merge
+"""
+
+import copy
+import json
+import pathlib
+import sys
+from io import StringIO
+
+import pytest
+
+actions_path = pathlib.Path(__file__).parent / ".." / ".." / "plugins" / "action"
+sys.path.insert(0, str(actions_path.absolute()))
+
+import config_template  # noqa
+
+DOCUMENT = {
+    "allow": [{"cidr": "10.0.0.0/24", "id": 1}, {"cidr": "10.0.1.0/24", "id": 2}],
+    "meta": {"version": 1, "tags": ["a"], "owner": "été"},
+    "scalar": 1.5e300,
+    "empty": {},
+    "flags": [True, False, None],
+}
+
+OVERRIDES = [
+    None,
+    {},
+    {"meta": {"version": 2}},
+    {"meta": {"tags": ["b", "c"], "new": {"deep": "x,y"}}},
+    {"allow": [{"cidr": "192.168.0.0/16", "id": 3}]},
+    {"scalar": ["now", "list"], "flags": "x\ny", "empty": {}},
+]
+
+
+@pytest.fixture(params=[1, 3, 64, 1 << 16])
+def chunk_size(request, monkeypatch):
+    monkeypatch.setattr(config_template.JsonStreamReader, "chunk_size", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize("indent", [None, 2, 4])
+@pytest.mark.parametrize("list_extend", [False, True])
+@pytest.mark.parametrize("overrides", OVERRIDES)
+def test_stream_merge_json_matches_simple_merger(
+    chunk_size, indent, list_extend, overrides
+):
+    source = json.dumps(DOCUMENT, indent=1, ensure_ascii=False)
+
+    merger = None
+    expected = copy.deepcopy(DOCUMENT)
+    if overrides is not None:
+        merger = config_template.SimpleMerger(
+            new_items=copy.deepcopy(overrides), list_extend=list_extend
+        )
+        expected = config_template.SimpleMerger(
+            new_items=copy.deepcopy(overrides), list_extend=list_extend
+        ).apply(expected)
+
+    out = StringIO()
+    config_template.stream_merge_json(StringIO(source), out, merger, indent)
+
+    assert out.getvalue() == json.dumps(expected, indent=indent)
+
+
+@pytest.mark.parametrize(
+    "source",
+    ['{"a": 1', '{"a" 1}', "[1,]", '{"a": 1}}', "", "tru", "[1 2]"],
+)
+def test_stream_merge_json_rejects_broken_documents(source):
+    with pytest.raises(config_template.AnsibleActionFail):
+        config_template.stream_merge_json(StringIO(source), StringIO(), None)
+
+
+def test_stream_merge_jsonl_applies_overrides_per_document():
+    source = '{"host": "a", "tags": ["x"]}\n\n{"host": "b"}\n'
+    merger = config_template.SimpleMerger(
+        new_items={"tags": ["y"], "env": "prod"}, list_extend=True
+    )
+
+    out = StringIO()
+    config_template.stream_merge_jsonl(StringIO(source), out, merger.apply)
+
+    assert out.getvalue() == (
+        '{"host": "a", "tags": ["x", "y"], "env": "prod"}\n'
+        '{"host": "b", "tags": ["y"], "env": "prod"}\n'
+    )
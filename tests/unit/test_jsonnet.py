@@ -5,11 +5,14 @@
 Test jsonnet module/action plugin basics
 """
 
+import json
+import os
+import time
 from pathlib import Path
 
 import pytest
 import yaml
-from ansible.errors import AnsibleError
+from ansible.errors import AnsibleActionFail, AnsibleError
 
 from plugins.action import jsonnet as action_jsonnet
 from plugins.modules import jsonnet as module_jsonnet
@@ -20,7 +23,22 @@ def test_jsonnet_module_documentation_schema():
 
     assert doc["module"] == "jsonnet"
     assert doc["version_added"] == "2.6.0"
-    assert sorted(doc["options"]["format"]["choices"]) == ["json", "yaml"]
+    assert sorted(doc["options"]["format"]["choices"]) == [
+        "env",
+        "ini",
+        "json",
+        "toml",
+        "yaml",
+        "yaml_stream",
+    ]
+
+
+class _FakeTask:
+    def __init__(self, search_path):
+        self.search_path = search_path
+
+    def get_search_path(self):
+        return self.search_path
 
 
 def test_import_callback_returns_file_content(tmp_path: Path):
@@ -30,6 +48,7 @@ def test_import_callback_returns_file_content(tmp_path: Path):
     target.write_bytes(b"{ x: 1 }")
 
     module = action_jsonnet.ActionModule.__new__(action_jsonnet.ActionModule)
+    module._task = _FakeTask([])  # type: ignore[attr-defined]
 
     def find_needle(base: str, rel: str) -> str:
         candidate = Path(base) / rel
@@ -47,6 +66,7 @@ def test_import_callback_returns_file_content(tmp_path: Path):
 
 def test_import_callback_raises_when_missing(tmp_path: Path):
     module = action_jsonnet.ActionModule.__new__(action_jsonnet.ActionModule)
+    module._task = _FakeTask([])  # type: ignore[attr-defined]
 
     def find_needle(base: str, rel: str) -> str:
         raise AnsibleError(f"not found: {base}/{rel}")
@@ -55,3 +75,642 @@ def test_import_callback_raises_when_missing(tmp_path: Path):
 
     with pytest.raises(AnsibleError, match="Unable to find"):
         module.import_callback([str(tmp_path)], "missing.libsonnet")
+
+
+def test_import_callback_caches_resolution_and_content(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(action_jsonnet.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(
+        action_jsonnet, "IMPORT_CACHE", action_jsonnet.RunCache("jsonnet_import")
+    )
+    monkeypatch.setattr(action_jsonnet, "_CONTENT_CACHE", {})
+    lib = tmp_path / "lib"
+    lib.mkdir()
+    (lib / "grafonnet.libsonnet").write_bytes(b"{ grafana: 1 }")
+    calls = []
+
+    def find_needle(base: str, rel: str) -> str:
+        calls.append((base, rel))
+        candidate = Path(base) / rel
+        if candidate.exists():
+            return str(candidate)
+        raise AnsibleError(f"not found: {candidate}")
+
+    def action():
+        module = action_jsonnet.ActionModule.__new__(action_jsonnet.ActionModule)
+        module._task = _FakeTask([str(tmp_path)])  # type: ignore[attr-defined]
+        module._find_needle = find_needle  # type: ignore[attr-defined]
+        return module
+
+    dirs = [str(tmp_path / "missing"), str(lib)]
+    first = action().import_callback(dirs, "grafonnet.libsonnet")
+    (lib / "grafonnet.libsonnet").write_bytes(b"changed")  # read once per worker
+    # as in a new fork, the resolution is loaded from the run cache dir
+    action_jsonnet.IMPORT_CACHE.clear()
+    second = action().import_callback(dirs, "grafonnet.libsonnet")
+
+    assert first == (str(lib / "grafonnet.libsonnet"), b"{ grafana: 1 }")
+    assert second == first
+    assert len(calls) == 2  # both dirs were searched once
+
+
+def test_import_cache_key_has_search_path(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(action_jsonnet.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(
+        action_jsonnet, "IMPORT_CACHE", action_jsonnet.RunCache("jsonnet_import")
+    )
+    for role in ("a", "b"):
+        (tmp_path / role / "templates").mkdir(parents=True)
+        (tmp_path / role / "templates" / "lib.libsonnet").write_text(role)
+
+    def action(role: str):
+        def find_needle(base: str, rel: str) -> str:
+            # like path_dwim_relative_stack(): falls back to the role dir
+            if os.path.isabs(base) and (Path(base) / rel).exists():
+                return str(Path(base) / rel)
+            return str(tmp_path / role / "templates" / rel)
+
+        module = action_jsonnet.ActionModule.__new__(action_jsonnet.ActionModule)
+        module._task = _FakeTask([str(tmp_path / role)])  # type: ignore[attr-defined]
+        module._find_needle = find_needle  # type: ignore[attr-defined]
+        return module
+
+    for d in ("templates", str(tmp_path / "shared")):
+        assert action("a")._find_import(d, "lib.libsonnet") == str(
+            tmp_path / "a" / "templates" / "lib.libsonnet"
+        )
+        assert action("b")._find_import(d, "lib.libsonnet") == str(
+            tmp_path / "b" / "templates" / "lib.libsonnet"
+        )
+
+
+def test_read_source_decrypts_once(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(action_jsonnet, "_SOURCE_CACHE", {})
+    source = tmp_path / "node.jsonnet"
+    source.write_text("{ a: 1 }")
+    calls = []
+
+    class _FakeLoader:
+        def get_real_file(self, path):
+            calls.append(path)
+            return path
+
+        def cleanup_tmp_file(self, path):
+            pass
+
+    module = action_jsonnet.ActionModule.__new__(action_jsonnet.ActionModule)
+    module._loader = _FakeLoader()  # type: ignore[attr-defined]
+
+    assert module._read_source(str(source)) == "{ a: 1 }"
+    assert module._read_source(str(source)) == "{ a: 1 }"
+    assert calls == [str(source)]
+
+
+def test_ext_var_names():
+    assert action_jsonnet.ext_var_names("std.extVar('a') + std.extVar(\"b.c\")") == {
+        "a",
+        "b.c",
+    }
+    assert action_jsonnet.ext_var_names("{ a: 1 }") == frozenset()
+    assert action_jsonnet.ext_var_names("std.extVar(name)") is None
+    assert action_jsonnet.ext_var_names("local ev = std.extVar; ev('a')") is None
+
+
+def _eval_action(tmp_path: Path):
+    module = action_jsonnet.ActionModule.__new__(action_jsonnet.ActionModule)
+    module._task = _FakeTask([str(tmp_path)])  # type: ignore[attr-defined]
+
+    def find_needle(base: str, rel: str) -> str:
+        candidate = Path(base) / rel
+        if candidate.exists():
+            return str(candidate)
+        raise AnsibleError(f"not found: {candidate}")
+
+    module._find_needle = find_needle  # type: ignore[attr-defined]
+    module._templar = None  # type: ignore[attr-defined]
+    return module
+
+
+def test_evaluate_cache_keys_on_read_ext_vars_and_imports(tmp_path: Path, monkeypatch):
+    pytest.importorskip("_jsonnet")
+    monkeypatch.setattr(action_jsonnet, "_CONTENT_CACHE", {})
+    monkeypatch.setattr(action_jsonnet, "_DIGEST_CACHE", {})
+    (tmp_path / "lib.libsonnet").write_text("{ region: std.extVar('region') }")
+    source = str(tmp_path / "a.jsonnet")
+    code = "local lib = import 'lib.libsonnet'; { env: std.extVar('env') } + lib"
+    cache = action_jsonnet.RunCache("jsonnet_eval", root=str(tmp_path / "cache"))
+    evaluated = []
+
+    module = _eval_action(tmp_path)
+    original = action_jsonnet.optional_import("_jsonnet").evaluate_snippet
+
+    def evaluate_snippet(*args, **kwargs):
+        # only the ext vars read by the template and its imports are passed
+        evaluated.append("/".join(v for _, v in sorted(kwargs["ext_vars"].items())))
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(
+        action_jsonnet.optional_import("_jsonnet"),
+        "evaluate_snippet",
+        evaluate_snippet,
+        raising=False,
+    )
+
+    def run(host, env="prod", region="r1"):
+        temp_vars = {"inventory_hostname": host, "env": env, "region": region}
+        return json.loads(module._evaluate(source, code, temp_vars, "templates", cache))
+
+    assert run("h1") == {"env": "prod", "region": "r1"}
+    assert run("h2") == {"env": "prod", "region": "r1"}  # host vars are not read
+    assert run("h3", env="dev") == {"env": "dev", "region": "r1"}
+    assert run("h4", region="r2") == {"env": "prod", "region": "r2"}  # var of an import
+    assert evaluated == ["prod/r1", "dev/r1", "prod/r2"]
+
+    # persisted: a new run (empty memory, same dir) reuses results
+    cache = action_jsonnet.RunCache("jsonnet_eval", root=str(tmp_path / "cache"))
+    assert run("h5", env="dev") == {"env": "dev", "region": "r1"}
+    assert evaluated == ["prod/r1", "dev/r1", "prod/r2"]
+
+    # changed import content invalidates results
+    (tmp_path / "lib.libsonnet").write_text("{ region: 'fixed' }")
+    monkeypatch.setattr(action_jsonnet, "_CONTENT_CACHE", {})
+    monkeypatch.setattr(action_jsonnet, "_DIGEST_CACHE", {})
+    assert run("h6") == {"env": "prod", "region": "fixed"}
+    assert evaluated == ["prod/r1", "dev/r1", "prod/r2", "prod"]
+
+
+def test_persisted_eval_cache_is_json_in_private_dir(tmp_path: Path):
+    pytest.importorskip("_jsonnet")
+    root = tmp_path / "cache"
+    cache = action_jsonnet.RunCache("jsonnet_eval", root=str(root))
+    cache.verify_root()
+    source = str(tmp_path / "a.jsonnet")
+
+    module = _eval_action(tmp_path)
+    module._evaluate(source, "{ a: std.extVar('a') }", {"a": "1"}, "templates", cache)
+
+    entries = list(Path(cache.path).iterdir())
+    assert len(entries) == 2  # manifest and result
+    for entry in entries:
+        json.loads(entry.read_bytes())  # never unpickled
+
+    root.chmod(0o777)
+    shared = action_jsonnet.RunCache("jsonnet_eval", root=str(root))
+    with pytest.raises(AnsibleActionFail, match="not writable by group or others"):
+        shared.verify_root()
+    with pytest.raises(KeyError):
+        shared.get(entries[0].name)
+
+
+def test_persisted_eval_cache_resolves_imports_again(tmp_path: Path, monkeypatch):
+    pytest.importorskip("_jsonnet")
+    monkeypatch.setattr(action_jsonnet.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(action_jsonnet, "_CONTENT_CACHE", {})
+    monkeypatch.setattr(action_jsonnet, "_DIGEST_CACHE", {})
+    (tmp_path / "src").mkdir()
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "common.libsonnet").write_text("{ v: 'lib' }")
+    source = str(tmp_path / "src" / "a.jsonnet")
+    code = "import 'common.libsonnet'"
+
+    def run(run_id):
+        # a new run: run scoped caches are empty, the persisted one is kept
+        monkeypatch.setattr(
+            action_jsonnet, "IMPORT_CACHE", action_jsonnet.RunCache(run_id)
+        )
+        cache = action_jsonnet.RunCache("jsonnet_eval", root=str(tmp_path / "cache"))
+        result = _eval_action(tmp_path)._evaluate(
+            source, code, {}, str(tmp_path / "lib"), cache
+        )
+        return json.loads(result)
+
+    assert run("run1") == {"v": "lib"}
+    # a file next to the source now shadows the include_dir one
+    (tmp_path / "src" / "common.libsonnet").write_text("{ v: 'src' }")
+    assert run("run2") == {"v": "src"}
+
+
+def test_evaluate_cache_skips_computed_ext_vars(tmp_path: Path):
+    pytest.importorskip("_jsonnet")
+    module = _eval_action(tmp_path)
+    cache = action_jsonnet.RunCache("jsonnet_eval", root=str(tmp_path / "cache"))
+    code = "{ v: std.extVar(std.extVar('name')) }"
+
+    first = module._evaluate(
+        str(tmp_path / "a.jsonnet"),
+        code,
+        {"name": "a", "a": "1", "b": "2"},
+        "templates",
+        cache,
+    )
+    assert json.loads(first) == {"v": "1"}
+    assert not (tmp_path / "cache").exists()
+
+
+def test_run_cache_evicts_least_recently_used(tmp_path: Path):
+    cache = action_jsonnet.RunCache("eviction", root=str(tmp_path), max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    os.utime(Path(cache.path) / "a", ns=(1, 1))
+    os.utime(Path(cache.path) / "b", ns=(2, 2))
+    action_jsonnet.RunCache("eviction", root=str(tmp_path), max_entries=2).get(
+        "a"
+    )  # touch
+    cache.set("c", 3)
+
+    assert sorted(os.listdir(cache.path)) == ["a", "c"]
+
+
+def test_split_outputs_formats_per_file():
+    outputs = dict(
+        action_jsonnet.split_outputs(
+            {
+                "b.yaml": {"groups": [{"name": "a"}]},
+                "a.json": {"x": [1]},
+                "c.yaml": "raw: 1\n",
+                "d.conf": {"y": 2},
+                "e.env": {"Y": 2},
+            },
+            "json",
+        )
+    )
+
+    assert list(outputs) == ["a.json", "b.yaml", "c.yaml", "d.conf", "e.env"]
+    assert outputs["e.env"] == "Y=2\n"
+    assert outputs["a.json"] == '{\n   "x": [\n      1\n   ]\n}\n'
+    assert yaml.safe_load(outputs["b.yaml"]) == {"groups": [{"name": "a"}]}
+    assert outputs["c.yaml"] == "raw: 1\n"  # manifested strings are kept
+    assert outputs["d.conf"] == '{\n   "y": 2\n}\n'
+    assert action_jsonnet.split_outputs({"d.conf": {"y": 2}}, "yaml") == [
+        ("d.conf", "y: 2\n")
+    ]
+
+
+def test_json_outputs_match_jsonnet_formatting(monkeypatch):
+    _jsonnet = pytest.importorskip("_jsonnet")
+    code = """{ "a.json": {
+      e: {}, l: [], f: 0.1, x: 1.5e-7, i: 2.0, n: 1e20, ni: [[], {}, -3.25],
+      s: "ü\\t\\u007f\\u0085 {}", k: { "[]": "a\\": {}", "1.5": 1.5 },
+    } }"""
+    raw = _jsonnet.evaluate_snippet("<test>", code)
+    expected = _jsonnet.evaluate_snippet("<test>", code + '["a.json"]')
+    decoded = json.loads(raw)
+
+    def evaluate_snippet(*args, **kwargs):
+        raise AssertionError("JSON is formatted in-process")
+
+    with monkeypatch.context() as m:
+        m.setattr(_jsonnet, "evaluate_snippet", evaluate_snippet)
+        outputs = action_jsonnet.split_outputs(decoded, "json")
+    assert outputs == [("a.json", expected)]
+    assert '"e": { }' in expected and '"f": 0.10000000000000001' in expected
+
+    with monkeypatch.context() as m:
+        m.setattr(_jsonnet, "evaluate_snippet", evaluate_snippet)
+        merged = action_jsonnet.merge_document(
+            json.loads(expected), "json", {"b": {}, "A": 0.1}
+        )
+    assert merged == _jsonnet.evaluate_snippet(
+        "<test>", code + '["a.json"] + { b: {}, A: 0.1 }'
+    )
+
+
+@pytest.mark.parametrize(
+    "result_obj", [[1], {"../a.json": {}}, {"a/b.json": {}}, {"": {}}]
+)
+def test_split_outputs_rejects_non_file_names(result_obj):
+    with pytest.raises(action_jsonnet.AnsibleActionFail):
+        action_jsonnet.split_outputs(result_obj, "json")
+
+
+def test_native_filters(tmp_path: Path):
+    pytest.importorskip("_jsonnet")
+    module = _eval_action(tmp_path)
+    code = """
+    local port = std.native('port');
+    {
+      port: port('api.bind'),
+      again: port('api.bind'),
+      url: std.native('url_replace')('http://api:80/v1', 'x', null, 'api.bind'),
+      noport: std.native('url_replace')('http://api:80/v1', null, '/v2', false),
+      sec: std.native('dur2sec')('1m30s'),
+      durs: std.map(std.native('sec2dur'), [90, 3600]),
+      cal: std.native('oncalendar_dur')('hourly', '2024-01-01T00:00:00', 2),
+    }
+    """
+    temp_vars = {
+        "ports": {"api": {"bind_port": 8080}},
+        "ports_overrides": {"api": {"bind": 9090}},
+    }
+
+    result = json.loads(
+        module._evaluate(
+            str(tmp_path / "a.jsonnet"), code, temp_vars, "templates", None
+        )
+    )
+
+    assert result == {
+        "port": 9090,
+        "again": 9090,
+        "url": "http://api:9090/v1/x",
+        "noport": "http://api/v2",
+        "sec": 90,
+        "durs": ["1m30s", "1h"],
+        "cal": [3600, 3600],
+    }
+
+
+def test_native_filters_key_the_evaluation_cache(tmp_path: Path):
+    pytest.importorskip("_jsonnet")
+    module = _eval_action(tmp_path)
+    cache = action_jsonnet.RunCache("jsonnet_eval", root=str(tmp_path / "cache"))
+    source = str(tmp_path / "a.jsonnet")
+    code = "{ port: std.native('port')('api.bind') }"
+
+    def run(port):
+        temp_vars = {"ports": {"api": {"bind": port}}}
+        return json.loads(module._evaluate(source, code, temp_vars, "templates", cache))
+
+    assert run(80) == {"port": 80}
+    assert run(81) == {"port": 81}
+
+    natives = action_jsonnet.NativeFilters({})
+    callbacks = natives.callbacks()
+    callbacks["oncalendar_dur"][1]("hourly", None, 1)
+    assert natives.pure is False
+
+
+@pytest.mark.parametrize(
+    "snippet",
+    [
+        '{a: [1, 2.5, "yes", null, true, {}], b: {c: "x\\ny", d: 1e20, f: "\u00fc"}}',
+        "std.manifestYamlDoc({a: [1, {b: 2}], c: 'yes'})",
+        "'plain string'",
+        "[1, '2', {a: {b: [[]]}}]",
+    ],
+)
+def test_format_output_matches_reparse(snippet):
+    _jsonnet = pytest.importorskip("_jsonnet")
+    resultant = _jsonnet.evaluate_snippet("x", snippet)
+    decoded = json.loads(resultant)
+
+    assert action_jsonnet.format_output(resultant, "json") == (
+        decoded if isinstance(decoded, str) else resultant
+    )
+    # the former json -> yaml text -> yaml load -> dump pipeline
+    reparsed = action_jsonnet._yaml().load(
+        decoded if isinstance(decoded, str) else resultant
+    )
+    assert action_jsonnet.format_output(resultant, "yaml") == action_jsonnet.dump_yaml(
+        [reparsed]
+    )
+
+
+def test_format_output_yaml_streams():
+    _jsonnet = pytest.importorskip("_jsonnet")
+    manifested = _jsonnet.evaluate_snippet(
+        "x", "std.manifestYamlStream([{a: 1}, {b: [2]}])"
+    )
+    array = _jsonnet.evaluate_snippet("x", "[{a: 1}, {b: [2]}]")
+
+    stream = action_jsonnet.format_output(manifested, "yaml")
+
+    assert list(yaml.safe_load_all(stream)) == [{"a": 1}, {"b": [2]}]
+    assert stream.startswith("---\n")
+    assert action_jsonnet.format_output(array, "yaml_stream") == stream
+    with pytest.raises(action_jsonnet.AnsibleActionFail, match="array"):
+        action_jsonnet.format_output('{"a": 1}', "yaml_stream")
+
+
+class _FakeTemplar:
+    """Renders "{{ name }}" strings from vars, enough for the var native"""
+
+    def __init__(self, temp_vars):
+        self.temp_vars = temp_vars
+
+    def template(self, value):
+        if isinstance(value, str) and value.startswith("{{"):
+            return self.temp_vars[value.strip("{} ")]
+        if isinstance(value, dict):
+            return {k: self.template(v) for k, v in value.items()}
+        return value
+
+
+def test_var_native_returns_typed_templated_values(tmp_path: Path):
+    pytest.importorskip("_jsonnet")
+    module = _eval_action(tmp_path)
+    cache = action_jsonnet.RunCache("jsonnet_eval", root=str(tmp_path / "cache"))
+    code = (
+        "local var = std.native('var'); { cfg: var('cfg'), n: var('cfg').replicas + 1 }"
+    )
+
+    def run(replicas):
+        temp_vars = {
+            "cfg": {"replicas": "{{ replicas }}", "tags": ["a"]},
+            "replicas": replicas,
+        }
+        module._templar = _FakeTemplar(temp_vars)
+        return json.loads(
+            module._evaluate(
+                str(tmp_path / "a.jsonnet"), code, temp_vars, "templates", cache
+            )
+        )
+
+    assert run(2) == {"cfg": {"replicas": 2, "tags": ["a"]}, "n": 3}
+    # the rendered value keys the cache, not the "{{ replicas }}" template
+    assert run(5) == {"cfg": {"replicas": 5, "tags": ["a"]}, "n": 6}
+
+    with pytest.raises(RuntimeError, match="Undefined variable: nope"):
+        module._evaluate(
+            str(tmp_path / "b.jsonnet"),
+            "std.native('var')('nope')",
+            {},
+            "templates",
+            None,
+        )
+
+
+def test_ext_var_scan_follows_import_closure(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(action_jsonnet, "_CONTENT_CACHE", {})
+    module = _eval_action(tmp_path)
+    (tmp_path / "a.libsonnet").write_text(
+        "local b = import @'b.libsonnet'; { a: std.extVar('a'), b: b }"
+    )
+    (tmp_path / "b.libsonnet").write_text(
+        "{ b: std.extVar('b'), c: importstr 'c.txt', d: importbin @\"c.txt\","
+        ' a:: import \'a.libsonnet\', v: import @"v""q.libsonnet" }'
+    )
+    (tmp_path / "c.txt").write_text("std.extVar('not_code')")
+    (tmp_path / 'v"q.libsonnet').write_text("{ v: std.extVar('v') }")
+    source = str(tmp_path / "main.jsonnet")
+
+    code = "local a = import 'a.libsonnet'; a + { m: std.extVar('m') }"
+    assert module._ext_var_scan(source, code, "templates") == (
+        {"a", "b", "m", "v"},
+        True,
+    )
+    if action_jsonnet.optional_import("_jsonnet") is not None:
+        temp_vars = {"a": "1", "b": "2", "m": "3", "v": "4", "unread": "5"}
+        result = json.loads(
+            module._evaluate(source, code, temp_vars, "templates", None)
+        )
+        assert result["b"]["v"] == {"v": "4"}
+
+    # imports the scan can not follow leave the names incomplete
+    for unknown in (
+        "// import 'missing.libsonnet'\n",
+        "local t = import |||\n  a.libsonnet\n|||;\n",
+        "local e = import 'a\\u002elibsonnet';\n",
+    ):
+        assert module._ext_var_scan(source, unknown + code, "templates") == (
+            {"a", "b", "m", "v"},
+            False,
+        )
+
+    (tmp_path / "b.libsonnet").write_text("{ b: std.extVar(std.extVar('name')) }")
+    action_jsonnet._CONTENT_CACHE.pop(str(tmp_path / "b.libsonnet"), None)
+    assert module._ext_var_scan(source, code, "templates") == (
+        {"a", "m", "name"},
+        False,
+    )
+
+
+def test_unscanned_ext_vars_are_passed_on_demand(tmp_path: Path, monkeypatch):
+    _jsonnet = pytest.importorskip("_jsonnet")
+    module = _eval_action(tmp_path)
+    source = str(tmp_path / "main.jsonnet")
+    code = "// import 'missing.libsonnet'\nlocal n = 'e' + 'nv'; { env: std.extVar(n) }"
+    passed = []
+    original = _jsonnet.evaluate_snippet
+
+    def evaluate_snippet(*args, **kwargs):
+        passed.append(sorted(kwargs["ext_vars"]))
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(_jsonnet, "evaluate_snippet", evaluate_snippet)
+    temp_vars = {"env": "prod", "groups": {"all": ["h1"]}, "unread": "x"}
+
+    result = module._evaluate(source, code, temp_vars, "templates", None)
+
+    assert json.loads(result) == {"env": "prod"}
+    assert passed == [[], ["env"]]  # never every var
+
+    with pytest.raises(RuntimeError, match="undefined external variable: enope"):
+        module._evaluate(source, code.replace("'nv'", "'nope'"), {}, "templates", None)
+
+
+def test_run_limited():
+    assert action_jsonnet.run_limited(lambda: {"a": [1]}, timeout=10) == {"a": [1]}
+
+    with pytest.raises(AnsibleActionFail, match="ZeroDivisionError"):
+        action_jsonnet.run_limited(lambda: 1 / 0, timeout=10)
+
+    with pytest.raises(AnsibleActionFail, match="timed out after 0.2 seconds"):
+        action_jsonnet.run_limited(lambda: time.sleep(30), timeout=0.2)
+
+    rss = action_jsonnet._worker_rss(os.getpid())
+    if rss is None:
+        pytest.skip("no RSS of processes")
+
+    def grow():
+        data = b"x" * (256 << 20)
+        time.sleep(30)
+        return len(data)
+
+    with pytest.raises(AnsibleActionFail, match="exceeded memory limit"):
+        action_jsonnet.run_limited(grow, timeout=20, max_memory=rss + (64 << 20))
+
+
+def test_evaluate_with_limits(tmp_path: Path, monkeypatch):
+    pytest.importorskip("_jsonnet")
+    module = _eval_action(tmp_path)
+    (tmp_path / "lib.libsonnet").write_text("{ env: std.native('var')('env') }")
+    cache = action_jsonnet.RunCache("jsonnet_eval", root=str(tmp_path / "cache"))
+    source = str(tmp_path / "a.jsonnet")
+    code = "import 'lib.libsonnet'"
+
+    def run(code=code, options=None, cache=cache):
+        return module._evaluate(
+            source, code, {"env": "prod"}, "templates", cache, options, 10, 1 << 30
+        )
+
+    assert json.loads(run()) == {"env": "prod"}
+
+    # the worker recorded imports and natives state for the cache
+    def no_worker(*args):
+        raise AssertionError("not cached")
+
+    monkeypatch.setattr(action_jsonnet, "run_limited", no_worker)
+    assert json.loads(run()) == {"env": "prod"}
+    monkeypatch.undo()
+
+    with pytest.raises(AnsibleActionFail, match="max stack frames exceeded"):
+        run(
+            "local f(n) = if n == 0 then 0 else 1 + f(n - 1); f(100)",
+            {"max_stack": 20},
+            None,
+        )
+
+    with pytest.raises(AnsibleActionFail, match="timed out"):
+        module._evaluate(
+            source,
+            "std.foldl(function(a, b) a + b, std.range(0, 1e9), 0)",
+            {},
+            "templates",
+            None,
+            timeout=0.5,
+        )
+
+
+def test_merge_document_ini_and_toml():
+    pytest.importorskip("iniparse")
+    tomlkit = pytest.importorskip("tomlkit")
+    document = {"main": {"port": 80, "hosts": ["a", "b"]}, "log": "info"}
+
+    ini = action_jsonnet.merge_document(
+        document, "ini", {"main": {"port": 8080}, "extra": {"x": 1}}
+    )
+    assert "[main]\nport = 8080\nhosts = a,b\n" in ini
+    assert "[DEFAULT]\nlog = info\n" in ini
+    assert "[extra]\nx = 1\n" in ini
+    # manifested INI text is parsed by the engine
+    assert (
+        action_jsonnet.merge_document("[s]\na = 1\n", "ini", {"s": {"b": 2}})
+        == "[s]\na = 1\nb = 2\n"
+    )
+
+    toml = action_jsonnet.merge_document(
+        document, "toml", [{"op": "replace", "path": "/main/port", "value": 8080}]
+    )
+    assert tomlkit.loads(toml) == {
+        "main": {"port": 8080, "hosts": ["a", "b"]},
+        "log": "info",
+    }
+
+    with pytest.raises(AnsibleActionFail, match="object of sections"):
+        action_jsonnet.merge_document([1], "ini")
+
+
+def test_merge_document_env_and_overrides():
+    env = action_jsonnet.merge_document(
+        {"A": "x y", "B": 3, "C": [1, 2], "D": None, "E": False, "F": "it's"},
+        "env",
+        {"B": 4, "G": "new"},
+    )
+    assert env == "A='x y'\nB=4\nC='[1,2]'\nE=false\nF='it'\"'\"'s'\nG=new\n"
+
+    with pytest.raises(AnsibleActionFail, match="not an environment variable name"):
+        action_jsonnet.merge_document({"A-B": 1}, "env")
+
+    stream = action_jsonnet.merge_document(
+        [{"a": [1]}, {"a": [2]}], "yaml_stream", {"a": [3]}, list_extend=True
+    )
+    assert list(yaml.safe_load_all(stream)) == [{"a": [1, 3]}, {"a": [2, 3]}]
+
+    assert json.loads(
+        action_jsonnet.merge_document(
+            {"a": 1, "b": 2}, "json", [{"op": "remove", "path": "/b"}]
+        )
+    ) == {"a": 1}
+
+    with pytest.raises(AnsibleActionFail, match="not to a manifested string"):
+        action_jsonnet.merge_document("a: 1\n", "yaml", {"b": 2})